@@ -231,7 +231,10 @@ class base_client_job(base_job.base_job):
             # send the entry to stdout, if it's enabled
             logging.info(rendered_entry)
         self._logger = base_job.status_logger(
-            self, status_indenter(self), record_hook=client_job_record_hook)
+            self, status_indenter(self), record_hook=client_job_record_hook,
+            max_flush_delay=GLOBAL_CONFIG.get_config_value(
+                    'CLIENT', 'status_log_max_flush_delay', type=float,
+                    default=0))
 
 
     def _post_record_init(self, control, options, drop_caches):
@@ -808,6 +811,8 @@ class base_client_job(base_job.base_job):
         # installed unload it first
         utils.system("modprobe -r netconsole", ignore_status=True)
 
+        # write out the status logs, synced below
+        self._logger.flush()
         # sync first, so that a sync during shutdown doesn't time out
         utils.system("sync; sync", ignore_status=True)
 
@@ -1284,6 +1289,8 @@ class job(base_client_job):
         self.reboot_setup()
         self.harness.run_reboot()
 
+        # write out the status logs, synced below
+        self._logger.flush()
         # sync first, so that a sync during shutdown doesn't time out
         utils.system('sync; sync', ignore_status=True)
 
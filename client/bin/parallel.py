@@ -3,11 +3,13 @@
 __author__ = """Copyright Andy Whitcroft 2006"""
 
 import sys, logging, os, pickle, traceback, gc, time
-from autotest_lib.client.common_lib import error, utils
+from autotest_lib.client.common_lib import base_job, error, utils
 
 def fork_start(tmp, l):
     sys.stdout.flush()
     sys.stderr.flush()
+    # the status lines buffered so far go before the child's
+    base_job.flush_status_loggers(sync=False)
     pid = os.fork()
     if pid:
         # Parent
@@ -40,6 +42,8 @@ def fork_start(tmp, l):
                 sys.stdout.flush()
                 sys.stderr.flush()
         finally:
+            # os._exit skips the exit handlers writing out the status logs
+            base_job.flush_status_loggers()
             # clear exception information to allow garbage collection of
             # objects referenced by the exception's traceback
             sys.exc_clear()
@@ -47,6 +51,7 @@ def fork_start(tmp, l):
             os._exit(1)
     else:
         try:
+            base_job.flush_status_loggers()
             sys.stdout.flush()
             sys.stderr.flush()
         finally:
@@ -0,0 +1,205 @@
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""This throttler removes files with exactly the same content as another result
+file, for example, copies of system logs collected in multiple iterations.
+
+Candidate files are grouped by size first, then by a hash of their first chunk,
+and only files still colliding are hashed in full. One file of each group of
+duplicates is kept. The others are deleted and recorded in a manifest file in
+the result directory, mapping each deleted file to the file kept, so no unique
+data is lost.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import throttler_lib
+import utils_lib
+
+
+# Name of the manifest file mapping the path of each deleted duplicate to the
+# path of the file with the same content, both relative to the result
+# directory.
+MANIFEST_FILE_NAME = 'content_dedupe_manifest.json'
+
+# Default threshold of file size in byte for it to be qualified for deduping.
+# Smaller files are not worth an entry in the manifest.
+DEFAULT_FILE_SIZE_THRESHOLD_BYTE = 4 * 1024
+
+# Size of the chunk to hash to tell apart files with the same size.
+HASH_CHUNK_SIZE_BYTE = 64 * 1024
+
+# Size of the block to read when hashing a whole file.
+HASH_READ_SIZE_BYTE = 1024 * 1024
+
+
+def _hash_file(path, max_size_byte=None):
+    """Get the hash of a file's content.
+
+    @param path: Path to the file.
+    @param max_size_byte: Maximum number of bytes to hash from the start of the
+            file, None to hash the whole file.
+    @return: The hex digest of the content, or None if the file can't be read.
+    """
+    sha1 = hashlib.sha1()
+    remaining = max_size_byte
+    try:
+        with open(path, 'rb') as f:
+            while remaining is None or remaining > 0:
+                read_size = HASH_READ_SIZE_BYTE
+                if remaining is not None:
+                    read_size = min(read_size, remaining)
+                    remaining -= read_size
+                data = f.read(read_size)
+                if not data:
+                    break
+                sha1.update(data)
+    except (IOError, OSError) as e:
+        utils_lib.LOG('Failed to read file %s, Error: %s' % (path, e))
+        return None
+    return sha1.hexdigest()
+
+
+def _group_by(file_infos, key_func):
+    """Group the file infos by the given key function.
+
+    @param file_infos: A list of ResultInfo objects.
+    @param key_func: A function returning the key to group a ResultInfo by.
+            Files with a key of None are dropped.
+    @return: A list of lists of ResultInfo objects with the same key, only
+            groups with more than one file are returned.
+    """
+    grouped_infos = {}
+    for info in file_infos:
+        key = key_func(info)
+        if key is not None:
+            grouped_infos.setdefault(key, []).append(info)
+    return [infos for infos in grouped_infos.values() if len(infos) > 1]
+
+
+def _find_duplicates(file_infos):
+    """Find groups of files with the same content.
+
+    @param file_infos: A list of ResultInfo objects.
+    @return: A list of lists of ResultInfo objects with the same content.
+    """
+    duplicates = []
+    for same_size in _group_by(file_infos, lambda f: f.trimmed_size):
+        for same_chunk in _group_by(
+                same_size,
+                lambda f: _hash_file(f.path, HASH_CHUNK_SIZE_BYTE)):
+            if same_chunk[0].trimmed_size <= HASH_CHUNK_SIZE_BYTE:
+                # The chunk covers the whole file.
+                duplicates.append(same_chunk)
+            else:
+                duplicates.extend(_group_by(
+                        same_chunk, lambda f: _hash_file(f.path)))
+    return duplicates
+
+
+def _load_manifest(path):
+    """Load the manifest of files deduped in an earlier run.
+
+    @param path: Path to the manifest file.
+    @return: A dictionary of deleted_path: kept_path.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        utils_lib.LOG('Failed to load manifest %s, Error: %s' % (path, e))
+        return {}
+
+
+def _save_manifest(summary, manifest):
+    """Save the manifest to the result directory and add it to the summary.
+
+    @param summary: A ResultInfo object containing result summary.
+    @param manifest: A dictionary of deleted_path: kept_path.
+    """
+    path = os.path.join(summary.path, MANIFEST_FILE_NAME)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    if MANIFEST_FILE_NAME in summary.get_file_names():
+        summary.remove_file(MANIFEST_FILE_NAME)
+    summary.add_file(MANIFEST_FILE_NAME)
+
+
+def _get_dedupable_files(file_infos, file_size_threshold_byte):
+    """Filter the files that can be deduped.
+
+    @param file_infos: A list of ResultInfo objects.
+    @param file_size_threshold_byte: Threshold of file size in byte for it to be
+            qualified for deduping.
+    @yield: ResultInfo objects that can be deduped.
+    """
+    for info in file_infos:
+        if info.trimmed_size < file_size_threshold_byte:
+            continue
+        # Deleting a symlink doesn't save anything, and deleting its target
+        # would break it.
+        if os.path.islink(info.path):
+            continue
+        yield info
+
+
+def get_kept_file_patterns(summary):
+    """Get the patterns of the files kept for the duplicates deleted.
+
+    The manifest points the deleted duplicates to these files, so other
+    throttlers must not trim, compress or delete them.
+
+    @param summary: A ResultInfo object containing result summary.
+    @return: A list of regex patterns matching the paths of the kept files.
+    """
+    manifest = _load_manifest(os.path.join(summary.path, MANIFEST_FILE_NAME))
+    return ['%s$' % re.escape(os.path.join(summary.path, kept_path))
+            for kept_path in sorted(set(manifest.values()))]
+
+
+def throttle(summary, max_result_size_KB,
+             file_size_threshold_byte=DEFAULT_FILE_SIZE_THRESHOLD_BYTE):
+    """Throttle the files in summary by removing files with duplicate content.
+
+    Stop throttling until all files are processed or the result size is already
+    reduced to be under the given max_result_size_KB.
+
+    @param summary: A ResultInfo object containing result summary.
+    @param max_result_size_KB: Maximum test result size in KB.
+    @param file_size_threshold_byte: Threshold of file size in byte for it to be
+            qualified for deduping.
+    """
+    file_infos, _ = throttler_lib.sort_result_files(summary)
+    file_infos = throttler_lib.get_throttleable_files(file_infos)
+    file_infos = list(_get_dedupable_files(file_infos,
+                                           file_size_threshold_byte))
+
+    manifest_path = os.path.join(summary.path, MANIFEST_FILE_NAME)
+    manifest = _load_manifest(manifest_path)
+    manifest_updated = False
+    result_dir = summary.path + os.sep
+    try:
+        for infos in _find_duplicates(file_infos):
+            infos.sort(key=lambda f: f.path)
+            kept_info = infos[0]
+            kept_path = os.path.relpath(kept_info.path, result_dir)
+            utils_lib.LOG('De-duplicating %d files with the same content as %s'
+                          % (len(infos) - 1, kept_info.path))
+            for info in infos[1:]:
+                if throttler_lib.try_delete_file_on_disk(info.path):
+                    info.trimmed_size = 0
+                    manifest[os.path.relpath(info.path, result_dir)] = (
+                            kept_path)
+                    manifest_updated = True
+
+            if throttler_lib.check_throttle_limit(summary, max_result_size_KB):
+                return
+    finally:
+        if manifest_updated:
+            _save_manifest(summary, manifest)
@@ -0,0 +1,124 @@
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from autotest_lib.client.bin.result_tools import content_dedupe_file_throttler
+from autotest_lib.client.bin.result_tools import result_info
+from autotest_lib.client.bin.result_tools import unittest_lib
+
+
+# Set to 0 to force maximum throttling.
+MAX_RESULT_SIZE_KB = 0
+
+SIZE = 8 * 1024
+# Larger than the hashed chunk, so the whole file needs to be hashed.
+LARGE_SIZE = content_dedupe_file_throttler.HASH_CHUNK_SIZE_BYTE + 1024
+# Smaller than the threshold to be deduped.
+SMALL_SIZE = 1024
+
+class ContentDedupeFileThrottleTest(unittest.TestCase):
+    """Test class for content_dedupe_file_throttler.throttle method."""
+
+    def setUp(self):
+        """Setup directory for test."""
+        self.test_dir = tempfile.mkdtemp()
+        folder1 = os.path.join(self.test_dir, 'folder1')
+        os.mkdir(folder1)
+        folder2 = os.path.join(self.test_dir, 'folder2')
+        os.mkdir(folder2)
+
+        self.files_to_keep = []
+        for path, size, char in [
+                (os.path.join(folder1, 'messages'), SIZE, 'A'),
+                (os.path.join(folder2, 'messages.1'), SIZE, 'A'),
+                (os.path.join(folder2, 'other'), SIZE, 'B'),
+                (os.path.join(folder1, 'large'), LARGE_SIZE, 'A'),
+                (os.path.join(folder2, 'large'), LARGE_SIZE, 'A'),
+                (os.path.join(folder1, 'small'), SMALL_SIZE, 'A'),
+                (os.path.join(folder2, 'small'), SMALL_SIZE, 'A'),
+                (os.path.join(folder1, 'keyval'), SIZE, 'A')]:
+            unittest_lib.create_file(path, size, char)
+            self.files_to_keep.append(path)
+
+        # Same size and first chunk as folder1/large, different tail.
+        self.large_diff = os.path.join(folder1, 'large_diff')
+        unittest_lib.create_file(self.large_diff, LARGE_SIZE, 'A')
+        with open(self.large_diff, 'r+') as f:
+            f.seek(LARGE_SIZE - 1)
+            f.write('B')
+        self.files_to_keep.append(self.large_diff)
+
+        self.files_to_delete = [os.path.join(folder2, 'messages.1'),
+                                os.path.join(folder2, 'large')]
+        for f in self.files_to_delete:
+            self.files_to_keep.remove(f)
+
+    def tearDown(self):
+        """Cleanup the test directory."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _get_manifest(self):
+        """Load the manifest saved in the test directory."""
+        with open(os.path.join(
+                self.test_dir,
+                content_dedupe_file_throttler.MANIFEST_FILE_NAME)) as f:
+            return json.load(f)
+
+    def testThrottle(self):
+        """Test throttle method."""
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        original_size = summary.original_size
+        content_dedupe_file_throttler.throttle(
+                summary, max_result_size_KB=MAX_RESULT_SIZE_KB)
+
+        for f in self.files_to_keep:
+            self.assertTrue(os.path.exists(f), 'File %s was deleted.' % f)
+        for f in self.files_to_delete:
+            self.assertFalse(os.path.exists(f),
+                             'File %s is not deleted.' % f)
+
+        self.assertEqual({'folder2/large': 'folder1/large',
+                          'folder2/messages.1': 'folder1/messages'},
+                         self._get_manifest())
+
+        # Verify summary sizes are updated.
+        manifest_info = summary.get_file(
+                content_dedupe_file_throttler.MANIFEST_FILE_NAME)
+        self.assertEqual(original_size + manifest_info.original_size,
+                         summary.original_size)
+        self.assertEqual(
+                summary.original_size - SIZE - LARGE_SIZE,
+                summary.trimmed_size)
+        self.assertEqual(
+                0,
+                summary.get_file('folder2').get_file('large').trimmed_size)
+
+    def testThrottle_UpdateManifest(self):
+        """Test throttle method adds to the manifest of an earlier run."""
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        content_dedupe_file_throttler.throttle(
+                summary, max_result_size_KB=MAX_RESULT_SIZE_KB)
+
+        unittest_lib.create_file(
+                os.path.join(self.test_dir, 'folder2', 'other.1'), SIZE, 'B')
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        content_dedupe_file_throttler.throttle(
+                summary, max_result_size_KB=MAX_RESULT_SIZE_KB)
+
+        self.assertEqual({'folder2/large': 'folder1/large',
+                          'folder2/messages.1': 'folder1/messages',
+                          'folder2/other.1': 'folder2/other'},
+                         self._get_manifest())
+
+
+# this is so the test can be run in standalone mode
+if __name__ == '__main__':
+    """Main"""
+    unittest.main()
@@ -11,7 +11,6 @@ prefix and remove files in the middle part.
 import os
 import re
 
-import result_info_lib
 import throttler_lib
 import utils_lib
 
@@ -32,22 +31,26 @@ NO_DEDUPE_FILE_PATTERNS = [
 # regex pattern to get the prefix of a file.
 PREFIX_PATTERN = '([a-zA-Z_-]*).*'
 
-def _group_by(file_infos, keys):
-    """Group the file infos by the given keys.
+def _get_dedupe_key(info):
+    """Get the key to group a file by for de-duplication.
+
+    @param info: A ResultInfo object of the file.
+    @return: A tuple of (parent_dir, prefix) of the file.
+    """
+    return (os.path.dirname(info.path),
+            re.match(PREFIX_PATTERN, info.name).group(1))
+
+
+def _group_by(file_infos, key_func):
+    """Group the file infos by the given key function.
 
     @param file_infos: A list of ResultInfo objects.
-    @param keys: A list of names of the attribute to group the file infos by.
+    @param key_func: A function returning the key to group a ResultInfo by.
     @return: A dictionary of grouped_key: [ResultInfo].
     """
     grouped_infos = {}
     for info in file_infos:
-        key_values = []
-        for key in keys:
-            key_values.append(getattr(info, key))
-        grouped_key = os.sep.join(key_values)
-        if grouped_key not in grouped_infos:
-            grouped_infos[grouped_key] = []
-        grouped_infos[grouped_key].append(info)
+        grouped_infos.setdefault(key_func(info), []).append(info)
     return grouped_infos
 
 
@@ -59,8 +62,7 @@ def _dedupe_files(summary, file_infos, max_result_size_KB):
     @param max_result_size_KB: Maximum test result size in KB.
     """
     # Sort file infos based on the modify date of the file.
-    file_infos.sort(
-            key=lambda f: result_info_lib.get_last_modification_time(f.path))
+    file_infos.sort(key=lambda f: f.last_modification_time)
     file_infos_to_delete = file_infos[
             OLDEST_FILES_TO_KEEP_COUNT:-NEWEST_FILES_TO_KEEP_COUNT]
 
@@ -72,7 +74,7 @@ def _dedupe_files(summary, file_infos, max_result_size_KB):
                 return
 
 
-def throttle(summary, max_result_size_KB):
+def throttle(summary, max_result_size_KB, exclude_file_patterns=[]):
     """Throttle the files in summary by de-duplicating files.
 
     Stop throttling until all files are processed or the result size is already
@@ -80,20 +82,19 @@ def throttle(summary, max_result_size_KB):
 
     @param summary: A ResultInfo object containing result summary.
     @param max_result_size_KB: Maximum test result size in KB.
+    @param exclude_file_patterns: A list of regex pattern for files not to be
+            throttled. Default is an empty list.
     """
     _, grouped_files = throttler_lib.sort_result_files(summary)
     for pattern in throttler_lib.RESULT_THROTTLE_PRIORITY:
         throttable_files = list(throttler_lib.get_throttleable_files(
-                grouped_files[pattern], NO_DEDUPE_FILE_PATTERNS))
-
-        for info in throttable_files:
-            info.parent_dir = os.path.dirname(info.path)
-            info.prefix = re.match(PREFIX_PATTERN, info.name).group(1)
+                grouped_files[pattern],
+                exclude_file_patterns + NO_DEDUPE_FILE_PATTERNS))
 
         # Group files for each parent directory
-        grouped_infos = _group_by(throttable_files, ['parent_dir', 'prefix'])
+        grouped_infos = _group_by(throttable_files, _get_dedupe_key)
 
-        for infos in grouped_infos.values():
+        for (parent_dir, prefix), infos in grouped_infos.items():
             if (len(infos) <=
                 OLDEST_FILES_TO_KEEP_COUNT + NEWEST_FILES_TO_KEEP_COUNT):
                 # No need to dedupe if the count of file is too few.
@@ -101,7 +102,7 @@ def throttle(summary, max_result_size_KB):
 
             # Remove files can be deduped
             utils_lib.LOG('De-duplicating files in %s with the same prefix of '
-                          '"%s"' % (infos[0].parent_dir, infos[0].prefix))
+                          '"%s"' % (parent_dir, prefix))
             #dedupe_file_infos = [i.result_info for i in infos]
             _dedupe_files(summary, infos, max_result_size_KB)
 
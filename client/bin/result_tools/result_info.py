@@ -84,8 +84,14 @@ class ResultInfo(dict):
     }
     """
 
+    # Results can have hundreds of thousands of files, use slots to keep the
+    # per-file memory overhead down.
+    __slots__ = ('_initialized', '_parent_result_info', '_name', '_details',
+                 '_path', '_is_dir', '_last_modification_time',
+                 '_previous_collected_size')
+
     def __init__(self, parent_dir, name=None, parent_result_info=None,
-                 original_info=None):
+                 original_info=None, scan_entry=None):
         """Initialize a collection of size information for a given result path.
 
         A ResultInfo object can be initialized in two ways:
@@ -107,6 +113,9 @@ class ResultInfo(dict):
                 which means a file's original size is 100 bytes, and trimmed
                 down to 50 bytes. This argument is used when the object is
                 restored from a json string.
+        @param scan_entry: A result_info_lib.ScanEntry object of the result
+                file or directory. If given, its stat information is used
+                instead of reading it from the file again.
         """
         super(ResultInfo, self).__init__()
 
@@ -122,9 +131,12 @@ class ResultInfo(dict):
         # the size updates can reduce unnecessary calculations.
         self._initialized = False
         self._parent_result_info = parent_result_info
+        # Last modification time of the file, read lazily if not cached from
+        # the scan that built the ResultInfo.
+        self._last_modification_time = None
 
         if original_info is None:
-            self._init_from_file(parent_dir, name)
+            self._init_from_file(parent_dir, name, scan_entry)
         else:
             self._init_with_original_info(parent_dir, original_info)
 
@@ -132,11 +144,13 @@ class ResultInfo(dict):
         self._previous_collected_size = 0
         self._initialized = True
 
-    def _init_from_file(self, parent_dir, name):
+    def _init_from_file(self, parent_dir, name, scan_entry=None):
         """Initialize with the physical file.
 
         @param parent_dir: Path to the parent directory.
         @param name: Name of the result file or directory.
+        @param scan_entry: A result_info_lib.ScanEntry object of the result
+                file or directory, None to read the stat of the file.
         """
         assert name != None
         self._name = name
@@ -149,7 +163,10 @@ class ResultInfo(dict):
 
         # rstrip is to remove / when name is ROOT_DIR ('').
         self._path = os.path.join(parent_dir, self.name).rstrip(os.sep)
-        self._is_dir = os.path.isdir(self._path)
+        if scan_entry is None:
+            self._is_dir = os.path.isdir(self._path)
+        else:
+            self._is_dir = scan_entry.is_dir
 
         if self.is_dir:
             # The value of key utils_lib.DIRS is a list of ResultInfo objects.
@@ -161,8 +178,11 @@ class ResultInfo(dict):
             # Set directory size to 0, it will be updated later after its
             # sub-directories are added.
             self.original_size = 0
-        else:
+        elif scan_entry is None:
             self.original_size = self.size
+        else:
+            self.original_size = scan_entry.size
+            self._last_modification_time = scan_entry.mtime
 
     def _init_with_original_info(self, parent_dir, original_info):
         """Initialize with pre-collected information.
@@ -203,6 +223,9 @@ class ResultInfo(dict):
         if utils_lib.TRIMMED_SIZE_BYTES in original_info[self.name]:
             self.trimmed_size = original_info[self.name][
                     utils_lib.TRIMMED_SIZE_BYTES]
+        if utils_lib.THROTTLE_SECONDS in original_info[self.name]:
+            self.details[utils_lib.THROTTLE_SECONDS] = dict(
+                    original_info[self.name][utils_lib.THROTTLE_SECONDS])
         if self.is_dir:
             dirs = original_info[self.name][utils_lib.DIRS]
             # TODO: Remove this conversion after R62 is in stable channel.
@@ -235,6 +258,21 @@ class ResultInfo(dict):
             f.update_dir_original_size()
         self.update_original_size(skip_parent_update=True)
 
+    def _add_scanned_files(self, scan_entry):
+        """Add ResultInfo objects for the files found by a scan, recursively.
+
+        @param scan_entry: The result_info_lib.ScanEntry object of this
+                directory.
+        """
+        for child in scan_entry.children:
+            file_info = ResultInfo(parent_dir=self._path,
+                                   name=child.name,
+                                   parent_result_info=self,
+                                   scan_entry=child)
+            self.files.append(file_info)
+            if child.children:
+                file_info._add_scanned_files(child)
+
     @staticmethod
     def build_from_path(parent_dir,
                         name=utils_lib.ROOT_DIR,
@@ -268,31 +306,15 @@ class ResultInfo(dict):
             dir_info.add_file(os.path.basename(parent_dir))
             return dir_info
 
+        # Scan the whole tree first, so each file is only stat-ed once.
+        scan_entry = result_info_lib.scan_tree(
+                os.path.join(parent_dir, name), top_dir, all_dirs)
         dir_info = ResultInfo(parent_dir=parent_dir,
                               name=name,
-                              parent_result_info=parent_result_info)
-
-        path = os.path.join(parent_dir, name)
-        if os.path.isdir(path):
-            real_path = os.path.realpath(path)
-            # The assumption here is that results are copied back to drone by
-            # copying the symlink, not the content, which is true with currently
-            # used rsync in cros_host.get_file call.
-            # Skip scanning the child folders if any of following condition is
-            # true:
-            # 1. The directory is a symlink and link to a folder under `top_dir`
-            # 2. The directory was scanned already.
-            if ((os.path.islink(path) and real_path.startswith(top_dir)) or
-                real_path in all_dirs):
-                return dir_info
-            all_dirs.add(real_path)
-            for f in sorted(os.listdir(path)):
-                dir_info.files.append(ResultInfo.build_from_path(
-                        parent_dir=path,
-                        name=f,
-                        parent_result_info=dir_info,
-                        top_dir=top_dir,
-                        all_dirs=all_dirs))
+                              parent_result_info=parent_result_info,
+                              scan_entry=scan_entry)
+        if scan_entry.children:
+            dir_info._add_scanned_files(scan_entry)
 
         # Update all directory's original size at the end of the tree building.
         if is_top_level:
@@ -349,6 +371,18 @@ class ResultInfo(dict):
                     '`original_size` property instead.')
         return result_info_lib.get_file_size(self._path)
 
+    @property
+    def last_modification_time(self):
+        """The last modification time of the file, as a unix timestamp.
+
+        The value read when the ResultInfo was built from the file system is
+        returned, so the file is not stat-ed again.
+        """
+        if self._last_modification_time is None:
+            self._last_modification_time = (
+                    result_info_lib.get_last_modification_time(self._path))
+        return self._last_modification_time
+
     @property
     def original_size(self):
         """The original size in bytes of the result before it's throttled.
@@ -428,6 +462,24 @@ class ResultInfo(dict):
         """
         return self._parent_result_info
 
+    @property
+    def throttle_seconds(self):
+        """A dictionary of throttler name: seconds spent in the throttler.
+        """
+        return self.details.get(utils_lib.THROTTLE_SECONDS, {})
+
+    def add_throttle_seconds(self, throttler_name, seconds):
+        """Add the time spent in a throttler to the result.
+
+        @param throttler_name: Name of the throttler.
+        @param seconds: Seconds spent in the throttler. It's added to the time
+                recorded for the throttler earlier, if any.
+        """
+        throttle_seconds = self.details.setdefault(
+                utils_lib.THROTTLE_SECONDS, {})
+        throttle_seconds[throttler_name] = round(
+                throttle_seconds.get(throttler_name, 0) + seconds, 3)
+
     def add_file(self, name, original_info=None):
         """Add a file to the result.
 
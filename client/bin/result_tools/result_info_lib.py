@@ -6,6 +6,16 @@
 """
 
 import os
+import stat as stat_module
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        # Backport of os.scandir for python 2, if installed.
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
 
 
 def _get_file_stat(path):
@@ -40,3 +50,131 @@ def get_last_modification_time(path):
     """
     stat = _get_file_stat(path)
     return stat.st_mtime if stat else 0
+
+
+class ScanEntry(object):
+    """A file or directory found by scan_tree, with its stat information.
+
+    @var name: Name of the file or directory.
+    @var is_dir: True if the entry is a directory, or a link to one.
+    @var size: Size in bytes of a file, 0 for a directory.
+    @var mtime: Last modification time of a file, 0 for a directory.
+    @var children: List of ScanEntry objects of a scanned directory, sorted by
+            name. None for a file.
+    """
+
+    __slots__ = ('name', 'is_dir', 'size', 'mtime', 'children')
+
+    def __init__(self, name, is_dir, size, mtime):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.children = [] if is_dir else None
+
+
+def _list_dir(path):
+    """List the entries of a directory with a single stat call each.
+
+    Symlinks are followed, a broken symlink is reported as an empty file.
+
+    @param path: Path to the directory.
+    @yield: Tuples of (name, is_dir, is_link, size, mtime).
+    """
+    if _scandir is not None:
+        for entry in _scandir(path):
+            is_link = entry.is_symlink()
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                yield entry.name, True, is_link, 0, 0
+                continue
+            try:
+                stat = entry.stat()
+                yield entry.name, False, is_link, stat.st_size, stat.st_mtime
+            except OSError:
+                # File was deleted already, or is a broken link.
+                yield entry.name, False, is_link, 0, 0
+        return
+
+    for name in os.listdir(path):
+        child_path = os.path.join(path, name)
+        try:
+            stat = os.lstat(child_path)
+        except OSError:
+            # File was deleted already.
+            yield name, False, False, 0, 0
+            continue
+        is_link = stat_module.S_ISLNK(stat.st_mode)
+        if is_link:
+            stat = _get_file_stat(child_path)
+        if stat is None:
+            # Broken link.
+            yield name, False, is_link, 0, 0
+        elif stat_module.S_ISDIR(stat.st_mode):
+            yield name, True, is_link, 0, 0
+        else:
+            yield name, False, is_link, stat.st_size, stat.st_mtime
+
+
+def scan_tree(path, top_dir, all_dirs):
+    """Scan a file or directory tree in a single pass.
+
+    Every entry is stat-ed once, and the results are cached on the returned
+    ScanEntry objects. A directory is not descended into if it is a symlink
+    to a folder under `top_dir`, or if its real path is in `all_dirs`.
+
+    @param path: Path to the file or directory to scan.
+    @param top_dir: The top directory of the scan.
+    @param all_dirs: A set of real paths of the directories scanned already.
+            It's updated with the directories scanned.
+    @return: A ScanEntry object for `path`.
+    """
+    name = os.path.basename(path.rstrip(os.sep))
+    if not os.path.isdir(path):
+        stat = _get_file_stat(path)
+        if stat is None:
+            return ScanEntry(name, False, 0, 0)
+        return ScanEntry(name, False, stat.st_size, stat.st_mtime)
+
+    entry = ScanEntry(name, True, 0, 0)
+    real_path = os.path.realpath(path)
+    if ((os.path.islink(path) and real_path.startswith(top_dir)) or
+        real_path in all_dirs):
+        return entry
+    all_dirs.add(real_path)
+    _scan_dir(entry, path, real_path, top_dir, all_dirs)
+    return entry
+
+
+def _scan_dir(entry, path, real_path, top_dir, all_dirs):
+    """Add the entries under a directory to its ScanEntry, recursively.
+
+    @param entry: The ScanEntry of the directory.
+    @param path: Path to the directory.
+    @param real_path: The real path of the directory.
+    @param top_dir: The top directory of the scan.
+    @param all_dirs: A set of real paths of the directories scanned already.
+    """
+    for name, is_dir, is_link, size, mtime in sorted(_list_dir(path)):
+        child = ScanEntry(name, is_dir, size, mtime)
+        entry.children.append(child)
+        if not is_dir:
+            continue
+        child_path = os.path.join(path, name)
+        # The real path of a directory that is not a link follows from its
+        # parent's, saving a realpath call per directory.
+        if is_link:
+            child_real_path = os.path.realpath(child_path)
+        else:
+            child_real_path = os.path.join(real_path, name)
+        # The assumption here is that results are copied back to drone by
+        # copying the symlink, not the content, which is true with currently
+        # used rsync in cros_host.get_file call.
+        if ((is_link and child_real_path.startswith(top_dir)) or
+            child_real_path in all_dirs):
+            continue
+        all_dirs.add(child_real_path)
+        _scan_dir(child, child_path, child_real_path, top_dir, all_dirs)
@@ -0,0 +1,90 @@
+#!/usr/bin/python2
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""unittest for result_info_lib.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import common
+from autotest_lib.client.bin.result_tools import result_info
+from autotest_lib.client.bin.result_tools import result_info_lib
+from autotest_lib.client.bin.result_tools import unittest_lib
+from autotest_lib.client.bin.result_tools import utils_lib
+
+
+class ScanTreeTest(unittest.TestCase):
+    """Test class for scan_tree method"""
+
+    def setUp(self):
+        """Setup directory for test."""
+        self.test_dir = tempfile.mkdtemp()
+        self.outside_dir = tempfile.mkdtemp()
+        unittest_lib.create_file(os.path.join(self.test_dir, 'file1'))
+        folder1 = os.path.join(self.test_dir, 'folder1')
+        os.mkdir(folder1)
+        unittest_lib.create_file(os.path.join(folder1, 'file2'), 2 * 10)
+        unittest_lib.create_file(os.path.join(self.outside_dir, 'file3'))
+        # Link to a folder under the top directory, not scanned.
+        os.symlink(folder1, os.path.join(self.test_dir, 'link_inside'))
+        # Link to a folder outside of the top directory, scanned.
+        os.symlink(self.outside_dir,
+                   os.path.join(self.test_dir, 'link_outside'))
+        os.symlink(os.path.join(self.test_dir, 'missing'),
+                   os.path.join(self.test_dir, 'link_broken'))
+
+    def tearDown(self):
+        """Cleanup the test directory."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+        shutil.rmtree(self.outside_dir, ignore_errors=True)
+
+    def _get_tree(self, entry):
+        """Convert a ScanEntry to a comparable tuple, recursively."""
+        if entry.children is None:
+            return (entry.name, entry.size)
+        return (entry.name, [self._get_tree(c) for c in entry.children])
+
+    def _check_scan(self):
+        """Scan the test directory and check the result."""
+        entry = result_info_lib.scan_tree(self.test_dir, self.test_dir, set())
+        self.assertEqual(
+                [('file1', unittest_lib.SIZE),
+                 ('folder1', [('file2', 2 * 10)]),
+                 ('link_broken', 0),
+                 ('link_inside', []),
+                 ('link_outside', [('file3', unittest_lib.SIZE)])],
+                self._get_tree(entry)[1])
+
+    def test_ScanTree(self):
+        """Test method scan_tree."""
+        self._check_scan()
+
+    def test_ScanTree_NoScandir(self):
+        """Test method scan_tree without scandir available."""
+        with mock.patch.object(result_info_lib, '_scandir', None):
+            self._check_scan()
+
+    def test_BuildFromPath_StatOnce(self):
+        """Test that build_from_path doesn't stat the files again."""
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        with mock.patch.object(result_info_lib, '_get_file_stat') as stat:
+            file1 = summary.get_file('file1')
+            self.assertNotEqual(0, file1.last_modification_time)
+            self.assertEqual(unittest_lib.SIZE, file1.original_size)
+            self.assertFalse(stat.called)
+        self.assertEqual(
+                {utils_lib.ORIGINAL_SIZE_BYTES: unittest_lib.SIZE},
+                file1.details)
+
+
+# this is so the test can be run in standalone mode
+if __name__ == '__main__':
+    """Main"""
+    unittest.main()
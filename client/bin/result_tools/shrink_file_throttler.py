@@ -70,9 +70,13 @@ DEFAULT_FILE_SIZE_LIMIT_BYTE = 100 * 1024
 def _trim_file(file_info, file_size_limit_byte):
     """Remove the file content in the middle to reduce the file size.
 
+    This is called in a worker thread, so it only changes the file on disk.
+    _update_summary updates the summary afterwards.
+
     @param file_info: A ResultInfo object containing summary for the file to be
             shrunk.
     @param file_size_limit_byte: Maximum file size in bytes after trimming.
+    @return: True if the file is trimmed, False otherwise.
     """
     utils_lib.LOG('Trimming file %s to reduce size from %d bytes to %d bytes' %
                   (file_info.path, file_info.original_size,
@@ -114,13 +118,23 @@ def _trim_file(file_info, file_size_limit_byte):
         # Clean up the intermediate file.
         throttler_lib.try_delete_file_on_disk(new_path)
         utils_lib.LOG('Failed to shrink %s' % file_info.path)
-        return
+        return False
 
     os.rename(new_path, file_info.path)
     # Modify the new file's timestamp to the old one.
     os.utime(file_info.path, (stat.st_atime, stat.st_mtime))
-    # Update the trimmed_size.
-    file_info.trimmed_size = file_info.size
+    return True
+
+
+def _update_summary(file_info, trimmed):
+    """Update the trimmed size of the file in the summary.
+
+    @param file_info: A ResultInfo object containing summary for the file
+            trimmed.
+    @param trimmed: True if the file was trimmed by _trim_file.
+    """
+    if trimmed:
+        file_info.trimmed_size = file_info.size
 
 
 def _get_shrinkable_files(file_infos, file_size_limit_byte):
@@ -151,10 +165,13 @@ def _get_shrinkable_files(file_infos, file_size_limit_byte):
 
 def throttle(summary, max_result_size_KB,
              file_size_limit_byte=DEFAULT_FILE_SIZE_LIMIT_BYTE,
-             skip_autotest_log=False):
+             skip_autotest_log=False, workers=throttler_lib.DEFAULT_WORKERS,
+             exclude_file_patterns=[]):
     """Throttle the files in summary by trimming file content.
 
-    Stop throttling until all files are processed or the result file size is
+    Files are trimmed in parallel, in the order of sort_result_files: by
+    RESULT_THROTTLE_PRIORITY group, largest first within each group. Stop
+    throttling until all files are processed or the result file size is
     already reduced to be under the given max_result_size_KB.
 
     @param summary: A ResultInfo object containing result summary.
@@ -164,15 +181,17 @@ def throttle(summary, max_result_size_KB,
             result size is under the given max_result_size_KB.
     @param skip_autotest_log: True to skip shrink Autotest logs, default is
             False.
+    @param workers: Number of files to trim at the same time.
+    @param exclude_file_patterns: A list of regex pattern for files not to be
+            throttled. Default is an empty list.
     """
     file_infos, _ = throttler_lib.sort_result_files(summary)
     extra_patterns = ([throttler_lib.AUTOTEST_LOG_PATTERN] if skip_autotest_log
-                      else [])
+                      else []) + exclude_file_patterns
     file_infos = throttler_lib.get_throttleable_files(
             file_infos, extra_patterns)
     file_infos = _get_shrinkable_files(file_infos, file_size_limit_byte)
-    for info in file_infos:
-        _trim_file(info, file_size_limit_byte)
-
-        if throttler_lib.check_throttle_limit(summary, max_result_size_KB):
-            return
+    throttler_lib.throttle_files_in_pool(
+            summary, max_result_size_KB, file_infos,
+            lambda info: _trim_file(info, file_size_limit_byte),
+            _update_summary, workers)
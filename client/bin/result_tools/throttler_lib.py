@@ -4,8 +4,11 @@
 
 """Help functions used by different throttlers."""
 
+import Queue
 import os
 import re
+import sys
+from multiprocessing import pool
 
 import utils_lib
 
@@ -18,6 +21,7 @@ NON_THROTTLEABLE_FILE_NAMES = set([
         '.parse.log',
         '.parser_execute',
         'control',
+        'content_dedupe_manifest.json',
         'control.srv',
         'host_keyvals',
         'job_report.html',
@@ -56,6 +60,9 @@ RESULT_THROTTLE_PRIORITY = [
 # without throttling if possible.
 AUTOTEST_LOG_PATTERN ='.*\.(DEBUG|ERROR|INFO|WARNING)$'
 
+# Default number of files to compress or trim at the same time.
+DEFAULT_WORKERS = 4
+
 def _list_files(files, all_files=None):
     """Get all files in the given directories.
 
@@ -145,6 +152,79 @@ def check_throttle_limit(summary, max_result_size_KB):
         return False
 
 
+def throttle_files_in_pool(summary, max_result_size_KB, file_infos,
+                           process_func, update_func,
+                           workers=DEFAULT_WORKERS):
+    """Throttle files in a pool of worker threads, in the given order.
+
+    `process_func` is called in the worker threads, and must only change the
+    file on disk, not the summary. `update_func` is called in the calling
+    thread with each file's ResultInfo and the value returned by
+    `process_func`, to update the summary.
+
+    No more than `workers` files are processed at a time, so throttling stops
+    shortly after the result size is under max_result_size_KB. Files being
+    processed at that point are finished and added to the summary.
+
+    @param summary: A ResultInfo object containing result summary.
+    @param max_result_size_KB: Maximum test result size in KB.
+    @param file_infos: An iterable of ResultInfo objects of the files to
+            throttle, in the order of sort_result_files.
+    @param process_func: A function to throttle a file on disk, taking its
+            ResultInfo object.
+    @param update_func: A function to update the summary after a file is
+            throttled, taking its ResultInfo object and the value returned by
+            `process_func`.
+    @param workers: Number of files to throttle at the same time.
+    @raise: The first exception raised by `process_func`, after the files
+            being processed are finished.
+    """
+    if workers <= 1:
+        for info in file_infos:
+            update_func(info, process_func(info))
+            if check_throttle_limit(summary, max_result_size_KB):
+                return
+        return
+
+    results = Queue.Queue()
+    def _process(info):
+        try:
+            results.put((info, process_func(info), None))
+        except Exception:
+            results.put((info, None, sys.exc_info()))
+
+    file_infos = iter(file_infos)
+    worker_pool = pool.ThreadPool(workers)
+    in_flight = 0
+    done = False
+    error = None
+    try:
+        while True:
+            while not done and in_flight < workers:
+                info = next(file_infos, None)
+                if info is None:
+                    done = True
+                    break
+                worker_pool.apply_async(_process, (info,))
+                in_flight += 1
+            if in_flight == 0:
+                break
+            info, value, exc_info = results.get()
+            in_flight -= 1
+            if exc_info is not None:
+                error = error or exc_info
+                done = True
+                continue
+            update_func(info, value)
+            if check_throttle_limit(summary, max_result_size_KB):
+                done = True
+    finally:
+        worker_pool.close()
+        worker_pool.join()
+    if error is not None:
+        raise error[0], error[1], error[2]
+
+
 def try_delete_file_on_disk(path):
     """Try to delete the give file on disk.
 
@@ -89,6 +89,52 @@ class ThrottlerLibTest(unittest.TestCase):
             self.assertEqual(os.path.join(*EXPECTED_THROTTABLE_FILES[i]),
                              throttleables[i].path)
 
+    def _get_summary_and_files(self):
+        """Get the sample summary and its throttleable files."""
+        summary = result_info.ResultInfo(parent_dir='',
+                                         original_info=SAMPLE_SUMMARY)
+        sorted_files, _ = throttler_lib.sort_result_files(summary)
+        return summary, list(throttler_lib.get_throttleable_files(
+                sorted_files))
+
+    def testThrottleFilesInPool(self):
+        """Test method throttle_files_in_pool"""
+        summary, file_infos = self._get_summary_and_files()
+        processed = []
+        def _update(info, value):
+            processed.append(value)
+            info.trimmed_size = 0
+
+        throttler_lib.throttle_files_in_pool(
+                summary, 0, file_infos, lambda info: info.path, _update,
+                workers=2)
+        self.assertEqual(sorted(f.path for f in file_infos), sorted(processed))
+        self.assertEqual(unittest_lib.SIZE, summary.trimmed_size)
+
+    def testThrottleFilesInPool_StopEarly(self):
+        """Test method throttle_files_in_pool stops at the size limit."""
+        summary, file_infos = self._get_summary_and_files()
+        processed = []
+        def _update(info, value):
+            processed.append(value)
+            info.trimmed_size = 0
+
+        # Throttling the first file is enough to meet the limit.
+        throttler_lib.throttle_files_in_pool(
+                summary, 5 * unittest_lib.SIZE / 1024.0, file_infos,
+                lambda info: info.path, _update, workers=1)
+        self.assertEqual([file_infos[0].path], processed)
+
+    def testThrottleFilesInPool_Error(self):
+        """Test method throttle_files_in_pool raises errors of workers."""
+        summary, file_infos = self._get_summary_and_files()
+        def _process(info):
+            raise IOError('Failed to process %s' % info.path)
+
+        self.assertRaises(IOError, throttler_lib.throttle_files_in_pool,
+                          summary, 0, file_infos, _process,
+                          lambda info, value: None, workers=2)
+
 
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
@@ -5,11 +5,12 @@
 
 SIZE = 10
 
-def create_file(path, size=SIZE):
+def create_file(path, size=SIZE, char='A'):
     """Create a temp file at given path with the given size.
 
     @param path: Path to the temp file.
     @param size: Size of the temp file, default to SIZE.
+    @param char: The character to fill the file with, default to 'A'.
     """
     with open(path, 'w') as f:
-        f.write('A' * size)
\ No newline at end of file
+        f.write(char * size)
\ No newline at end of file
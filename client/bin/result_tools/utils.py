@@ -39,6 +39,7 @@ import sys
 import time
 import traceback
 
+import content_dedupe_file_throttler
 import dedupe_file_throttler
 import delete_file_throttler
 import result_info
@@ -260,6 +261,18 @@ def _throttle_results(summary, max_result_size_KB):
 
     args = {'summary': summary,
             'max_result_size_KB': max_result_size_KB}
+    # Removing files with duplicate content goes first, as it doesn't lose any
+    # data.
+    old_size = summary.trimmed_size
+    if _apply_throttler(content_dedupe_file_throttler, copy.copy(args),
+                        old_size):
+        return
+
+    # The manifest points the deleted duplicates to the files kept, so the
+    # other throttlers leave these files alone.
+    kept_file_patterns = content_dedupe_file_throttler.get_kept_file_patterns(
+            summary)
+    args['exclude_file_patterns'] = kept_file_patterns
     args_skip_autotest_log = copy.copy(args)
     args_skip_autotest_log['skip_autotest_log'] = True
     # Apply the throttlers in following order.
@@ -283,7 +296,7 @@ def _throttle_results(summary, max_result_size_KB):
     # at 5MB then lowering to 100KB.
     delete_file_thresholds = [5*1024*1024, 1*1024*1024, 100*1024]
     # Try to keep tgz files first.
-    exclude_file_patterns = ['.*\.tgz']
+    exclude_file_patterns = ['.*\.tgz'] + kept_file_patterns
     for threshold in delete_file_thresholds:
         new_args = copy.copy(args)
         new_args.update({'file_size_threshold_byte': threshold,
@@ -295,27 +308,43 @@ def _throttle_results(summary, max_result_size_KB):
     throttlers.append((delete_file_throttler, new_args))
 
     # Run the throttlers in order until result size is under max_result_size_KB.
-    old_size = summary.trimmed_size
     for throttler, args in throttlers:
-        try:
-            args_without_summary = copy.copy(args)
-            del args_without_summary['summary']
-            utils_lib.LOG('Applying throttler %s, args: %s' %
-                          (throttler.__name__, args_without_summary))
-            throttler.throttle(**args)
-            if throttler_lib.check_throttle_limit(summary, max_result_size_KB):
-                return
-        except:
-            utils_lib.LOG('Failed to apply throttler %s. Exception: %s' %
-                          (throttler, traceback.format_exc()))
-        finally:
-            new_size = summary.trimmed_size
-            if new_size == old_size:
-                utils_lib.LOG('Result size was not changed: %s.' % old_size)
-            else:
-                utils_lib.LOG('Result size was reduced from %s to %s.' %
-                              (utils_lib.get_size_string(old_size),
-                               utils_lib.get_size_string(new_size)))
+        if _apply_throttler(throttler, args, old_size):
+            return
+
+
+def _apply_throttler(throttler, args, old_size):
+    """Apply a throttler, and record the time spent in it in the summary.
+
+    @param throttler: The throttler module.
+    @param args: A dictionary of the arguments of the throttle method.
+    @param old_size: The result size before throttling, to log the reduction.
+    @return: True if the result size is now under max_result_size_KB.
+    """
+    summary = args['summary']
+    start_time = time.time()
+    try:
+        args_without_summary = copy.copy(args)
+        del args_without_summary['summary']
+        utils_lib.LOG('Applying throttler %s, args: %s' %
+                      (throttler.__name__, args_without_summary))
+        throttler.throttle(**args)
+        return throttler_lib.check_throttle_limit(summary,
+                                                  args['max_result_size_KB'])
+    except:
+        utils_lib.LOG('Failed to apply throttler %s. Exception: %s' %
+                      (throttler, traceback.format_exc()))
+    finally:
+        summary.add_throttle_seconds(throttler.__name__.split('.')[-1],
+                                     time.time() - start_time)
+        new_size = summary.trimmed_size
+        if new_size == old_size:
+            utils_lib.LOG('Result size was not changed: %s.' % old_size)
+        else:
+            utils_lib.LOG('Result size was reduced from %s to %s.' %
+                          (utils_lib.get_size_string(old_size),
+                           utils_lib.get_size_string(new_size)))
+    return False
 
 
 def _setup_logging():
@@ -25,6 +25,9 @@ TRIMMED_SIZE_BYTES = '/T'
 COLLECTED_SIZE_BYTES = '/C'
 # A dictionary of sub-directories' summary: name: {directory_summary}
 DIRS = '/D'
+# A dictionary of throttler name: seconds spent in the throttler. Only set for
+# the top directory of a throttled result.
+THROTTLE_SECONDS = '/TT'
 # Default root directory name. To allow summaries to be merged effectively, all
 # summaries are collected with root directory of ''
 ROOT_DIR = ''
@@ -14,6 +14,7 @@ import time
 import unittest
 
 import common
+from autotest_lib.client.bin.result_tools import content_dedupe_file_throttler
 from autotest_lib.client.bin.result_tools import result_info
 from autotest_lib.client.bin.result_tools import shrink_file_throttler
 from autotest_lib.client.bin.result_tools import throttler_lib
@@ -441,20 +442,22 @@ class ThrottleTest(unittest.TestCase):
         """Setup directory to match the file structure in MERGED_SUMMARY."""
         self.test_dir = tempfile.mkdtemp()
 
+        # Large files have different content, so they are not deduped by
+        # content_dedupe_file_throttler.
         folder = os.path.join(self.test_dir, 'files_to_shink')
         os.mkdir(folder)
         file1 = os.path.join(folder, 'file.txt')
-        unittest_lib.create_file(file1, LARGE_SIZE)
+        unittest_lib.create_file(file1, LARGE_SIZE, 'A')
 
         folder = os.path.join(self.test_dir, 'files_to_zip')
         os.mkdir(folder)
         file1 = os.path.join(folder, 'file.xml')
-        unittest_lib.create_file(file1, LARGE_SIZE)
+        unittest_lib.create_file(file1, LARGE_SIZE, 'B')
 
         folder = os.path.join(self.test_dir, 'files_to_delete')
         os.mkdir(folder)
         file1 = os.path.join(folder, 'file.png')
-        unittest_lib.create_file(file1, LARGE_SIZE)
+        unittest_lib.create_file(file1, LARGE_SIZE, 'C')
 
         folder = os.path.join(self.test_dir, 'files_to_dedupe')
         os.mkdir(folder)
@@ -467,6 +470,17 @@ class ThrottleTest(unittest.TestCase):
         """Cleanup the test directory."""
         shutil.rmtree(self.test_dir, ignore_errors=True)
 
+    def _check_throttle_seconds(self, summary):
+        """Check the time spent in throttlers is recorded in the summary.
+
+        The times are removed from the summary afterwards, so the summary can
+        be compared with the expected one.
+        """
+        throttle_seconds = summary.details.pop(utils_lib.THROTTLE_SECONDS)
+        self.assertIn('shrink_file_throttler', throttle_seconds)
+        for seconds in throttle_seconds.values():
+            self.assertTrue(seconds >= 0)
+
     def testThrottleResults(self):
         """Test _throttle_results method."""
         summary = result_info.ResultInfo.build_from_path(self.test_dir)
@@ -474,6 +488,7 @@ class ThrottleTest(unittest.TestCase):
         self.assertEqual(EXPECTED_THROTTLED_SUMMARY_NO_THROTTLE, summary)
 
         result_utils._throttle_results(summary, LARGE_SIZE * 3 / 1024)
+        self._check_throttle_seconds(summary)
         self.assertEqual(EXPECTED_THROTTLED_SUMMARY_WITH_SHRINK, summary)
 
     def testThrottleResults_Dedupe(self):
@@ -486,10 +501,38 @@ class ThrottleTest(unittest.TestCase):
             summary = result_info.ResultInfo.build_from_path(self.test_dir)
             result_utils._throttle_results(
                     summary, (2*LARGE_SIZE + 3*SMALL_SIZE + SHRINK_SIZE) / 1024)
+            self._check_throttle_seconds(summary)
             self.assertEqual(EXPECTED_THROTTLED_SUMMARY_WITH_DEDUPE, summary)
         finally:
             throttler_lib.AUTOTEST_LOG_PATTERN = old_pattern
 
+    def testThrottleResults_KeepContentDedupeTarget(self):
+        """Test the file kept by content dedupe is not throttled further."""
+        folder = os.path.join(self.test_dir, 'files_to_content_dedupe')
+        os.mkdir(folder)
+        for name in ('log_1.txt', 'log_2.txt'):
+            unittest_lib.create_file(os.path.join(folder, name), LARGE_SIZE,
+                                     'D')
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        # Throttle as much as possible, zipping and deleting files.
+        result_utils._throttle_results(summary, 0)
+
+        self.assertFalse(os.path.exists(
+                os.path.join(self.test_dir, 'files_to_zip', 'file.xml')))
+        self.assertFalse(os.path.exists(
+                os.path.join(self.test_dir, 'files_to_delete', 'file.png')))
+        with open(os.path.join(
+                self.test_dir,
+                content_dedupe_file_throttler.MANIFEST_FILE_NAME)) as f:
+            self.assertEqual(
+                    {'files_to_content_dedupe/log_2.txt':
+                     'files_to_content_dedupe/log_1.txt'},
+                    json.load(f))
+        kept_path = os.path.join(folder, 'log_1.txt')
+        self.assertEqual(LARGE_SIZE, os.path.getsize(kept_path))
+        self.assertEqual(LARGE_SIZE, summary.get_file(
+                'files_to_content_dedupe').get_file('log_1.txt').trimmed_size)
+
     def testThrottleResults_Zip(self):
         """Test _throttle_results method with dedupe triggered."""
         summary = result_info.ResultInfo.build_from_path(self.test_dir)
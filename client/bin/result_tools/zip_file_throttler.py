@@ -36,18 +36,19 @@ DEFAULT_FILE_SIZE_THRESHOLD_BYTE = 100 * 1024
 def _zip_file(file_info):
     """Zip the file to reduce the file size.
 
+    This is called in a worker thread, so it only changes the file on disk.
+    _update_summary updates the summary afterwards.
+
     @param file_info: A ResultInfo object containing summary for the file to be
             shrunk.
+    @return: True if the file is compressed, False otherwise.
     """
     utils_lib.LOG('Compressing file %s' % file_info.path)
-    parent_result_info = file_info.parent_result_info
-    new_name = file_info.name + '.tgz'
-    new_path = os.path.join(os.path.dirname(file_info.path), new_name)
+    new_path = file_info.path + '.tgz'
     if os.path.exists(new_path):
         utils_lib.LOG('File %s already exists, removing...' % new_path)
         if not throttler_lib.try_delete_file_on_disk(new_path):
-            return
-        parent_result_info.remove_file(new_name)
+            return False
     with tarfile.open(new_path, 'w:gz') as tar:
         tar.add(file_info.path, arcname=os.path.basename(file_info.path))
     stat = os.stat(file_info.path)
@@ -55,10 +56,26 @@ def _zip_file(file_info):
         # Clean up the intermediate file.
         throttler_lib.try_delete_file_on_disk(new_path)
         utils_lib.LOG('Failed to compress %s' % file_info.path)
-        return
+        return False
 
     # Modify the new file's timestamp to the old one.
     os.utime(new_path, (stat.st_atime, stat.st_mtime))
+    return True
+
+
+def _update_summary(file_info, zipped):
+    """Replace the file with the compressed file in the summary.
+
+    @param file_info: A ResultInfo object containing summary for the file
+            compressed.
+    @param zipped: True if the file was compressed by _zip_file.
+    """
+    if not zipped:
+        return
+    parent_result_info = file_info.parent_result_info
+    new_name = file_info.name + '.tgz'
+    if new_name in parent_result_info.get_file_names():
+        parent_result_info.remove_file(new_name)
     # Get the original file size before compression.
     original_size = file_info.original_size
     parent_result_info.remove_file(file_info.name)
@@ -99,10 +116,13 @@ def _get_zippable_files(file_infos, file_size_threshold_byte):
 
 def throttle(summary, max_result_size_KB,
              file_size_threshold_byte=DEFAULT_FILE_SIZE_THRESHOLD_BYTE,
-             skip_autotest_log=False):
+             skip_autotest_log=False, workers=throttler_lib.DEFAULT_WORKERS,
+             exclude_file_patterns=[]):
     """Throttle the files in summary by compressing file.
 
-    Stop throttling until all files are processed or the result file size is
+    Files are compressed in parallel, in the order of sort_result_files: by
+    RESULT_THROTTLE_PRIORITY group, largest first within each group. Stop
+    throttling until all files are processed or the result file size is
     already reduced to be under the given max_result_size_KB.
 
     @param summary: A ResultInfo object containing result summary.
@@ -111,15 +131,16 @@ def throttle(summary, max_result_size_KB,
             qualified for compression.
     @param skip_autotest_log: True to skip shrink Autotest logs, default is
             False.
+    @param workers: Number of files to compress at the same time.
+    @param exclude_file_patterns: A list of regex pattern for files not to be
+            throttled. Default is an empty list.
     """
     file_infos, _ = throttler_lib.sort_result_files(summary)
     extra_patterns = ([throttler_lib.AUTOTEST_LOG_PATTERN] if skip_autotest_log
-                      else [])
+                      else []) + exclude_file_patterns
     file_infos = throttler_lib.get_throttleable_files(
             file_infos, extra_patterns)
     file_infos = _get_zippable_files(file_infos, file_size_threshold_byte)
-    for info in file_infos:
-        _zip_file(info)
-
-        if throttler_lib.check_throttle_limit(summary, max_result_size_KB):
-            return
+    throttler_lib.throttle_files_in_pool(
+            summary, max_result_size_KB, file_infos, _zip_file,
+            _update_summary, workers)
@@ -1,5 +1,6 @@
 # pylint: disable=missing-docstring
 
+import atexit
 import cPickle as pickle
 import copy
 import errno
@@ -8,6 +9,7 @@ import logging
 import os
 import re
 import tempfile
+import threading
 import time
 import traceback
 import weakref
@@ -173,6 +175,71 @@ def with_backing_file(method):
 
 
 
+def _get_file_version(stat_result):
+    """Return what identifies the contents of a file from its stat result.
+
+    Files are only appended to or replaced, so the contents are unchanged as
+    long as the inode, size and mtime are.
+    """
+    return stat_result.st_ino, stat_result.st_size, stat_result.st_mtime
+
+
+def _apply_state_record(state, record):
+    """Apply a journal record of a state file to a state dictionary.
+
+    @param state: A dictionary of namespace dictionaries.
+    @param record: A tuple of an operation name and its arguments, as
+        journaled by job_state.
+    """
+    operation, namespace = record[:2]
+    if operation == 'set':
+        state.setdefault(namespace, {})[record[2]] = record[3]
+    elif operation == 'discard':
+        namespace_dict = state.get(namespace, {})
+        namespace_dict.pop(record[2], None)
+        if not namespace_dict:
+            state.pop(namespace, None)
+    elif operation == 'discard_namespace':
+        state.pop(namespace, None)
+    else:
+        raise ValueError('Unknown state record %r' % (record,))
+
+
+def _load_state_file(file_path):
+    """Read a state file: a pickled snapshot followed by journal records.
+
+    A record that is cut short, because the job crashed while appending it,
+    ends the journal.
+
+    @param file_path: The path of the state file. It must exist but it can
+        be empty.
+
+    @return: A tuple (state, snapshot size, journal size, file version,
+        truncated), where truncated tells whether the journal ended with a
+        partial record.
+    """
+    with open(file_path, 'rb') as state_file:
+        stat_result = os.fstat(state_file.fileno())
+        if stat_result.st_size == 0:
+            return {}, 0, 0, _get_file_version(stat_result), False
+        state = pickle.load(state_file)
+        snapshot_size = state_file.tell()
+        truncated = False
+        position = snapshot_size
+        while position < stat_result.st_size:
+            try:
+                record = pickle.load(state_file)
+            except Exception:
+                logging.warning('Ignoring partial record at offset %d of '
+                                'state file %s', position, file_path)
+                truncated = True
+                break
+            _apply_state_record(state, record)
+            position = state_file.tell()
+    return (state, snapshot_size, position - snapshot_size,
+            _get_file_version(stat_result), truncated)
+
+
 class job_state(object):
     """A class for managing explicit job and user state, optionally persistent.
 
@@ -182,10 +249,19 @@ class job_state(object):
     as names. Additionally, the namespace 'stateful_property' is used for
     storing the valued associated with properties constructed using the
     property_factory method.
+
+    The backing file holds a pickled snapshot of the state followed by a
+    journal of pickled changes, appended as they are made. Once the journal
+    outgrows the snapshot, the file is compacted: the whole state is written
+    to a new file renamed over the backing file. The state is only read
+    again from the backing file when another job_state changed it.
     """
 
     NO_DEFAULT = object()
     PICKLE_PROTOCOL = 2  # highest protocol available in python 2.4
+    # Size the journal can reach before the backing file is compacted,
+    # whatever the size of the snapshot.
+    MIN_JOURNAL_COMPACTION_SIZE = 64 * 1024
 
 
     def __init__(self):
@@ -194,13 +270,41 @@ class job_state(object):
         self._backing_file = None
         self._backing_file_initialized = False
         self._backing_file_lock = None
+        self._reset_backing_file_journal()
+
+
+    def _reset_backing_file_journal(self):
+        """Forget what is known of the contents of the backing file."""
+        # The version of the backing file matching the in-memory state.
+        self._backing_file_version = None
+        self._backing_file_snapshot_size = 0
+        self._backing_file_journal_size = 0
+        # Whether the backing file must be compacted to match the state.
+        self._backing_file_stale = False
+        # Pickled records of the changes not written yet.
+        self._pending_records = []
 
 
     def _lock_backing_file(self):
-        """Acquire a lock on the backing file."""
+        """Acquire a lock on the backing file.
+
+        Compacting the backing file replaces it, so the lock is taken again
+        if the file was replaced while waiting for it.
+        """
         if self._backing_file:
-            self._backing_file_lock = open(self._backing_file, 'a')
-            fcntl.flock(self._backing_file_lock, fcntl.LOCK_EX)
+            while True:
+                lock_file = open(self._backing_file, 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if (os.fstat(lock_file.fileno()).st_ino ==
+                            os.stat(self._backing_file).st_ino):
+                        break
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        lock_file.close()
+                        raise
+                lock_file.close()
+            self._backing_file_lock = lock_file
 
 
     def _unlock_backing_file(self):
@@ -229,10 +333,8 @@ class job_state(object):
         """
 
         # we can assume that the file exists
-        if os.path.getsize(file_path) == 0:
-            on_disk_state = {}
-        else:
-            on_disk_state = pickle.load(open(file_path))
+        (on_disk_state, snapshot_size, journal_size, version,
+         truncated) = _load_state_file(file_path)
 
         if merge:
             # merge the on-disk state with the in-memory state
@@ -256,6 +358,15 @@ class job_state(object):
             # just replace the in-memory state with the on-disk state
             self._state = on_disk_state
 
+        if file_path == self._backing_file:
+            self._backing_file_version = version
+            self._backing_file_snapshot_size = snapshot_size
+            self._backing_file_journal_size = journal_size
+            # a partial record must be dropped before appending others
+            self._backing_file_stale = merge or truncated
+        else:
+            self._backing_file_stale = True
+
         # lock the backing file before we refresh it
         with_backing_lock(self.__class__._write_to_backing_file)(self)
 
@@ -281,18 +392,91 @@ class job_state(object):
 
         If the backing file has never been read before (indicated by checking
         self._backing_file_initialized) it will merge the file with the
-        in-memory state, rather than overwriting it.
+        in-memory state, rather than overwriting it. The file is not read
+        again if it is unchanged since it was last read or written.
         """
         if self._backing_file:
+            if (self._backing_file_initialized and
+                    self._backing_file_version == _get_file_version(
+                            os.stat(self._backing_file))):
+                return
             merge_backing_file = not self._backing_file_initialized
             self.read_from_file(self._backing_file, merge=merge_backing_file)
             self._backing_file_initialized = True
 
 
     def _write_to_backing_file(self):
-        """Flush the current state to the backing file."""
+        """Flush the current state to the backing file.
+
+        The pending changes are appended to the journal, unless the backing
+        file needs to be compacted.
+        """
+        if not self._backing_file:
+            self._pending_records = []
+            return
+        pending_size = sum(len(record) for record in self._pending_records)
+        journal_size = self._backing_file_journal_size + pending_size
+        try:
+            if self._backing_file_stale or journal_size > max(
+                    self.MIN_JOURNAL_COMPACTION_SIZE,
+                    self._backing_file_snapshot_size):
+                self._compact_backing_file()
+            elif self._pending_records:
+                self._append_to_backing_file()
+        except Exception:
+            # the on-disk state is authoritative, read it again
+            self._backing_file_version = None
+            raise
+        finally:
+            self._pending_records = []
+
+
+    def _append_to_backing_file(self):
+        """Append the pending changes to the journal of the backing file."""
+        with open(self._backing_file, 'ab') as backing_file:
+            backing_file.write(''.join(self._pending_records))
+            backing_file.flush()
+            self._backing_file_version = _get_file_version(
+                    os.fstat(backing_file.fileno()))
+        self._backing_file_journal_size += sum(
+                len(record) for record in self._pending_records)
+
+
+    def _compact_backing_file(self):
+        """Replace the backing file with a snapshot of the current state.
+
+        The snapshot is written to a temporary file renamed over the backing
+        file, so the backing file is complete even after a crash.
+        """
+        dirname, basename = os.path.split(os.path.abspath(self._backing_file))
+        fd, temp_path = tempfile.mkstemp(prefix=basename + '.', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as snapshot_file:
+                pickle.dump(self._state, snapshot_file, self.PICKLE_PROTOCOL)
+                snapshot_file.flush()
+                os.fchmod(fd, os.stat(self._backing_file).st_mode & 0777)
+                os.fsync(fd)
+                stat_result = os.fstat(fd)
+            os.rename(temp_path, self._backing_file)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._backing_file_version = _get_file_version(stat_result)
+        self._backing_file_snapshot_size = stat_result.st_size
+        self._backing_file_journal_size = 0
+        self._backing_file_stale = False
+
+
+    def _journal(self, *record):
+        """Record a change of the state, to append it to the backing file.
+
+        @param record: The operation name and its arguments, as applied by
+            _apply_state_record.
+        """
         if self._backing_file:
-            self.write_to_file(self._backing_file)
+            self._pending_records.append(
+                    pickle.dumps(record, self.PICKLE_PROTOCOL))
 
 
     @with_backing_file
@@ -317,6 +501,7 @@ class job_state(object):
         self._synchronize_backing_file()
         self._backing_file = file_path
         self._backing_file_initialized = False
+        self._reset_backing_file_journal()
         self._synchronize_backing_file()
 
 
@@ -353,6 +538,7 @@ class job_state(object):
         """
         namespace_dict = self._state.setdefault(namespace, {})
         namespace_dict[name] = copy.deepcopy(value)
+        self._journal('set', namespace, name, namespace_dict[name])
         logging.debug('Persistent state %s.%s now set to %r', namespace,
                       name, value)
 
@@ -381,6 +567,7 @@ class job_state(object):
             del self._state[namespace][name]
             if len(self._state[namespace]) == 0:
                 del self._state[namespace]
+            self._journal('discard', namespace, name)
             logging.debug('Persistent state %s.%s deleted', namespace, name)
         else:
             logging.debug(
@@ -396,6 +583,7 @@ class job_state(object):
         """
         if namespace in self._state:
             del self._state[namespace]
+            self._journal('discard_namespace', namespace)
         logging.debug('Persistent state %s.* deleted', namespace)
 
 
@@ -596,15 +784,52 @@ class status_indenter(object):
         """Decrease indentation by one level."""
 
 
+# status loggers that may have buffered entries to write out at exit
+_status_loggers = weakref.WeakSet()
+
+
+@atexit.register
+def flush_status_loggers(sync=True):
+    """Write out the buffered entries of all the status loggers.
+
+    This runs at exit, and has to be called before forking, so that the
+    entries buffered by the parent are written before the child's, and
+    before a forked process exits with os._exit.
+
+    @param sync: If True, also sync the log files written to disk.
+    """
+    for logger in list(_status_loggers):
+        # a forked process has no timer threads
+        logger._check_fork()
+        timer = logger._timer
+        try:
+            logger.flush(sync=sync)
+        except Exception:
+            logging.exception('Failed to flush status log entries')
+        # let the cancelled timer end before the interpreter shuts down
+        if timer:
+            timer.join()
+
+
 class status_logger(object):
     """Represents a status log file. Responsible for translating messages
     into on-disk status log lines.
 
+    The log files are kept open, and entries are buffered for at most
+    max_flush_delay seconds. START and END entries are written out and
+    synced to disk at once, together with anything buffered before them,
+    and so is everything still buffered at exit.
+
     @property global_filename: The filename to write top-level logs to.
     @property subdir_filename: The filename to write subdir-level logs to.
     """
+
+    # Maximum number of log files kept open.
+    MAX_OPEN_FILES = 16
+
     def __init__(self, job, indenter, global_filename='status',
-                 subdir_filename='status', record_hook=None):
+                 subdir_filename='status', record_hook=None,
+                 max_flush_delay=0):
         """Construct a logger instance.
 
         @param job: A reference to the job object this is logging for. Only a
@@ -619,12 +844,118 @@ class status_logger(object):
         @param record_hook: An optional function to be called before an entry
             is logged. The function should expect a single parameter, a
             copy of the status_log_entry object.
+        @param max_flush_delay: The maximum number of seconds entries are
+            buffered before being written out. With 0, entries are written
+            out as they are recorded.
         """
         self._jobref = weakref.ref(job)
         self._indenter = indenter
         self.global_filename = global_filename
         self.subdir_filename = subdir_filename
         self._record_hook = record_hook
+        self._max_flush_delay = max_flush_delay
+        self._reset_buffers()
+        _status_loggers.add(self)
+
+
+    def _reset_buffers(self):
+        """Forget the open files and buffered entries."""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # open log files, and when each was last used
+        self._files = {}
+        self._last_used = {}
+        self._use_count = 0
+        # lists of entries to append to each log file
+        self._pending = {}
+        # paths of the log files written to since they were last synced
+        self._unsynced = set()
+        self._timer = None
+
+
+    def _check_fork(self):
+        """Drop the buffers inherited from the parent in a forked process.
+
+        The parent still writes out the entries it buffered, so it has to
+        flush before forking to keep the status lines in order.
+        """
+        if self._pid != os.getpid():
+            self._reset_buffers()
+
+
+    def _open_locked(self, path):
+        """Return the log file at path, opening it if needed.
+
+        When too many files are open, the least recently used one is written
+        out and closed.
+
+        @param path: The path of the log file.
+        """
+        fileobj = self._files.get(path)
+        if fileobj is None:
+            if len(self._files) >= self.MAX_OPEN_FILES:
+                self._close_locked(min(self._files,
+                                       key=self._last_used.__getitem__))
+            fileobj = self._files[path] = open(path, 'a', 0)
+        self._use_count += 1
+        self._last_used[path] = self._use_count
+        return fileobj
+
+
+    def _close_locked(self, path):
+        """Write out the entries buffered for a log file, and close it.
+
+        @param path: The path of the log file.
+        """
+        self._write_locked(path, sync=path in self._unsynced)
+        self._files.pop(path).close()
+        del self._last_used[path]
+
+
+    def _write_locked(self, path, sync):
+        """Write out the entries buffered for a log file.
+
+        @param path: The path of the log file.
+        @param sync: If True, also sync the log file to disk.
+        """
+        fileobj = self._files[path]
+        lines = self._pending.pop(path, None)
+        if lines:
+            fileobj.write(''.join(lines))
+            self._unsynced.add(path)
+        if sync and path in self._unsynced:
+            os.fsync(fileobj.fileno())
+            self._unsynced.discard(path)
+
+
+    def _flush_locked(self, sync):
+        """Write out all the buffered entries.
+
+        @param sync: If True, also sync the log files written to disk.
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        for path in self._files.keys():
+            self._write_locked(path, sync)
+
+
+    def flush(self, sync=False):
+        """Write out all the buffered entries.
+
+        @param sync: If True, also sync the log files written to disk.
+        """
+        self._check_fork()
+        with self._lock:
+            self._flush_locked(sync)
+
+
+    def _flush_on_timer(self):
+        """Write out the buffered entries once the flush delay is over."""
+        try:
+            self.flush()
+        except Exception:
+            logging.exception('Failed to flush status log entries')
 
 
     def render_entry(self, log_entry):
@@ -668,14 +999,21 @@ class status_logger(object):
             log_files.append(os.path.join(job.resultdir, log_entry.subdir,
                                           self.subdir_filename))
 
-        # write out to entry to the log files
-        log_text = self.render_entry(log_entry)
-        for log_file in log_files:
-            fileobj = open(log_file, 'a')
-            try:
-                print >> fileobj, log_text
-            finally:
-                fileobj.close()
+        # write out to entry to the log files, or buffer it
+        log_text = self.render_entry(log_entry) + '\n'
+        is_boundary = log_entry.is_start() or log_entry.is_end()
+        self._check_fork()
+        with self._lock:
+            for log_file in log_files:
+                self._open_locked(log_file)
+                self._pending.setdefault(log_file, []).append(log_text)
+            if is_boundary or not self._max_flush_delay:
+                self._flush_locked(sync=is_boundary)
+            elif not self._timer:
+                self._timer = threading.Timer(self._max_flush_delay,
+                                              self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
 
         # adjust the indentation if this was a START or END entry
         if log_entry.is_start():
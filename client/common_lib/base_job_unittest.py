@@ -2,14 +2,18 @@
 
 # pylint: disable=missing-docstring
 
+import cPickle as pickle
+import glob
 import logging
 import os
 import shutil
 import stat
 import tempfile
+import time
 import unittest
 
 import common
+from autotest_lib.client.bin import parallel
 from autotest_lib.client.common_lib import base_job, error
 
 
@@ -54,6 +58,9 @@ class stub_job_state(base_job.job_state):
     def _write_to_backing_file(self):
         pass
 
+    def _journal(self, *record):
+        pass
+
     def _lock_backing_file(self):
         pass
 
@@ -732,6 +739,93 @@ class test_job_state_set_backing_file(unittest.TestCase):
         self.assertRaises(KeyError, state2.get, 'n7', 'shared5')
 
 
+class test_job_state_journal(unittest.TestCase):
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp(suffix='unittest')
+        self.original_wd = os.getcwd()
+        os.chdir(self.testdir)
+        self.state = base_job.job_state()
+        self.state.set_backing_file('backing_file')
+
+
+    def tearDown(self):
+        os.chdir(self.original_wd)
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+
+    def _reload(self):
+        state = base_job.job_state()
+        state.read_from_file('backing_file')
+        return state
+
+
+    def test_changes_are_appended(self):
+        self.state.set('ns', 'var1', 1)
+        inode = os.stat('backing_file').st_ino
+        size = os.path.getsize('backing_file')
+        self.state.set('ns', 'var2', 2)
+        self.state.discard('ns', 'var1')
+        self.assertEqual(inode, os.stat('backing_file').st_ino)
+        self.assert_(os.path.getsize('backing_file') > size)
+        state = self._reload()
+        self.assertFalse(state.has('ns', 'var1'))
+        self.assertEqual(2, state.get('ns', 'var2'))
+
+
+    def test_journal_is_compacted(self):
+        for i in xrange(2000):
+            self.state.set('ns', 'counter', i)
+        self.assert_(os.path.getsize('backing_file') <
+                     2 * base_job.job_state.MIN_JOURNAL_COMPACTION_SIZE)
+        self.assertEqual([], glob.glob('backing_file.*'))
+        self.assertEqual(1999, self._reload().get('ns', 'counter'))
+
+
+    def test_unchanged_file_is_not_read(self):
+        self.state.set('ns', 'var', 'value')
+        def fail_read(file_path, merge=True):
+            self.fail('%s was read' % file_path)
+        self.state.read_from_file = fail_read
+        self.assertEqual('value', self.state.get('ns', 'var'))
+        self.state.set('ns', 'var', 'other value')
+        self.assertEqual('other value', self._reload().get('ns', 'var'))
+
+
+    def test_changes_after_compaction_are_read(self):
+        state2 = base_job.job_state()
+        state2.set_backing_file('backing_file')
+        self.state.set('ns', 'var', 1)
+        self.assertEqual(1, state2.get('ns', 'var'))
+        self.state.read_from_file('backing_file', merge=True)
+        self.state.set('ns', 'var', 2)
+        self.assertEqual(2, state2.get('ns', 'var'))
+
+
+    def test_partial_record_is_dropped(self):
+        self.state.set('ns', 'var1', 1)
+        size = os.path.getsize('backing_file')
+        self.state.set('ns', 'var2', 2)
+        with open('backing_file', 'r+b') as backing_file:
+            backing_file.truncate(os.path.getsize('backing_file') - 2)
+        self.assertFalse(self._reload().has('ns', 'var2'))
+
+        state = base_job.job_state()
+        state.set_backing_file('backing_file')
+        self.assertEqual(1, state.get('ns', 'var1'))
+        self.assertFalse(state.has('ns', 'var2'))
+        state.set('ns', 'var3', 3)
+        reloaded = self._reload()
+        self.assertEqual(1, reloaded.get('ns', 'var1'))
+        self.assertEqual(3, reloaded.get('ns', 'var3'))
+
+
+    def test_snapshot_can_be_read_as_pickle(self):
+        self.state.set('ns', 'var', 'value')
+        self.state.read_from_file('backing_file', merge=True)
+        self.assertEqual({'ns': {'var': 'value'}},
+                         pickle.load(open('backing_file')))
+
+
 class test_job_state_backing_file_locking(unittest.TestCase):
     def setUp(self):
         self.testdir = tempfile.mkdtemp(suffix='unittest')
@@ -1254,6 +1348,87 @@ class test_status_logger(unittest.TestCase):
         self.assertEqual(entries, recorded_entries)
 
 
+    def test_buffers_until_start_or_end(self):
+        os.mkdir('sub')
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             max_flush_delay=3600)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        self.logger.record_entry(self.make_dummy_entry('LINE2', subdir='sub'))
+        self.assertEqual('', open('status').read())
+        self.assertEqual('', open('sub/status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE3', start=True))
+        self.assertEqual('LINE1\nLINE2\nLINE3\n', open('status').read())
+        self.assertEqual('LINE2\n', open('sub/status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE4'))
+        self.logger.record_entry(self.make_dummy_entry('LINE5', end=True))
+        self.assertEqual('LINE1\nLINE2\nLINE3\n\tLINE4\nLINE5\n',
+                         open('status').read())
+
+
+    def test_flushes_after_delay(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             max_flush_delay=0.05)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        self.logger.record_entry(self.make_dummy_entry('LINE2'))
+        deadline = time.time() + 10
+        while not open('status').read() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual('LINE1\nLINE2\n', open('status').read())
+
+
+    def test_flushes_at_exit(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             max_flush_delay=3600)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        base_job.flush_status_loggers()
+        self.assertEqual('LINE1\n', open('status').read())
+
+
+    def test_closes_least_recently_used_files(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             max_flush_delay=3600)
+        subdirs = ['sub%d' % i
+                   for i in xrange(base_job.status_logger.MAX_OPEN_FILES)]
+        for subdir in subdirs:
+            os.mkdir(subdir)
+            self.logger.record_entry(self.make_dummy_entry(subdir,
+                                                           subdir=subdir))
+        self.assertEqual(base_job.status_logger.MAX_OPEN_FILES,
+                         len(self.logger._files))
+        self.assertEqual('sub0\n', open('sub0/status').read())
+        self.assertEqual('', open('sub1/status').read())
+
+
+    def test_forked_process_keeps_order(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             max_flush_delay=3600)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        base_job.flush_status_loggers(sync=False)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.logger.record_entry(self.make_dummy_entry('LINE2'))
+                self.logger.flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.logger.record_entry(self.make_dummy_entry('LINE3'))
+        self.logger.flush()
+        self.assertEqual('LINE1\nLINE2\nLINE3\n', open('status').read())
+
+
+    def test_fork_start_child_entries_written(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             max_flush_delay=3600)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        record = lambda: self.logger.record_entry(
+                self.make_dummy_entry('LINE2'))
+        pid = parallel.fork_start(self.testdir, record)
+        parallel.fork_waitfor(self.testdir, pid)
+        self.logger.record_entry(self.make_dummy_entry('LINE3', end=True))
+        self.assertEqual('LINE1\nLINE2\nLINE3\n', open('status').read())
+
+
     def tearDown(self):
         os.chdir(self.original_wd)
         shutil.rmtree(self.testdir, ignore_errors=True)
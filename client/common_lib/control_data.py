@@ -7,9 +7,14 @@ with warnings.catch_warnings():
     # so in every log file.
     warnings.simplefilter("ignore", DeprecationWarning)
     import compiler
+import errno
+import hashlib
 import logging
-import textwrap
+import marshal
+import os
 import re
+import tempfile
+import textwrap
 
 from autotest_lib.client.common_lib import enum
 from autotest_lib.client.common_lib import global_config
@@ -29,6 +34,16 @@ CONFIG = global_config.global_config
 DEFAULT_MAX_RESULT_SIZE_KB = CONFIG.get_config_value(
         'AUTOSERV', 'default_max_result_size_KB', type=int, default=20000)
 
+# Directory of the index of variables parsed from control files, keyed by the
+# hash of their content, so unchanged control files are not parsed again.
+# Empty to disable the index.
+CONTROL_FILE_INDEX_DIR = CONFIG.get_config_value(
+        'CROS', 'control_file_index_dir', default='')
+
+# Version of the format of the index entries, to bump when the variables
+# extracted from a control file change.
+_INDEX_FORMAT_VERSION = 1
+
 
 class ControlVariableException(Exception):
     pass
@@ -382,24 +397,113 @@ def _extract_assignment(n):
     return (key, val)
 
 
+def _get_index_path(control):
+    """Get the path of the index entry of a control file.
+
+    @param control: string containing the text of a control file.
+
+    @return The path, or None if the index is disabled.
+    """
+    if not CONTROL_FILE_INDEX_DIR:
+        return None
+    if isinstance(control, unicode):
+        control = control.encode('utf-8')
+    digest = hashlib.sha1(control).hexdigest()
+    return os.path.join(CONTROL_FILE_INDEX_DIR, 'v%d' % _INDEX_FORMAT_VERSION,
+                        digest[:2], digest)
+
+
+def _read_index(index_path):
+    """Read the variables of a control file from the index.
+
+    @param index_path: Path of the index entry.
+
+    @return The dictionary of variables, or None if not in the index.
+    """
+    try:
+        with open(index_path, 'rb') as f:
+            variables = marshal.load(f)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            logging.warning('Failed to read control file index %s: %s',
+                            index_path, e)
+        return None
+    except (EOFError, ValueError, TypeError) as e:
+        logging.warning('Corrupted control file index %s: %s', index_path, e)
+        return None
+    return variables if isinstance(variables, dict) else None
+
+
+def _write_index(index_path, variables):
+    """Add the variables of a control file to the index.
+
+    The entry is written to a temporary file, then renamed, so concurrent
+    readers never see a partial entry.  Failures are logged and ignored.
+
+    @param index_path: Path of the index entry.
+    @param variables: Dictionary of variables parsed from the control file.
+    """
+    index_dir = os.path.dirname(index_path)
+    try:
+        try:
+            os.makedirs(index_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(variables, f)
+                # mkstemp creates the file readable by its owner only, but
+                # the index is shared with the other users, e.g. apache.
+                os.fchmod(fd, 0644)
+            os.rename(tmp_path, index_path)
+        except:
+            os.unlink(tmp_path)
+            raise
+    except (IOError, OSError, ValueError) as e:
+        # The index is only an optimization, e.g. it may not be writable
+        # when running from a checkout.
+        logging.debug('Failed to write control file index %s: %s',
+                      index_path, e)
+
+
+def is_control_string_indexed(control):
+    """Return whether a control file is in the control file index.
+
+    @param control: string containing the text of a control file.
+    """
+    index_path = _get_index_path(control)
+    return bool(index_path) and os.path.exists(index_path)
+
+
 def parse_control_string(control, raise_warnings=False, path=''):
     """Parse a control file from a string.
 
+    The variables of the control file are looked up in the control file
+    index first, if enabled, and parsed only if not found there.
+
     @param control: string containing the text of a control file.
     @param raise_warnings: True iff ControlData should raise an error on
             warnings about control file contents.
     @param path: string path to the control file.
 
     """
-    try:
-        mod = compiler.parse(control)
-    except SyntaxError as e:
-        logging.error('Syntax error (%s) while parsing control string:', e)
-        lines = control.split('\n')
-        for n, l in enumerate(lines):
-            logging.error('Line %d: %s', n + 1, l)
-        raise ControlVariableException("Error parsing data because %s" % e)
-    return finish_parse(mod, path, raise_warnings)
+    index_path = _get_index_path(control)
+    variables = _read_index(index_path) if index_path else None
+    if variables is None:
+        try:
+            mod = compiler.parse(control)
+        except SyntaxError as e:
+            logging.error('Syntax error (%s) while parsing control string:', e)
+            lines = control.split('\n')
+            for n, l in enumerate(lines):
+                logging.error('Line %d: %s', n + 1, l)
+            raise ControlVariableException("Error parsing data because %s" % e)
+        variables = _extract_variables(mod)
+        if index_path:
+            _write_index(index_path, variables)
+    return ControlData(variables, path, raise_warnings)
 
 
 def parse_control(path, raise_warnings=False):
@@ -424,7 +528,13 @@ def _try_extract_assignment(node, variables):
         pass
 
 
-def finish_parse(mod, path, raise_warnings):
+def _extract_variables(mod):
+    """Extract the variables set in a parsed control file.
+
+    @param mod: compiler.ast.Module of the control file.
+
+    @return A dictionary of the variables.
+    """
     assert(mod.__class__ == compiler.ast.Module)
     assert(mod.node.__class__ == compiler.ast.Stmt)
     assert(mod.node.nodes.__class__ == list)
@@ -446,4 +556,8 @@ def finish_parse(mod, path, raise_warnings):
             _try_extract_assignment(n, injection_variables)
 
     variables.update(injection_variables)
-    return ControlData(variables, path, raise_warnings)
+    return variables
+
+
+def finish_parse(mod, path, raise_warnings):
+    return ControlData(_extract_variables(mod), path, raise_warnings)
@@ -2,7 +2,9 @@
 # pylint: disable-msg=C0111
 
 import json
-import os, unittest
+import os, shutil, tempfile, unittest
+
+import mock
 
 import common
 
@@ -323,6 +325,58 @@ class SetMethodTests(unittest.TestCase):
         self.assertRaises(control_data.ControlVariableException, fail)
 
 
+class ControlFileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self._index_dir = control_data.CONTROL_FILE_INDEX_DIR
+        control_data.CONTROL_FILE_INDEX_DIR = self.index_dir
+
+
+    def tearDown(self):
+        control_data.CONTROL_FILE_INDEX_DIR = self._index_dir
+        shutil.rmtree(self.index_dir)
+
+
+    def _index_entries(self):
+        return [os.path.join(dirpath, name)
+                for dirpath, _, names in os.walk(self.index_dir)
+                for name in names]
+
+
+    def test_parsed_once(self):
+        cd = control_data.parse_control_string(CONTROL, True, 'path1')
+        self.assertEqual(len(self._index_entries()), 1)
+        self.assertEqual(
+                os.stat(self._index_entries()[0]).st_mode & 0777, 0644)
+        with mock.patch.object(control_data.compiler, 'parse') as parse:
+            indexed_cd = control_data.parse_control_string(CONTROL, True,
+                                                           'path2')
+        self.assertFalse(parse.called)
+        self.assertEqual(indexed_cd.path, 'path2')
+        indexed_cd.path = cd.path
+        self.assertEqual(vars(indexed_cd), vars(cd))
+
+
+    def test_corrupted_entry(self):
+        control_data.parse_control_string(CONTROL, True)
+        with open(self._index_entries()[0], 'w') as f:
+            f.write('garbage')
+        cd = control_data.parse_control_string(CONTROL, True)
+        self.assertEquals(cd.name, "nAmE")
+
+
+    def test_syntax_error_not_indexed(self):
+        self.assertRaises(control_data.ControlVariableException,
+                          control_data.parse_control_string, 'NAME = (')
+        self.assertEqual(self._index_entries(), [])
+
+
+    def test_disabled(self):
+        control_data.CONTROL_FILE_INDEX_DIR = ''
+        control_data.parse_control_string(CONTROL, True)
+        self.assertEqual(self._index_entries(), [])
+
+
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
     unittest.main()
@@ -11,6 +11,10 @@ import logging
 import os
 import re
 import shutil
+import struct
+import subprocess
+import tarfile
+import tempfile
 
 import common
 from autotest_lib.client.bin import os_dep
@@ -22,6 +26,136 @@ from autotest_lib.client.common_lib import utils
 # the name of the checksum file that stores the packages' checksums
 CHECKSUM_FILE = "packages.checksum"
 
+# Seconds allowed to fetch and install each package of a batch.
+_BATCH_TIMEOUT_PER_PKG = 1200
+
+# Prefix of the lines printed by the batched install script for each step,
+# followed by the package name, the step, its status, and the start and end
+# times of the step.
+_BATCH_STEP_MARKER = 'AUTOTEST_PKG_STEP'
+
+# Formats of the package tarballs, named after their file extension.  The
+# bzip2 format is understood by every repository and host.  The zstd format
+# is a tar archive compressed in independent zstd frames, preceded by an
+# index of the frame of each member in a skippable frame: the frames are
+# decompressed and extracted in parallel, and single files can be extracted
+# without decompressing the whole package.  It is used when the package is
+# in the repository and the host has zstd, see BasePackageManager.
+PACKAGE_FORMAT_BZ2 = 'tar.bz2'
+PACKAGE_FORMAT_ZSTD = 'tar.zst'
+PACKAGE_FORMATS = (PACKAGE_FORMAT_BZ2, PACKAGE_FORMAT_ZSTD)
+
+# Uncompressed size of the frames of a zstd package.
+_ZSTD_FRAME_SIZE = 8 * 1024 * 1024
+_ZSTD_LEVEL = 9
+# Magic number of the skippable frame holding the index of a zstd package,
+# followed by the size of the index.  The index has one line per member:
+# `<frame offset> <frame size> <member name>`, with the offsets from the end
+# of the index.
+_ZSTD_INDEX_MAGIC = 0x184D2A5A
+_ZSTD_INDEX_HEADER = struct.Struct('<II')
+
+# Shell functions shared by the commands untarring packages.
+#   _index_size <path>: prints the size of the index of a zstd package,
+#       fails if it has none.
+#   _untar_frames <path> <dir> <base>: extracts the frames of a zstd
+#       package, listed on stdin as `<offset> <size>` lines with offsets from
+#       <base>, in parallel.
+#   _untar <path> <dir>: extracts a package of any format.
+_UNTAR_FUNCTIONS = '''\
+_index_size() {
+  [ "$(od -An -tx4 -N4 "$1" | tr -d ' ')" = "%x" ] || return 1
+  od -An -tu4 -j4 -N4 "$1" | tr -d ' '
+}
+_untar_frames() {
+  xargs -n 2 -P "$(nproc 2>/dev/null || echo 1)" sh -c \\
+    'tail -c +$(($2 + $3 + 1)) "$0" | head -c "$4" | zstd -dqc |
+     tar --no-same-owner -xf - -C "$1"' "$1" "$2" "$3"
+}
+_untar() {
+  case "$1" in
+  *.%s)
+    if size=$(_index_size "$1"); then
+      tail -c +9 "$1" | head -c "$size" | cut -d' ' -f1,2 | uniq |
+        _untar_frames "$1" "$2" $((8 + size))
+    else
+      zstd -dqc "$1" | tar --no-same-owner -xf - -C "$2"
+    fi;;
+  *) tar --no-same-owner -xjf "$1" -C "$2";;
+  esac
+}
+''' % (_ZSTD_INDEX_MAGIC, PACKAGE_FORMAT_ZSTD)
+
+# Shell functions of the batched install script.
+#   _now: prints the current time.
+#   _step <pkg> <step> <status> <start>: prints the marker line of a step.
+#   _sum <path>: prints the checksum of a package, like compute_checksum().
+#   _listed <pkg>: succeeds if the checksum file lists the package.
+#   _get_pkg <fetch command>: uses the package at $path if its checksum
+#       matches the checksum file, fetches it otherwise.
+_BATCH_SCRIPT_HEADER = '''\
+_now() { date +%%s.%%N 2>/dev/null; }
+_step() { echo "%s $1 $2 $3 $4 $(_now)"; }
+_sum() {
+  if [ -e "$1.checksum" ]; then tr -d '\\n' <"$1.checksum"
+  else md5sum "$1" | cut -d' ' -f1; fi
+}
+_listed() {
+  awk -v n="$1" '$2 == n {f = 1} END {exit !f}' "$checksums" 2>/dev/null
+}
+_get_pkg() {
+  expected=$(awk -v n="$name" '$2 == n {print $1}' "$checksums" 2>/dev/null)
+  if [ -e "$path" ] && [ -n "$expected" ] &&
+     [ "$(_sum "$path")" = "$expected" ]; then
+    _step "$name" fetch cached $start
+    return 0
+  fi
+  if ! eval "$1"; then
+    _step "$name" fetch failed $start
+    return 1
+  fi
+  sum=$(_sum "$path")
+  { awk -v n="$name" 'NF && $2 != n' "$checksums" 2>/dev/null
+    echo "$sum $name"; } >"$checksums.tmp" &&
+    mv "$checksums.tmp" "$checksums"
+  _step "$name" fetch ok $start
+}
+command -v zstd >/dev/null 2>&1 && zstd=1 || zstd=
+''' % _BATCH_STEP_MARKER + _UNTAR_FUNCTIONS
+
+# Installs a package, like install_pkg() does step by step.  The zstd
+# package is used if the host has zstd and the checksum file lists it,
+# falling back to the bzip2 package.  Parameters: the tarball names, fetch
+# paths and fetch commands of both formats, the install directory, and the
+# command cleaning the install directory.
+_BATCH_SCRIPT_PKG = '''\
+_install() {
+  install_dir=%(install_dir)s
+  start=$(_now)
+  name=%(zstd_name)s path=%(zstd_path)s
+  if [ -z "$zstd" ] || ! _listed "$name" || ! _get_pkg %(zstd_fetch)s; then
+    start=$(_now)
+    name=%(bz2_name)s path=%(bz2_path)s
+    _get_pkg %(bz2_fetch)s || return 1
+  fi
+  start=$(_now)
+  sum=$(_sum "$path")
+  if [ -d "$install_dir" ] &&
+     [ "$(cat "$install_dir/.checksum" 2>/dev/null)" = "$sum" ]; then
+    _step "$name" untar skipped $start
+    return 0
+  fi
+  if ! { %(clean)s mkdir -p "$install_dir" &&
+         _untar "$path" "$install_dir" &&
+         echo "$sum" >"$install_dir/.checksum"; }; then
+    _step "$name" untar failed $start
+    return 1
+  fi
+  _step "$name" untar ok $start
+}
+_install
+'''
+
 
 def has_pbzip2():
     '''Check if parallel bzip2 is available on this system.'''
@@ -36,6 +170,106 @@ def has_pbzip2():
 _PBZIP2_AVAILABLE = has_pbzip2()
 
 
+def has_zstd():
+    '''Check if zstd is available on this system.'''
+    try:
+        os_dep.command('zstd')
+    except ValueError:
+        return False
+    return True
+
+
+def _write_zstd_package(tar_path, package_path):
+    '''
+    Compress a tar archive into a zstd package: the members are grouped
+    in frames of about _ZSTD_FRAME_SIZE bytes, each compressed separately,
+    after the index of the frame of each member.
+    tar_path     : the path of the uncompressed tar archive.
+    package_path : the path of the package to write.
+    '''
+    with open(tar_path, 'rb') as tar_file:
+        members = tarfile.open(fileobj=tar_file).getmembers()
+        tar_size = os.fstat(tar_file.fileno()).st_size
+        # Split the archive at the start of members, including their extra
+        # headers like long names, so each frame holds whole members.  The
+        # last frame ends with the end of archive blocks.
+        frame_starts = [0]
+        member_frames = []
+        for member in members:
+            if member.offset - frame_starts[-1] >= _ZSTD_FRAME_SIZE:
+                frame_starts.append(member.offset)
+            member_frames.append(len(frame_starts) - 1)
+        frame_ends = frame_starts[1:] + [tar_size]
+
+        with tempfile.TemporaryFile() as frames_file:
+            frames = []
+            for start, end in zip(frame_starts, frame_ends):
+                frame_offset = frames_file.tell()
+                compressor = subprocess.Popen(
+                        ['zstd', '-q', '-c', '-%d' % _ZSTD_LEVEL],
+                        stdin=subprocess.PIPE, stdout=frames_file)
+                tar_file.seek(start)
+                remaining = end - start
+                while remaining:
+                    data = tar_file.read(min(remaining, 1024 * 1024))
+                    compressor.stdin.write(data)
+                    remaining -= len(data)
+                compressor.stdin.close()
+                if compressor.wait():
+                    raise error.CmdError('zstd', utils.CmdResult(
+                            'zstd', exit_status=compressor.returncode))
+                frames_file.seek(0, os.SEEK_END)
+                frames.append((frame_offset,
+                               frames_file.tell() - frame_offset))
+
+            index = ''.join('%d %d %s\n' % (frames[frame] + (member.name,))
+                            for frame, member in zip(member_frames, members))
+            with open(package_path, 'wb') as package:
+                package.write(_ZSTD_INDEX_HEADER.pack(_ZSTD_INDEX_MAGIC,
+                                                      len(index)))
+                package.write(index)
+                frames_file.seek(0)
+                shutil.copyfileobj(frames_file, package)
+
+
+def read_zstd_package_index(package_path):
+    '''
+    Read the index of a zstd package.
+    package_path : the path of the package.
+    Returns a list of (frame offset, frame size, member name) tuples, with
+    the offsets from the start of the package.
+    '''
+    with open(package_path, 'rb') as package:
+        header = package.read(_ZSTD_INDEX_HEADER.size)
+        magic, size = _ZSTD_INDEX_HEADER.unpack(header)
+        if magic != _ZSTD_INDEX_MAGIC:
+            raise error.PackageError('%s has no index' % package_path)
+        return _parse_zstd_package_index(package.read(size))
+
+
+def _parse_zstd_package_index(index):
+    '''
+    Parse the index of a zstd package, see read_zstd_package_index.
+    index : the index string.
+    '''
+    base = _ZSTD_INDEX_HEADER.size + len(index)
+    entries = []
+    for line in index.splitlines():
+        offset, size, name = line.split(' ', 2)
+        entries.append((base + int(offset), int(size), name))
+    return entries
+
+
+def _get_parent_dirs(path):
+    '''Return the parent directories of a relative path.'''
+    parents = []
+    while True:
+        path = os.path.dirname(path)
+        if not path or path == '.':
+            return parents
+        parents.append(path)
+
+
 def parse_ssh_path(repo):
     '''
     Parse ssh://xx@xx/path/to/ and return a tuple with host_line and
@@ -134,6 +368,21 @@ class RepositoryFetcher(object):
         raise NotImplementedError()
 
 
+    def get_fetch_command(self, filename, dest_path):
+        """ Return a shell command fetching a package file.
+
+        The command is run where the packages are installed, as part of a
+        batched install.
+
+        @param filename: The filename of the package file to fetch.
+        @param dest_path: Destination path to download the file to.
+
+        @returns The command string, or None if the fetcher doesn't fetch
+            files with a shell command.
+        """
+        return None
+
+
 class HttpFetcher(RepositoryFetcher):
     curl_cmd_pattern = 'curl --connect-timeout 15 -s %s -o %s'
 
@@ -144,6 +393,7 @@ class HttpFetcher(RepositoryFetcher):
         """
         self.run_command = package_manager._run_command
         self.url = repository_url
+        self._reachable = False
 
     def exists(self, destpath, target='file'):
         """Check if a file or directory exists using `test`.
@@ -168,21 +418,24 @@ class HttpFetcher(RepositoryFetcher):
     def _quick_http_test(self):
         """ Run a simple 30 second curl on the repository to see if it is
         reachable. This avoids the need to wait for a full 10min timeout.
-        """
-        # just make a temp file to write a test fetch into
-        mktemp = 'mktemp -u /tmp/tmp.XXXXXX'
-        dest_file_path = self.run_command(mktemp).stdout.strip()
 
+        The repository is only tested until it is found reachable once.
+        """
+        if self._reachable:
+            return
+        http_cmd = self.curl_cmd_pattern % (self.url, '/dev/null')
         try:
-            # build up a curl command
-            http_cmd = self.curl_cmd_pattern % (self.url, dest_file_path)
-            try:
-                self.run_command(http_cmd, _run_command_dargs={'timeout': 30})
-            except Exception, e:
-                msg = 'HTTP test failed, unable to contact %s: %s'
-                raise error.PackageFetchError(msg % (self.url, e))
-        finally:
-            self.run_command('rm -rf %s' % dest_file_path)
+            self.run_command(http_cmd, _run_command_dargs={'timeout': 30})
+        except Exception, e:
+            msg = 'HTTP test failed, unable to contact %s: %s'
+            raise error.PackageFetchError(msg % (self.url, e))
+        self._reachable = True
+
+
+    def get_fetch_command(self, filename, dest_path):
+        package_url = os.path.join(self.url, filename)
+        return self.curl_cmd_pattern % (utils.sh_quote_word(package_url),
+                                        utils.sh_quote_word(dest_path))
 
 
     def fetch_pkg_file(self, filename, dest_path):
@@ -234,6 +487,12 @@ class LocalFilesystemFetcher(RepositoryFetcher):
                 % (filename, self.url), e)
 
 
+    def get_fetch_command(self, filename, dest_path):
+        local_path = os.path.join(self.url, filename)
+        return 'cp %s %s' % (utils.sh_quote_word(local_path),
+                             utils.sh_quote_word(dest_path))
+
+
 class BasePackageManager(object):
     def __init__(self, pkgmgr_dir, hostname=None, repo_urls=None,
                  upload_paths=None, do_locking=True, run_function=utils.run,
@@ -261,6 +520,9 @@ class BasePackageManager(object):
 
         self.pkgmgr_dir = pkgmgr_dir
         self.do_locking = do_locking
+        # Whether zstd packages can be untarred where the packages are
+        # installed, checked when first needed.
+        self._zstd_supported = None
         self.hostname = hostname
         self.repositories = []
 
@@ -392,52 +654,241 @@ class BasePackageManager(object):
         install_dir : the directory where the package files will be untarred to
         repo_url    : the url of the repository to fetch the package from.
         '''
-
+        self.install_pkgs([(name, pkg_type, install_dir)], fetch_dir,
+                          preserve_install_dir=preserve_install_dir,
+                          repo_url=repo_url)
+
+
+    def install_pkgs(self, pkgs, fetch_dir, preserve_install_dir=False,
+                     repo_url=None):
+        """Install several packages, like install_pkg does for one.
+
+        When all the repositories fetch packages with shell commands, the
+        checksum file and the packages are fetched, verified, untarred and
+        stamped with their checksum by a single command.  Otherwise, each
+        package is installed step by step.
+
+        @param pkgs: List of (name, pkg_type, install_dir) tuples.
+        @param fetch_dir: The directory the package tarballs are fetched to.
+        @param preserve_install_dir: Don't clean the install directories
+            before untarring the packages.
+        @param repo_url: The url of the repository to fetch the packages
+            from, instead of the repositories of the package manager.
+
+        @returns A dictionary mapping each package tarball name to a
+            dictionary of the seconds taken by each step of its install,
+            empty if the packages were installed step by step.
+        @raises PackageInstallError if any package could not be installed.
+        """
         # do_locking flag is on by default unless you disable it (typically
         # in the cases where packages are directly installed from the server
         # onto the client in which case fcntl stuff wont work as the code
         # will run on the server in that case..
+        lockfiles = []
         if self.do_locking:
-            lockfile_name = '.%s-%s-lock' % (name, pkg_type)
-            lockfile = open(os.path.join(self.pkgmgr_dir, lockfile_name), 'w')
+            for name, pkg_type in sorted(set((name, pkg_type)
+                                             for name, pkg_type, _ in pkgs)):
+                lockfile_name = '.%s-%s-lock' % (name, pkg_type)
+                lockfiles.append(open(os.path.join(self.pkgmgr_dir,
+                                                   lockfile_name), 'w'))
 
         try:
-            if self.do_locking:
+            for lockfile in lockfiles:
                 fcntl.flock(lockfile, fcntl.LOCK_EX)
 
-            self._run_command('mkdir -p %s' % fetch_dir)
-
-            pkg_name = self.get_tarball_name(name, pkg_type)
-            fetch_path = os.path.join(fetch_dir, pkg_name)
-            try:
-                # Fetch the package into fetch_dir
-                self.fetch_pkg(pkg_name, fetch_path, use_checksum=True)
-
-                # check to see if the install_dir exists and if it does
-                # then check to see if the .checksum file is the latest
-                if (self.exists(install_dir, target='dir') and
-                    not self.untar_required(fetch_path, install_dir)):
-                    return
-
-                # untar the package into install_dir and
-                # update the checksum in that directory
-                if not preserve_install_dir:
-                    # Make sure we clean up the install_dir
-                    self._run_command('rm -rf %s' % install_dir)
-                self._run_command('mkdir -p %s' % install_dir)
-
-                self.untar_pkg(fetch_path, install_dir)
-
-            except error.PackageFetchError, why:
-                raise error.PackageInstallError(
-                    'Installation of %s(type:%s) failed : %s'
-                    % (name, pkg_type, why))
+            repositories = self._get_repositories(repo_url)
+            if repositories and all(
+                    fetcher.get_fetch_command('', '') is not None
+                    for fetcher in repositories):
+                return self._install_pkgs_batched(
+                        pkgs, fetch_dir, preserve_install_dir, repositories)
+
+            for name, pkg_type, install_dir in pkgs:
+                self._install_pkg_by_steps(name, pkg_type, fetch_dir,
+                                           install_dir, preserve_install_dir,
+                                           repo_url)
+            return {}
         finally:
-            if self.do_locking:
+            for lockfile in reversed(lockfiles):
                 fcntl.flock(lockfile, fcntl.LOCK_UN)
                 lockfile.close()
 
 
+    def _install_pkg_by_steps(self, name, pkg_type, fetch_dir, install_dir,
+                              preserve_install_dir, repo_url):
+        '''
+        Install a package running a command for each step of the install.
+        The parameters are the same as for install_pkg.
+        '''
+        self._run_command('mkdir -p %s' % fetch_dir)
+
+        pkg_name = self.get_tarball_name(name, pkg_type)
+        fetch_path = os.path.join(fetch_dir, pkg_name)
+        try:
+            # Fetch the package into fetch_dir, in the zstd format if both
+            # the repositories and this host support it.
+            zstd_pkg_name = self.get_tarball_name(name, pkg_type,
+                                                  PACKAGE_FORMAT_ZSTD)
+            try:
+                if (not self.is_pkg_listed(zstd_pkg_name)
+                        or not self._is_zstd_supported()):
+                    raise error.PackageFetchError(
+                            '%s not available' % zstd_pkg_name)
+                zstd_fetch_path = os.path.join(fetch_dir, zstd_pkg_name)
+                self.fetch_pkg(zstd_pkg_name, zstd_fetch_path,
+                               repo_url=repo_url, use_checksum=True)
+                pkg_name, fetch_path = zstd_pkg_name, zstd_fetch_path
+            except error.PackageFetchError:
+                self.fetch_pkg(pkg_name, fetch_path, repo_url=repo_url,
+                               use_checksum=True)
+
+            # check to see if the install_dir exists and if it does
+            # then check to see if the .checksum file is the latest
+            if (self.exists(install_dir, target='dir') and
+                not self.untar_required(fetch_path, install_dir)):
+                return
+
+            # untar the package into install_dir and
+            # update the checksum in that directory
+            if not preserve_install_dir:
+                # Make sure we clean up the install_dir
+                self._run_command('rm -rf %s' % install_dir)
+            self._run_command('mkdir -p %s' % install_dir)
+
+            self.untar_pkg(fetch_path, install_dir)
+
+        except error.PackageFetchError, why:
+            raise error.PackageInstallError(
+                'Installation of %s(type:%s) failed : %s'
+                % (name, pkg_type, why))
+
+
+    @staticmethod
+    def _get_fetch_command(repositories, filename, dest_path):
+        """Return a shell command fetching a file from the repositories.
+
+        The repositories are tried in reverse order, like fetch_pkg does,
+        and whatever junk a failed fetch left is removed.
+
+        @param repositories: List of RepositoryFetcher objects.
+        @param filename: The filename of the file to fetch.
+        @param dest_path: Destination path to download the file to.
+        """
+        quoted_path = utils.sh_quote_word(dest_path)
+        commands = ['{ %s && [ -e %s ]; } || { rm -f %s; false; }'
+                    % (fetcher.get_fetch_command(filename, dest_path),
+                       quoted_path, quoted_path)
+                    for fetcher in reversed(repositories)]
+        return '{ %s; }' % ' || '.join(commands)
+
+
+    def _install_pkgs_batched(self, pkgs, fetch_dir, preserve_install_dir,
+                              repositories):
+        """Install packages with a single command.
+
+        The parameters are the same as for install_pkgs, with the
+        repositories to fetch the packages from.
+
+        @returns A dictionary mapping the tarball name of each package, in
+            the format installed, to a dictionary of the seconds taken by
+            each step of its install.
+        @raises PackageInstallError if any package could not be installed.
+        """
+        checksum_path = self._get_checksum_file_path()
+        script = [_BATCH_SCRIPT_HEADER,
+                  'checksums=%s\n' % utils.sh_quote_word(checksum_path),
+                  'mkdir -p %s\n' % utils.sh_quote_word(fetch_dir),
+                  # Fetch the checksum file if not already fetched.
+                  'start=$(_now)\n'
+                  'if [ -e "$checksums" ]; then\n'
+                  '  _step %(name)s fetch cached $start\n'
+                  'elif %(fetch)s; then\n'
+                  '  _step %(name)s fetch ok $start\n'
+                  'else\n'
+                  '  _step %(name)s fetch failed $start\n'
+                  'fi\n'
+                  % {'name': CHECKSUM_FILE,
+                     'fetch': self._get_fetch_command(
+                             repositories, CHECKSUM_FILE, checksum_path)}]
+        pkg_names = []
+        for name, pkg_type, install_dir in pkgs:
+            substitutions = {
+                    'install_dir': utils.sh_quote_word(install_dir),
+                    'clean': ('' if preserve_install_dir
+                              else 'rm -rf "$install_dir" &&')}
+            for pkg_format, prefix in ((PACKAGE_FORMAT_ZSTD, 'zstd'),
+                                       (PACKAGE_FORMAT_BZ2, 'bz2')):
+                pkg_name = self.get_tarball_name(name, pkg_type, pkg_format)
+                fetch_path = os.path.join(fetch_dir, pkg_name)
+                substitutions.update({
+                        prefix + '_name': utils.sh_quote_word(pkg_name),
+                        prefix + '_path': utils.sh_quote_word(fetch_path),
+                        prefix + '_fetch': utils.sh_quote_word(
+                                self._get_fetch_command(
+                                        repositories, pkg_name, fetch_path))})
+            pkg_names.append((self.get_tarball_name(name, pkg_type), name,
+                              pkg_type))
+            script.append(_BATCH_SCRIPT_PKG % substitutions)
+
+        result = self._run_command(
+                ''.join(script),
+                _run_command_dargs={
+                        'timeout': _BATCH_TIMEOUT_PER_PKG * len(pkgs),
+                        'ignore_status': True, 'verbose': False})
+        # The checksum file was changed by the command.
+        self._checksum_dict = {}
+
+        steps = {}
+        for line in result.stdout.splitlines():
+            fields = line.split()
+            if len(fields) < 4 or fields[0] != _BATCH_STEP_MARKER:
+                continue
+            try:
+                seconds = float(fields[5]) - float(fields[4])
+            except (IndexError, ValueError):
+                seconds = None
+            steps.setdefault(fields[1], {})[fields[2]] = (fields[3], seconds)
+
+        timings = {}
+        failures = []
+        for pkg_name, name, pkg_type in pkg_names:
+            zstd_pkg_name = self.get_tarball_name(name, pkg_type,
+                                                  PACKAGE_FORMAT_ZSTD)
+            if 'untar' in steps.get(zstd_pkg_name, {}):
+                pkg_name = zstd_pkg_name
+            pkg_steps = steps.get(pkg_name, {})
+            timings[pkg_name] = dict((step, seconds) for step, (_, seconds)
+                                     in pkg_steps.iteritems())
+            logging.info('Installed %s: %s', pkg_name, ', '.join(
+                    '%s %s in %s seconds' % (step, status,
+                                             'unknown' if seconds is None
+                                             else '%.2f' % seconds)
+                    for step, (status, seconds) in sorted(
+                            pkg_steps.iteritems())) or 'failed')
+            if pkg_steps.get('untar', ('failed',))[0] == 'failed':
+                if pkg_steps.get('fetch', ('failed',))[0] == 'failed':
+                    why = ('%s could not be fetched from any of the repos %s'
+                           % (pkg_name, [repo.url for repo in repositories]))
+                else:
+                    why = 'untar failed: %s' % result.stderr.strip()
+                failures.append('Installation of %s(type:%s) failed : %s'
+                                % (name, pkg_type, why))
+        if failures:
+            raise error.PackageInstallError('\n'.join(failures))
+        return timings
+
+
+    def _get_repositories(self, repo_url=None):
+        '''
+        Return the fetchers of the repositories to fetch packages from.
+        repo_url : the URL of a repository to use instead of the
+                   repositories of the package manager.
+        '''
+        if repo_url:
+            return [self.get_fetcher(repo_url)]
+        return self.repositories
+
+
     def fetch_pkg(self, pkg_name, dest_path, repo_url=None, use_checksum=False):
         '''
         Fetch the package into dest_dir from repo_url. By default repo_url
@@ -788,6 +1239,15 @@ class BasePackageManager(object):
         self._save_checksum_dict(checksum_dict)
 
 
+    def is_pkg_listed(self, pkg_name):
+        '''
+        Return True if the packages' checksum file lists the package, that is
+        if the package is in the repositories.
+        pkg_name :  The name of the package
+        '''
+        return pkg_name in self._get_checksum_dict()
+
+
     def remove_checksum(self, pkg_name):
         '''
         Remove the checksum of the package from the packages checksum file.
@@ -821,14 +1281,20 @@ class BasePackageManager(object):
 
     def tar_package(self, pkg_name, src_dir, dest_dir, exclude_string=None):
         '''
-        Create a tar.bz2 file with the name 'pkg_name' say test-blah.tar.bz2.
+        Create a tar.bz2 file with the name 'pkg_name' say test-blah.tar.bz2,
+        or a zstd package if the name ends with .tar.zst.
         Excludes the directories specified in exclude_string while tarring
         the source. Returns the tarball path.
         '''
         tarball_path = os.path.join(dest_dir, pkg_name)
         temp_path = tarball_path + '.tmp'
-        cmd_list = ['tar', '-cf', temp_path, '-C', src_dir]
-        if _PBZIP2_AVAILABLE:
+        zstd = pkg_name.endswith('.' + PACKAGE_FORMAT_ZSTD)
+        tar_path = temp_path + '.tar' if zstd else temp_path
+        cmd_list = ['tar', '-cf', tar_path, '-C', src_dir]
+        if zstd:
+            # Compressed by _write_zstd_package.
+            pass
+        elif _PBZIP2_AVAILABLE:
             cmd_list.append('--use-compress-prog=pbzip2')
         else:
             cmd_list.append('-j')
@@ -837,9 +1303,15 @@ class BasePackageManager(object):
 
         try:
             utils.system(' '.join(cmd_list))
+            if zstd:
+                _write_zstd_package(tar_path, temp_path)
         except:
-            os.unlink(temp_path)
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
             raise
+        finally:
+            if zstd and os.path.exists(tar_path):
+                os.unlink(tar_path)
 
         os.rename(temp_path, tarball_path)
         return tarball_path
@@ -869,10 +1341,12 @@ class BasePackageManager(object):
         ".checksum" file in the dest_dir containing the checksum
         of the tarball. This method
         assumes that the package to be untarred is of the form
-        <name>.tar.bz2
+        <name>.tar.bz2 or <name>.tar.zst
         '''
-        self._run_command('tar --no-same-owner -xjf %s -C %s' %
-                          (tarball_path, dest_dir))
+        self._run_command('%s_untar %s %s' % (
+                _UNTAR_FUNCTIONS, utils.sh_quote_word(tarball_path),
+                utils.sh_quote_word(dest_dir)),
+                _run_command_dargs={'verbose': False})
         # Put the .checksum file in the install_dir to note
         # where the package came from
         pkg_checksum = self.compute_checksum(tarball_path)
@@ -882,17 +1356,101 @@ class BasePackageManager(object):
                           % (pkg_checksum, pkg_checksum_path))
 
 
+    def extract_pkg_files(self, tarball_path, dest_dir, paths):
+        '''
+        Extract some files of a package, instead of untarring all of it.
+        Only the frames of a zstd package holding the files are
+        decompressed.
+        tarball_path : the path of the package.
+        dest_dir     : the directory to extract the files to.
+        paths        : list of the paths of the files in the package.
+                       All the files under a directory are extracted.
+        Returns the list of the member names extracted.
+        '''
+        quoted_path = utils.sh_quote_word(tarball_path)
+        zstd = tarball_path.endswith('.' + PACKAGE_FORMAT_ZSTD)
+        if zstd:
+            # The index of a zstd package is in a skippable frame.
+            index = self._run_command(
+                    '%ssize=$(_index_size %s) && tail -c +9 %s | '
+                    'head -c "$size"' % (_UNTAR_FUNCTIONS, quoted_path,
+                                         quoted_path),
+                    _run_command_dargs={'verbose': False}).stdout
+            entries = _parse_zstd_package_index(index)
+        else:
+            entries = [(None, None, name) for name in self._run_command(
+                    'tar -tjf %s' % quoted_path,
+                    _run_command_dargs={'verbose': False}).stdout.splitlines()]
+
+        wanted = [os.path.normpath(path) for path in paths]
+        members = []
+        frames = []
+        for offset, size, name in entries:
+            normalized = os.path.normpath(name)
+            if any(normalized == path or normalized.startswith(path + '/')
+                   for path in wanted):
+                members.append(name)
+                if (offset, size) not in frames:
+                    frames.append((offset, size))
+        if not members:
+            raise error.PackageError('%s not found in %s'
+                                     % (', '.join(paths), tarball_path))
+
+        # tar extracts the members under a directory given, and fails if
+        # they are given too.
+        normalized_members = set(os.path.normpath(member)
+                                 for member in members)
+        quoted_members = ' '.join(
+                utils.sh_quote_word(member) for member in members
+                if not any(parent in normalized_members for parent in
+                           _get_parent_dirs(os.path.normpath(member))))
+        if zstd:
+            self._run_command(
+                    'mkdir -p %s && for frame in %s; do '
+                    'tail -c +$((${frame%%:*} + 1)) %s | '
+                    'head -c ${frame#*:} | zstd -dqc; done | '
+                    'tar --no-same-owner -xf - -C %s %s'
+                    % (utils.sh_quote_word(dest_dir),
+                       ' '.join('%d:%d' % frame for frame in frames),
+                       quoted_path, utils.sh_quote_word(dest_dir),
+                       quoted_members),
+                    _run_command_dargs={'verbose': False})
+        else:
+            self._run_command(
+                    'mkdir -p %s && tar --no-same-owner -xjf %s -C %s %s'
+                    % (utils.sh_quote_word(dest_dir), quoted_path,
+                       utils.sh_quote_word(dest_dir), quoted_members),
+                    _run_command_dargs={'verbose': False})
+        return members
+
+
+    def _is_zstd_supported(self):
+        '''
+        Return whether zstd packages can be untarred where the packages
+        are installed.
+        '''
+        if self._zstd_supported is None:
+            try:
+                self._run_command('command -v zstd')
+                self._zstd_supported = True
+            except (error.CmdError, error.AutoservRunError):
+                self._zstd_supported = False
+        return self._zstd_supported
+
+
     @staticmethod
-    def get_tarball_name(name, pkg_type):
+    def get_tarball_name(name, pkg_type, pkg_format=PACKAGE_FORMAT_BZ2):
         """Converts a package name and type into a tarball name.
 
         @param name: The name of the package
         @param pkg_type: The type of the package
+        @param pkg_format: The format of the package, PACKAGE_FORMAT_BZ2 or
+            PACKAGE_FORMAT_ZSTD.
 
         @returns A tarball filename for that specific type of package
         """
         assert '-' not in pkg_type
-        return '%s-%s.tar.bz2' % (pkg_type, name)
+        return '%s-%s.%s' % (pkg_type, name, pkg_format)
 
 
     @staticmethod
@@ -904,8 +1462,8 @@ class BasePackageManager(object):
         @returns (name, pkg_type) where name is the package name and pkg_type
             is the package type.
         """
-        match = re.search(r'^([^-]*)-(.*)\.tar\.bz2$', tarball_name)
-        pkg_type, name = match.groups()
+        match = re.search(r'^([^-]*)-(.*)\.tar\.(bz2|zst)$', tarball_name)
+        pkg_type, name, _ = match.groups()
         return name, pkg_type
 
 
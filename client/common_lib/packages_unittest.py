@@ -0,0 +1,271 @@
+#!/usr/bin/python2
+
+"""Tests for the batched install of packages."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import common
+from autotest_lib.client.common_lib import error
+from autotest_lib.client.common_lib import packages
+from autotest_lib.client.common_lib import utils
+
+
+class ShellLessFetcher(packages.RepositoryFetcher):
+    """Fetcher copying files without running shell commands."""
+
+    def __init__(self, url):
+        self.url = url
+
+
+    def fetch_pkg_file(self, filename, dest_path):
+        try:
+            shutil.copy(os.path.join(self.url, filename), dest_path)
+        except IOError as e:
+            raise error.PackageFetchError(str(e))
+
+
+class InstallPkgsTest(unittest.TestCase):
+    """Tests for BasePackageManager.install_pkgs."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmpdir, 'repo')
+        self.autodir = os.path.join(self.tmpdir, 'autodir')
+        self.fetch_dir = os.path.join(self.autodir, 'packages')
+        os.makedirs(self.repo)
+        os.makedirs(self.autodir)
+        for name in ('sleeptest', 'dummy_Pass'):
+            self._create_package(name, 'content of %s' % name)
+        open(os.path.join(self.repo, packages.CHECKSUM_FILE), 'w').close()
+        self.commands = []
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def _create_package(self, name, content):
+        """Create a test package in the repository."""
+        src_dir = os.path.join(self.tmpdir, 'src', name)
+        if os.path.exists(src_dir):
+            shutil.rmtree(src_dir)
+        os.makedirs(src_dir)
+        with open(os.path.join(src_dir, 'file'), 'w') as f:
+            f.write(content)
+        utils.run('tar -cjf %s -C %s .' % (
+                os.path.join(self.repo, 'test-%s.tar.bz2' % name), src_dir))
+
+
+    def _run(self, command, **dargs):
+        """Run function recording the commands run."""
+        self.commands.append(command)
+        return utils.run(command, **dargs)
+
+
+    def _get_pkgmgr(self, repo=None):
+        return packages.PackageManager(
+                self.autodir, repo_urls=[repo or self.repo], do_locking=False,
+                run_function=self._run)
+
+
+    def _install(self, pkgmgr, names):
+        return pkgmgr.install_pkgs(
+                [(name, 'test', os.path.join(self.autodir, 'tests', name))
+                 for name in names], self.fetch_dir)
+
+
+    def _read_installed(self, name):
+        with open(os.path.join(self.autodir, 'tests', name, 'file')) as f:
+            return f.read()
+
+
+    def test_install(self):
+        """Test installing packages with a single command."""
+        timings = self._install(self._get_pkgmgr(),
+                                ['sleeptest', 'dummy_Pass'])
+        self.assertEqual(1, len(self.commands))
+        self.assertEqual(['test-dummy_Pass.tar.bz2', 'test-sleeptest.tar.bz2'],
+                         sorted(timings))
+        self.assertEqual(['fetch', 'untar'],
+                         sorted(timings['test-sleeptest.tar.bz2']))
+        self.assertEqual('content of sleeptest',
+                         self._read_installed('sleeptest'))
+        pkgmgr = self._get_pkgmgr()
+        self.assertEqual(['test-dummy_Pass.tar.bz2', 'test-sleeptest.tar.bz2'],
+                         sorted(pkgmgr._get_checksum_dict()))
+
+
+    def test_reinstall(self):
+        """Test that only packages that changed are fetched again."""
+        self._install(self._get_pkgmgr(), ['sleeptest', 'dummy_Pass'])
+        installed = os.path.join(self.autodir, 'tests', 'dummy_Pass', 'file')
+        os.remove(installed)
+        self._create_package('sleeptest', 'new content')
+        # Fetching the unchanged package again would fail.
+        os.remove(os.path.join(self.repo, 'test-dummy_Pass.tar.bz2'))
+        pkgmgr = self._get_pkgmgr()
+        checksum_dict = pkgmgr._get_checksum_dict()
+        checksum_dict['test-sleeptest.tar.bz2'] = 'outdated'
+        pkgmgr._save_checksum_dict(checksum_dict)
+
+        self._install(pkgmgr, ['sleeptest', 'dummy_Pass'])
+        self.assertEqual('new content', self._read_installed('sleeptest'))
+        # The package didn't change, so it was not untarred again.
+        self.assertFalse(os.path.exists(installed))
+
+
+    def test_missing_package(self):
+        """Test that a package missing from the repository fails."""
+        pkgmgr = self._get_pkgmgr()
+        self.assertRaises(error.PackageInstallError, self._install, pkgmgr,
+                          ['sleeptest', 'missing'])
+        self.assertEqual('content of sleeptest',
+                         self._read_installed('sleeptest'))
+        self.assertFalse(os.path.exists(
+                os.path.join(self.fetch_dir, 'test-missing.tar.bz2')))
+
+
+    def test_install_by_steps(self):
+        """Test installing from a fetcher without shell commands."""
+        timings = self._install(self._get_pkgmgr(ShellLessFetcher(self.repo)),
+                                ['sleeptest'])
+        self.assertEqual({}, timings)
+        self.assertTrue(len(self.commands) > 1)
+        self.assertEqual('content of sleeptest',
+                         self._read_installed('sleeptest'))
+
+
+    def _add_zstd_package(self, name):
+        """Add the zstd package of a test package to the repository."""
+        pkgmgr = self._get_pkgmgr()
+        pkg_name = pkgmgr.get_tarball_name(name, 'test',
+                                           packages.PACKAGE_FORMAT_ZSTD)
+        src_dir = os.path.join(self.tmpdir, 'src', name)
+        tarball_path = pkgmgr.tar_package(pkg_name, src_dir, self.repo, '.')
+        with open(os.path.join(self.repo, packages.CHECKSUM_FILE), 'a') as f:
+            f.write('%s %s\n' % (pkgmgr.compute_checksum(tarball_path),
+                                  pkg_name))
+
+
+    @unittest.skipUnless(packages.has_zstd(), 'zstd is not available')
+    def test_install_zstd(self):
+        """Test that zstd packages are installed when available."""
+        self._add_zstd_package('sleeptest')
+        timings = self._install(self._get_pkgmgr(),
+                                ['sleeptest', 'dummy_Pass'])
+        self.assertEqual(['test-dummy_Pass.tar.bz2', 'test-sleeptest.tar.zst'],
+                         sorted(timings))
+        self.assertEqual('content of sleeptest',
+                         self._read_installed('sleeptest'))
+
+
+    @unittest.skipUnless(packages.has_zstd(), 'zstd is not available')
+    def test_install_zstd_fallback(self):
+        """Test falling back to bz2 when a zstd package can't be fetched."""
+        self._add_zstd_package('sleeptest')
+        os.remove(os.path.join(self.repo, 'test-sleeptest.tar.zst'))
+        timings = self._install(self._get_pkgmgr(), ['sleeptest'])
+        self.assertEqual(['test-sleeptest.tar.bz2'], sorted(timings))
+        self.assertEqual('content of sleeptest',
+                         self._read_installed('sleeptest'))
+
+
+    @unittest.skipUnless(packages.has_zstd(), 'zstd is not available')
+    def test_install_zstd_by_steps(self):
+        """Test installing a zstd package step by step."""
+        self._add_zstd_package('sleeptest')
+        pkgmgr = self._get_pkgmgr(ShellLessFetcher(self.repo))
+        self._install(pkgmgr, ['sleeptest'])
+        self.assertTrue(os.path.exists(
+                os.path.join(self.fetch_dir, 'test-sleeptest.tar.zst')))
+        self.assertEqual('content of sleeptest',
+                         self._read_installed('sleeptest'))
+
+
+@unittest.skipUnless(packages.has_zstd(), 'zstd is not available')
+class ZstdPackageTest(unittest.TestCase):
+    """Tests for the zstd package format."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmpdir, 'src')
+        self.files = {}
+        for i in xrange(20):
+            path = os.path.join('dir%d' % (i % 3), 'file%d' % i)
+            self.files[path] = os.urandom(1000 + i)
+            if not os.path.isdir(os.path.join(self.src_dir,
+                                              os.path.dirname(path))):
+                os.makedirs(os.path.join(self.src_dir, os.path.dirname(path)))
+            with open(os.path.join(self.src_dir, path), 'wb') as f:
+                f.write(self.files[path])
+        self.pkgmgr = packages.PackageManager(self.tmpdir, do_locking=False)
+        # Make frames of a few members.
+        with mock.patch.object(packages, '_ZSTD_FRAME_SIZE', 4096):
+            self.tarball_path = self.pkgmgr.tar_package(
+                    'test-sleeptest.tar.zst', self.src_dir, self.tmpdir, '.')
+        self.dest_dir = os.path.join(self.tmpdir, 'dest')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def _check_extracted(self, paths):
+        """Check that exactly some files were extracted."""
+        extracted = []
+        for root, _, files in os.walk(self.dest_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    content = f.read()
+                path = os.path.relpath(path, self.dest_dir)
+                self.assertEqual(self.files.get(path), content)
+                extracted.append(path)
+        self.assertEqual(sorted(paths), sorted(extracted))
+
+
+    def test_index(self):
+        """Test that the index lists the frame of every member."""
+        index = packages.read_zstd_package_index(self.tarball_path)
+        names = [name for _, _, name in index]
+        for path in self.files:
+            self.assertIn('./' + path, names)
+        self.assertTrue(len(set((offset, size)
+                                for offset, size, _ in index)) > 3)
+
+
+    def test_untar(self):
+        """Test untarring the package, in parallel."""
+        os.makedirs(self.dest_dir)
+        self.pkgmgr.untar_pkg(self.tarball_path, self.dest_dir)
+        os.remove(os.path.join(self.dest_dir, '.checksum'))
+        self._check_extracted(self.files)
+
+
+    def test_untar_with_zstd(self):
+        """Test that the package is a regular zstd compressed archive."""
+        os.makedirs(self.dest_dir)
+        utils.run('zstd -dqc %s | tar -xf - -C %s' % (self.tarball_path,
+                                                      self.dest_dir))
+        self._check_extracted(self.files)
+
+
+    def test_extract_pkg_files(self):
+        """Test extracting only some files."""
+        members = self.pkgmgr.extract_pkg_files(
+                self.tarball_path, self.dest_dir, ['dir1', 'dir2/file5'])
+        self.assertIn('./dir2/file5', members)
+        self._check_extracted([path for path in self.files
+                               if path.startswith('dir1/')]
+                              + ['dir2/file5'])
+        self.assertRaises(error.PackageError, self.pkgmgr.extract_pkg_files,
+                          self.tarball_path, self.dest_dir, ['missing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,8 +13,10 @@ inheritance with, just a collection of static methods.
 
 import StringIO
 import collections
+import ctypes
 import datetime
 import errno
+import fcntl
 import inspect
 import itertools
 import logging
@@ -92,6 +94,16 @@ DEFAULT_STDERR_LEVEL = logging.ERROR
 STDOUT_PREFIX = '[stdout] '
 STDERR_PREFIX = '[stderr] '
 
+# Maximum number of bytes read from the output of a BgJob at once.
+_BG_JOB_READ_SIZE = 64 * 1024
+
+# Seconds between checks for the exit of BgJobs, when it can't be
+# waited for with a pidfd.
+_BG_JOB_POLL_INTERVAL_SECS = 1
+
+# pidfd_open() has the same number on all architectures, see pidfd_open(2).
+_SYS_PIDFD_OPEN = 434
+
 # safe characters for the shell (do not need quoting)
 SHELL_QUOTING_WHITELIST = frozenset(string.ascii_letters +
                                     string.digits +
@@ -244,9 +256,10 @@ class BgJob(object):
     def process_output(self, stdout=True, final_read=False):
         """Read from process's output stream, and write data to destinations.
 
-        This function reads up to 1024 bytes from the background job's
-        stdout or stderr stream, and writes the resulting data to the BgJob's
-        output tee and to the stream set up in output_prepare.
+        This function reads up to _BG_JOB_READ_SIZE bytes from the
+        background job's stdout or stderr stream, and writes the resulting
+        data to the BgJob's output tee and to the stream set up in
+        output_prepare.
 
         Warning: Calls to process_output will block on reads from the
         subprocess stream, and will block on writes to the configured
@@ -255,9 +268,11 @@ class BgJob(object):
         @param stdout: True = read and process data from job's stdout.
                        False = from stderr.
                        Default: True
-        @param final_read: Do not read only 1024 bytes from stream. Instead,
-                           read and process all data until end of the stream.
+        @param final_read: Do not read only _BG_JOB_READ_SIZE bytes from
+                           stream. Instead, read and process all data until
+                           end of the stream.
 
+        @return The number of bytes read, 0 at the end of the stream.
         """
         if self.unjoinable:
             raise error.InvalidBgJobCall('Cannot call process_output on '
@@ -270,21 +285,22 @@ class BgJob(object):
                 self.sp.stderr, self._stderr_file, self._stderr_tee)
 
         if not pipe:
-            return
+            return 0
 
         if final_read:
             # read in all the data we can from pipe and then stop
             data = []
             while select.select([pipe], [], [], 0)[0]:
-                data.append(os.read(pipe.fileno(), 1024))
+                data.append(os.read(pipe.fileno(), _BG_JOB_READ_SIZE))
                 if len(data[-1]) == 0:
                     break
             data = "".join(data)
         else:
             # perform a single read
-            data = os.read(pipe.fileno(), 1024)
+            data = os.read(pipe.fileno(), _BG_JOB_READ_SIZE)
         buf.write(data)
         tee.write(data)
+        return len(data)
 
     def cleanup(self):
         """Clean up after BgJob.
@@ -838,98 +854,222 @@ def join_bg_jobs(bg_jobs, timeout=None):
     return bg_jobs
 
 
-def _wait_for_commands(bg_jobs, start_time, timeout):
-    """Waits for background jobs by select polling their stdout/stderr.
+_pidfd_supported = True
 
-    @param bg_jobs: A list of background jobs to wait on.
-    @param start_time: Time used to calculate the timeout lifetime of a job.
-    @param timeout: The timeout of the list of bg_jobs.
 
-    @return: True if the return was due to a timeout, False otherwise.
+def _pidfd_open(pid):
+    """Open a file descriptor which becomes readable when a process exits.
+
+    @param pid: Process id of a child process.
+
+    @return The file descriptor, or None if pidfds are not supported, i.e.
+            before Linux 5.3.
     """
+    global _pidfd_supported
+    if not _pidfd_supported:
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.syscall(_SYS_PIDFD_OPEN, pid, 0)
+    except (AttributeError, OSError):
+        _pidfd_supported = False
+        return None
+    if fd < 0:
+        # Other errors, e.g. ESRCH for a process already reaped or EMFILE,
+        # only affect this process.
+        if ctypes.get_errno() in (errno.ENOSYS, errno.EPERM):
+            _pidfd_supported = False
+        return None
+    return fd
 
-    # To check for processes which terminate without producing any output
-    # a 1 second timeout is used in select.
-    SELECT_TIMEOUT = 1
 
-    read_list = []
-    write_list = []
-    reverse_dict = {}
+class _BgJobPoller(object):
+    """Waits for the I/O and the exit of background jobs with epoll.
 
-    for bg_job in bg_jobs:
-        if bg_job.sp.stdout:
-            read_list.append(bg_job.sp.stdout)
-            reverse_dict[bg_job.sp.stdout] = (bg_job, True)
-        if bg_job.sp.stderr:
-            read_list.append(bg_job.sp.stderr)
-            reverse_dict[bg_job.sp.stderr] = (bg_job, False)
-        if bg_job.string_stdin is not None:
-            write_list.append(bg_job.sp.stdin)
-            reverse_dict[bg_job.sp.stdin] = bg_job
-
-    if timeout:
-        stop_time = start_time + timeout
-        time_left = stop_time - time.time()
-    else:
-        time_left = None # so that select never times out
-
-    while not timeout or time_left > 0:
-        # select will return when we may write to stdin, when there is
-        # stdout/stderr output we can read (including when it is
-        # EOF, that is the process has terminated) or when a non-fatal
-        # signal was sent to the process. In the last case the select returns
-        # EINTR, and we continue waiting for the job if the signal handler for
-        # the signal that interrupted the call allows us to.
+    The output of the jobs is read as it becomes readable, and string stdin
+    is written as much as the pipe takes at once.  The exit of each job is
+    waited for with a pidfd where the kernel supports it, otherwise it is
+    checked after every event and every _BG_JOB_POLL_INTERVAL_SECS.
+    """
+
+    # Kinds of the file descriptors watched.
+    _STDOUT, _STDERR, _STDIN, _EXIT = range(4)
+
+    def __init__(self, bg_jobs, start_time):
+        """Watch the pipes and the exit of the jobs.
+
+        @param bg_jobs: A list of background jobs to wait on.
+        @param start_time: Time used to calculate the duration of the jobs.
+        """
+        self._start_time = start_time
+        self._epoll = select.epoll()
+        # fd -> (kind, bg_job)
+        self._reverse_dict = {}
+        # bg_job -> offset of the string stdin left to write
+        self._stdin_offsets = {}
+        # bg_job -> pidfd
+        self._pidfds = {}
+        self._running = set()
+        for bg_job in bg_jobs:
+            if bg_job.sp.stdout:
+                self._watch(bg_job.sp.stdout.fileno(), select.EPOLLIN,
+                            self._STDOUT, bg_job)
+            if bg_job.sp.stderr:
+                self._watch(bg_job.sp.stderr.fileno(), select.EPOLLIN,
+                            self._STDERR, bg_job)
+            if bg_job.string_stdin is not None:
+                fd = bg_job.sp.stdin.fileno()
+                fcntl.fcntl(fd, fcntl.F_SETFL,
+                            fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                self._stdin_offsets[bg_job] = 0
+                self._watch(fd, select.EPOLLOUT, self._STDIN, bg_job)
+            if bg_job.result.exit_status is None:
+                self._running.add(bg_job)
+                pidfd = _pidfd_open(bg_job.sp.pid)
+                if pidfd is not None:
+                    self._pidfds[bg_job] = pidfd
+                    self._watch(pidfd, select.EPOLLIN, self._EXIT, bg_job)
+
+
+    def _watch(self, fd, eventmask, kind, bg_job):
+        """Start watching a file descriptor of a job."""
+        self._epoll.register(fd, eventmask)
+        self._reverse_dict[fd] = (kind, bg_job)
+
+
+    def _unwatch(self, fd):
+        """Stop watching a file descriptor, if watched."""
+        if self._reverse_dict.pop(fd, None):
+            self._epoll.unregister(fd)
+
+
+    def _write_stdin(self, bg_job, eventmask):
+        """Write the string stdin of a job; close the pipe when done."""
+        pipe = bg_job.sp.stdin
+        offset = self._stdin_offsets[bg_job]
+        done = bool(eventmask & (select.EPOLLERR | select.EPOLLHUP))
+        if not done:
+            try:
+                offset += os.write(pipe.fileno(),
+                                   memoryview(bg_job.string_stdin)[offset:])
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return
+                if e.errno != errno.EPIPE:
+                    raise
+                # The process closed its stdin.
+                done = True
+            self._stdin_offsets[bg_job] = offset
+            done = done or offset >= len(bg_job.string_stdin)
+        if done:
+            self._unwatch(pipe.fileno())
+            del self._stdin_offsets[bg_job]
+            bg_job.string_stdin = bg_job.string_stdin[offset:]
+            pipe.close()
+
+
+    def _check_exit(self, bg_job):
+        """Record the exit status of a job, if it exited.
+
+        Its output is not watched any more; the rest of it is read by the
+        final read in join_bg_jobs().
+        """
+        if bg_job not in self._running:
+            return
+        exit_status = bg_job.sp.poll()
+        if exit_status is None:
+            return
+        bg_job.result.exit_status = exit_status
+        bg_job.result.duration = time.time() - self._start_time
+        self._running.remove(bg_job)
+        for pipe in (bg_job.sp.stdout, bg_job.sp.stderr):
+            if pipe:
+                self._unwatch(pipe.fileno())
+        self._close_pidfd(bg_job)
+
+
+    def _close_pidfd(self, bg_job):
+        """Stop watching the exit of a job."""
+        pidfd = self._pidfds.pop(bg_job, None)
+        if pidfd is not None:
+            self._unwatch(pidfd)
+            os.close(pidfd)
+
+
+    def all_finished(self):
+        """Return whether all the jobs exited."""
+        return not self._running
+
+
+    def wait(self, timeout):
+        """Wait for events, and handle them.
+
+        @param timeout: Maximum number of seconds to wait, None to wait for
+                        an event.
+        """
+        if len(self._pidfds) < len(self._running):
+            # Some exits can't be waited for.
+            timeout = min(_BG_JOB_POLL_INTERVAL_SECS,
+                          _BG_JOB_POLL_INTERVAL_SECS if timeout is None
+                          else timeout)
         try:
-            read_ready, write_ready, _ = select.select(read_list, write_list,
-                                                       [], SELECT_TIMEOUT)
-        except select.error as v:
-            if v[0] == errno.EINTR:
-                logging.warning(v)
+            events = self._epoll.poll(-1 if timeout is None else timeout)
+        except IOError as e:
+            # A non-fatal signal was sent to the process; we continue
+            # waiting for the job if the signal handler for the signal
+            # that interrupted the call allows us to.
+            if e.errno == errno.EINTR:
+                logging.warning(e)
+                return
+            raise
+        for fd, eventmask in events:
+            if fd not in self._reverse_dict:
                 continue
+            kind, bg_job = self._reverse_dict[fd]
+            if kind in (self._STDOUT, self._STDERR):
+                if not bg_job.process_output(kind == self._STDOUT):
+                    # End of the stream, which would stay readable.
+                    self._unwatch(fd)
+            elif kind == self._STDIN:
+                self._write_stdin(bg_job, eventmask)
             else:
-                raise
-        # os.read() has to be used instead of
-        # subproc.stdout.read() which will otherwise block
-        for file_obj in read_ready:
-            bg_job, is_stdout = reverse_dict[file_obj]
-            bg_job.process_output(is_stdout)
-
-        for file_obj in write_ready:
-            # we can write PIPE_BUF bytes without blocking
-            # POSIX requires PIPE_BUF is >= 512
-            bg_job = reverse_dict[file_obj]
-            file_obj.write(bg_job.string_stdin[:512])
-            bg_job.string_stdin = bg_job.string_stdin[512:]
-            # no more input data, close stdin, remove it from the select set
-            if not bg_job.string_stdin:
-                file_obj.close()
-                write_list.remove(file_obj)
-                del reverse_dict[file_obj]
-
-        all_jobs_finished = True
-        for bg_job in bg_jobs:
-            if bg_job.result.exit_status is not None:
-                continue
+                self._check_exit(bg_job)
+        for bg_job in list(self._running):
+            if bg_job not in self._pidfds:
+                self._check_exit(bg_job)
 
-            bg_job.result.exit_status = bg_job.sp.poll()
-            if bg_job.result.exit_status is not None:
-                # process exited, remove its stdout/stdin from the select set
-                bg_job.result.duration = time.time() - start_time
-                if bg_job.sp.stdout:
-                    read_list.remove(bg_job.sp.stdout)
-                    del reverse_dict[bg_job.sp.stdout]
-                if bg_job.sp.stderr:
-                    read_list.remove(bg_job.sp.stderr)
-                    del reverse_dict[bg_job.sp.stderr]
-            else:
-                all_jobs_finished = False
 
-        if all_jobs_finished:
-            return False
+    def close(self):
+        """Stop watching."""
+        for bg_job, offset in self._stdin_offsets.items():
+            bg_job.string_stdin = bg_job.string_stdin[offset:]
+        for bg_job in self._pidfds.keys():
+            self._close_pidfd(bg_job)
+        self._epoll.close()
+
 
-        if timeout:
-            time_left = stop_time - time.time()
+def _wait_for_commands(bg_jobs, start_time, timeout):
+    """Waits for background jobs, handling their I/O as it comes.
+
+    @param bg_jobs: A list of background jobs to wait on.
+    @param start_time: Time used to calculate the timeout lifetime of a job.
+    @param timeout: The timeout of the list of bg_jobs.
+
+    @return: True if the return was due to a timeout, False otherwise.
+    """
+    poller = _BgJobPoller(bg_jobs, start_time)
+    try:
+        while not poller.all_finished():
+            time_left = None
+            if timeout:
+                time_left = start_time + timeout - time.time()
+                if time_left <= 0:
+                    break
+            poller.wait(time_left)
+        else:
+            return False
+    finally:
+        poller.close()
 
     # Kill all processes which did not complete prior to timeout
     for bg_job in bg_jobs:
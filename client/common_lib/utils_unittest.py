@@ -785,6 +785,30 @@ class test_run(unittest.TestCase):
                             cmd, stdout='hi!\n')
 
 
+    def test_large_stdin_and_output(self):
+        """Test input and output larger than the pipe buffers."""
+        cmd = 'cat && cat >&2 < /dev/null'
+        data = ''.join(chr(i % 256) for i in xrange(1024 * 1024))
+        self.__check_result(utils.run(cmd, verbose=False, stdin=data),
+                            cmd, stdout=data)
+
+
+    def test_stdin_not_read(self):
+        """Test a command exiting before reading all of its string stdin."""
+        cmd = 'head -c 3'
+        self.__check_result(
+                utils.run(cmd, verbose=False, stdin='x' * 1024 * 1024),
+                cmd, stdout='xxx')
+
+
+    def test_without_pidfd(self):
+        """Test waiting for commands when exits are polled for."""
+        self.god.stub_function_to_return(utils, '_pidfd_open', None)
+        cmd = 'sleep 0.1 && echo output'
+        self.__check_result(utils.run(cmd, verbose=False), cmd,
+                            stdout='output\n')
+
+
     def test_stdout_tee_to_logs_info(self):
         """Test logging stdout at the info level."""
         utils.run('echo output', stdout_tee=utils.TEE_TO_LOGS,
@@ -834,23 +858,77 @@ class test_run(unittest.TestCase):
 
 
     def test_wait_interrupt(self):
-        """Test that we actually select twice if the first one returns EINTR."""
+        """Test that we actually poll twice if the first one returns EINTR."""
         utils.logging.debug.expect_any_call()
 
         bg_job = utils.BgJob('echo "hello world"')
-        bg_job.result.exit_status = 0
-        self.god.stub_function(utils.select, 'select')
+        epoll = utils.select.epoll
 
-        utils.select.select.expect_any_call().and_raises(
-                select.error(errno.EINTR, 'Select interrupted'))
-        utils.logging.warning.expect_any_call()
+        class interrupted_epoll(object):
+            """epoll object whose first poll is interrupted."""
+            def __init__(self):
+                self._epoll = epoll()
+                self._interrupted = False
 
-        utils.select.select.expect_any_call().and_return(
-                ([bg_job.sp.stdout, bg_job.sp.stderr], [], None))
+            def poll(self, timeout):
+                if not self._interrupted:
+                    self._interrupted = True
+                    raise IOError(errno.EINTR, 'Interrupted system call')
+                return self._epoll.poll(timeout)
+
+            def __getattr__(self, name):
+                return getattr(self._epoll, name)
+
+        self.god.stub_with(utils.select, 'epoll', interrupted_epoll)
         utils.logging.warning.expect_any_call()
 
         self.assertFalse(
                 utils._wait_for_commands([bg_job], time.time(), None))
+        self.assertEqual(bg_job.result.exit_status, 0)
+        self.god.check_playback()
+
+
+class test_pidfd_open(unittest.TestCase):
+    """Tests for _pidfd_open()."""
+
+    def setUp(self):
+        patcher = pymock.patch.object(utils, '_pidfd_supported', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = pymock.patch.object(utils.ctypes, 'CDLL')
+        self.libc = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.libc.syscall.return_value = -1
+
+
+    def _pidfd_open_with_errno(self, err):
+        with pymock.patch.object(utils.ctypes, 'get_errno', return_value=err):
+            return utils._pidfd_open(1234)
+
+
+    def test_open(self):
+        """Test that the pidfd of the process is returned."""
+        self.libc.syscall.return_value = 5
+        self.assertEqual(5, utils._pidfd_open(1234))
+        self.assertTrue(utils._pidfd_supported)
+
+
+    def test_not_supported(self):
+        """Test that pidfds are not tried again when unsupported."""
+        for err in (errno.ENOSYS, errno.EPERM):
+            utils._pidfd_supported = True
+            self.assertIsNone(self._pidfd_open_with_errno(err))
+            self.assertFalse(utils._pidfd_supported)
+            self.libc.syscall.reset_mock()
+            self.assertIsNone(utils._pidfd_open(1234))
+            self.assertFalse(self.libc.syscall.called)
+
+
+    def test_transient_error(self):
+        """Test that other errors only affect the process."""
+        for err in (errno.ESRCH, errno.EMFILE):
+            self.assertIsNone(self._pidfd_open_with_errno(err))
+            self.assertTrue(utils._pidfd_supported)
 
 
 class test_compare_versions(unittest.TestCase):
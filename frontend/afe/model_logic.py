@@ -7,6 +7,7 @@ from django.db import connection
 from django.db import connections
 from django.db import models as dbmodels
 from django.db import transaction
+from django.db.models.query import prefetch_related_objects
 from django.db.models.sql import query
 import django.db.models.sql.where
 
@@ -952,6 +953,50 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         return serialized
 
 
+    @classmethod
+    def _get_serialization_lookups(cls, prefix=''):
+        """Lists the relations followed when serializing objects of a model.
+
+        @param prefix: Lookup path of this model, to prepend to its links.
+
+        @returns A list of lookups for prefetch_related, e.g.
+                 ['aclgroup_set', 'aclgroup_set__users'].
+        """
+        lookups = []
+        for link in sorted(cls.SERIALIZATION_LINKS_TO_FOLLOW):
+            # Reverse relations, e.g. aclgroup_set, are only reachable by
+            # their accessor through the descriptor.
+            descriptor = getattr(cls, link)
+            if hasattr(descriptor, 'related'):
+                related_model = descriptor.related.model
+            else:
+                related_model = descriptor.field.rel.to
+            lookups.append(prefix + link)
+            if hasattr(related_model, '_get_serialization_lookups'):
+                lookups.extend(related_model._get_serialization_lookups(
+                        prefix + link + '__'))
+        return lookups
+
+
+    @classmethod
+    def serialize_objects(cls, objects):
+        """Serializes objects of this model with their dependencies.
+
+        This returns the same as calling serialize() on each object, but
+        fetches the dependencies of all the objects in one query per
+        relation, instead of a few queries per object.
+
+        @param objects: Iterable of objects of this model.
+
+        @returns: List of dictionary representations of the objects.
+        """
+        objects = list(objects)
+        if objects and cls.SERIALIZATION_LINKS_TO_FOLLOW:
+            prefetch_related_objects(objects,
+                                     cls._get_serialization_lookups())
+        return [obj.serialize() for obj in objects]
+
+
     def _serialize_relation(self, link):
         """Serializes dependent objects given the name of the relation.
 
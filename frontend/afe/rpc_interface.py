@@ -649,6 +649,13 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
     models.Host.objects.populate_relationships(hosts,
                                                models.StaticHostAttribute,
                                                'staticattribute_list')
+    if RESPECT_STATIC_LABELS:
+        replacing_labels = rpc_utils.get_replacing_static_labels(
+                label for host_obj in hosts for label in host_obj.label_list)
+    if include_current_job:
+        current_jobs, current_special_tasks = (
+                rpc_utils.get_current_jobs_and_special_tasks(
+                        [host_obj.id for host_obj in hosts]))
     host_dicts = []
     for host_obj in hosts:
         host_dict = host_obj.get_object_dict()
@@ -656,15 +663,10 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
         host_dict['attributes'] = dict((attribute.attribute, attribute.value)
                                        for attribute in host_obj.attribute_list)
         if RESPECT_STATIC_LABELS:
-            label_list = []
             # Only keep static labels which has a corresponding entries in
             # afe_labels.
-            for label in host_obj.label_list:
-                if label.is_replaced_by_static():
-                    static_label = models.StaticLabel.smart_get(label.name)
-                    label_list.append(static_label)
-                else:
-                    label_list.append(label)
+            label_list = [replacing_labels.get(label.id, label)
+                          for label in host_obj.label_list]
 
             host_dict['labels'] = [label.name for label in label_list]
             host_dict['platform'] = rpc_utils.find_platform(
@@ -681,19 +683,9 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
                     host_dict['attributes'][attr.attribute] = attr.value
 
         if include_current_job:
-            host_dict['current_job'] = None
-            host_dict['current_special_task'] = None
-            entries = models.HostQueueEntry.objects.filter(
-                    host_id=host_dict['id'], active=True, complete=False)
-            if entries:
-                host_dict['current_job'] = (
-                        entries[0].get_object_dict()['job'])
-            tasks = models.SpecialTask.objects.filter(
-                    host_id=host_dict['id'], is_active=True, is_complete=False)
-            if tasks:
-                host_dict['current_special_task'] = (
-                        '%d-%s' % (tasks[0].get_object_dict()['id'],
-                                   tasks[0].get_object_dict()['task'].lower()))
+            host_dict['current_job'] = current_jobs.get(host_obj.id)
+            host_dict['current_special_task'] = current_special_tasks.get(
+                    host_obj.id)
         host_dicts.append(host_dict)
 
     return rpc_utils.prepare_for_serialization(host_dicts)
@@ -2077,19 +2069,15 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
     shard_obj = rpc_utils.retrieve_shard(shard_hostname=shard_hostname)
     rpc_utils.persist_records_sent_from_shard(shard_obj, jobs, hqes)
     assert len(known_host_ids) == len(known_host_statuses)
-    for i in range(len(known_host_ids)):
-        host_model = models.Host.objects.get(pk=known_host_ids[i])
-        if host_model.status != known_host_statuses[i]:
-            host_model.status = known_host_statuses[i]
-            host_model.save()
+    rpc_utils.update_host_statuses(known_host_ids, known_host_statuses)
 
     hosts, jobs, suite_keyvals, inc_ids = rpc_utils.find_records_for_shard(
             shard_obj, known_job_ids=known_job_ids,
             known_host_ids=known_host_ids)
     return {
-        'hosts': [host.serialize() for host in hosts],
-        'jobs': [job.serialize() for job in jobs],
-        'suite_keyvals': [kv.serialize() for kv in suite_keyvals],
+        'hosts': models.Host.serialize_objects(hosts),
+        'jobs': models.Job.serialize_objects(jobs),
+        'suite_keyvals': models.JobKeyval.serialize_objects(suite_keyvals),
         'incorrect_host_ids': [int(i) for i in inc_ids],
     }
 
@@ -33,6 +33,19 @@ SERVER = control_data.CONTROL_TYPE_NAMES.SERVER
 _hqe_status = models.HostQueueEntry.Status
 
 
+def _count_queries(func, *args, **kwargs):
+    """Count the database queries made by a function call."""
+    # Django is only set up once setup_django_environment is imported.
+    from django.db import connection
+    connection.use_debug_cursor = True
+    try:
+        queries_before = len(connection.queries)
+        func(*args, **kwargs)
+        return len(connection.queries) - queries_before
+    finally:
+        connection.use_debug_cursor = None
+
+
 class ShardHeartbeatTest(mox.MoxTestBase, unittest.TestCase):
 
     _PRIORITY = priorities.Priority.DEFAULT
@@ -415,6 +428,29 @@ class RpcInterfaceTestWithStaticLabel(ShardHeartbeatTest,
         self.assertEquals(host['hostname'], 'test_host')
 
 
+    def test_get_hosts_query_count(self):
+        host1 = self._fake_host_with_static_labels()
+        one_host_queries = _count_queries(rpc_interface.get_hosts,
+                                          hostname=host1.hostname)
+        for hostname in ('test_host2', 'test_host3'):
+            host = models.Host.objects.create(hostname=hostname)
+            host.labels = host1.labels.all()
+            host.static_labels = host1.static_labels.all()
+
+        hostnames = ['test_host', 'test_host2', 'test_host3']
+        hosts = rpc_interface.get_hosts(hostname__in=hostnames)
+        self.assertEquals(sorted(host['hostname'] for host in hosts),
+                          hostnames)
+        for host in hosts:
+            self.assertEquals(host['labels'],
+                              ['non_static_label1', 'static_platform'])
+            self.assertEquals(host['platform'], 'static_platform')
+        self.assertEquals(
+                _count_queries(rpc_interface.get_hosts,
+                               hostname__in=hostnames),
+                one_host_queries)
+
+
     def test_delete_static_label(self):
         label1 = models.Label.smart_get('static')
 
@@ -784,6 +820,40 @@ class RpcInterfaceTest(unittest.TestCase,
         self._check_hostnames(hosts, ['host1'])
 
 
+    def test_get_hosts_include_current_job(self):
+        job = self._create_job(hosts=[1], active=True)
+        job.hostqueueentry_set.update(active=True)
+        task = models.SpecialTask.objects.create(
+                host=self.hosts[1], task=models.SpecialTask.Task.VERIFY,
+                is_active=True, requested_by=models.User.current_user())
+
+        hosts = dict((host['hostname'], host) for host in
+                     rpc_interface.get_hosts(include_current_job=True))
+        self.assertEquals(hosts['host1']['current_job'], job.id)
+        self.assertEquals(hosts['host1']['current_special_task'], None)
+        self.assertEquals(hosts['host2']['current_job'], None)
+        self.assertEquals(hosts['host2']['current_special_task'],
+                          '%d-verify' % task.id)
+        self.assertEquals(hosts['host3']['current_job'], None)
+        self.assertEquals(hosts['host3']['current_special_task'], None)
+
+
+    def test_get_hosts_query_count(self):
+        for host in self.hosts:
+            job = self._create_job(hosts=[host.id], active=True)
+            job.hostqueueentry_set.update(active=True)
+            models.SpecialTask.objects.create(
+                    host=host, task=models.SpecialTask.Task.VERIFY,
+                    is_active=True, requested_by=models.User.current_user())
+
+        one_host_queries = _count_queries(
+                rpc_interface.get_hosts, hostname='host1',
+                include_current_job=True)
+        all_hosts_queries = _count_queries(
+                rpc_interface.get_hosts, include_current_job=True)
+        self.assertEquals(all_hosts_queries, one_host_queries)
+
+
     def test_job_keyvals(self):
         keyval_dict = {'mykey': 'myvalue'}
         job_id = rpc_interface.create_job(name='test',
@@ -1888,5 +1958,74 @@ class ExtraRpcInterfaceTest(frontend_test_utils.FrontendTestMixin,
         self._testResendHostsAfterFailedHeartbeatHelper(host1)
 
 
+    def testShardHeartbeatHostStatuses(self):
+        """Check that the host statuses sent by a shard are saved."""
+        shard1, host1, label1 = self._createShardAndHostWithLabel()
+        host2 = models.Host.objects.create(hostname='host2', leased=False,
+                                           shard=shard1)
+        host3 = models.Host.objects.create(hostname='host3', leased=False,
+                                           shard=shard1)
+        host1.status = models.Host.Status.RUNNING
+        host2.status = models.Host.Status.REPAIRING
+        host3.status = models.Host.Status.REPAIRING
+
+        self._do_heartbeat_and_assert_response(
+                known_hosts=[host1, host2, host3])
+        self.assertEqual(
+                [models.Host.objects.get(pk=host.id).status
+                 for host in (host1, host2, host3)],
+                [models.Host.Status.RUNNING, models.Host.Status.REPAIRING,
+                 models.Host.Status.REPAIRING])
+
+
+    def testShardHeartbeatHostStatusesAclViolation(self):
+        """Check that no status is saved if a changed host is not accessible.
+        """
+        shard1, host1, label1 = self._createShardAndHostWithLabel()
+        host2 = models.Host.objects.create(hostname='host2', leased=False,
+                                           shard=shard1)
+        host2.status = models.Host.Status.REPAIRING
+
+        self.mox.StubOutWithMock(models.AclGroup,
+                                 'check_for_acl_violation_hosts')
+        models.AclGroup.check_for_acl_violation_hosts(
+                mox.Func(lambda hosts: [host.id for host in hosts] ==
+                         [host2.id])).AndRaise(
+                                 models.AclAccessViolation('denied'))
+        self.mox.ReplayAll()
+        self.assertRaises(models.AclAccessViolation,
+                          rpc_utils.update_host_statuses,
+                          [host1.id, host2.id],
+                          [host1.status, host2.status])
+        self.assertEqual(models.Host.objects.get(pk=host2.id).status,
+                         models.Host.Status.READY)
+
+
+    def testSerializeObjects(self):
+        """Check bulk serialization matches serializing each object."""
+        shard1, host1, label1 = self._createShardAndHostWithLabel()
+        host2 = models.Host.objects.create(hostname='host2', leased=False,
+                                           shard=shard1)
+        host2.labels.add(label1)
+        host2.set_attribute('attribute1', 'value1')
+        job1 = self._createJobForLabel(label1)
+        job2 = self._createJobForLabel(label1)
+
+        for model, objects in ((models.Host, [host1, host2]),
+                               (models.Job, [job1, job2])):
+            objects = list(model.objects.filter(
+                    pk__in=[obj.id for obj in objects]).order_by('id'))
+            expected = [obj.serialize() for obj in objects]
+            objects = list(model.objects.filter(
+                    pk__in=[obj.id for obj in objects]).order_by('id'))
+            self.assertEqual(model.serialize_objects(objects), expected)
+
+        # Serializing more objects doesn't make more queries.
+        hosts = list(models.Host.objects.all())
+        self.assertEqual(
+                _count_queries(models.Host.serialize_objects, hosts[:1]),
+                _count_queries(models.Host.serialize_objects, hosts))
+
+
 if __name__ == '__main__':
     unittest.main()
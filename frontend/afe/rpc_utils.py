@@ -580,6 +580,87 @@ def find_platform(hostname, label_list):
     return platform
 
 
+# The default maximum value of a host parameter number in SQLite is 999.
+_QUERY_BATCH_SIZE = 900
+
+
+def _batches(items):
+    """Split a list of query parameters into batches of a safe size.
+
+    @param items: A list.
+
+    @returns A generator of lists of at most _QUERY_BATCH_SIZE items.
+    """
+    for i in xrange(0, len(items), _QUERY_BATCH_SIZE):
+        yield items[i:i + _QUERY_BATCH_SIZE]
+
+
+def get_replacing_static_labels(labels):
+    """Find the static labels replacing labels, in bulk.
+
+    This is the same as calling is_replaced_by_static() on each label, and
+    StaticLabel.smart_get() on the labels replaced, in a fixed number of
+    queries.
+
+    @param labels: An iterable of Label objects.
+
+    @returns A dictionary mapping the id of each label replaced by a static
+             label to the StaticLabel object.
+    """
+    names_by_id = dict((label.id, label.name) for label in labels)
+    replaced_ids = []
+    for ids in _batches(names_by_id.keys()):
+        replaced_ids.extend(models.ReplacedLabel.objects.filter(
+                label__id__in=ids).values_list('label_id', flat=True))
+
+    replaced_names = list(set(names_by_id[label_id]
+                              for label_id in replaced_ids))
+    static_labels = {}
+    for names in _batches(replaced_names):
+        for static_label in models.StaticLabel.objects.filter(
+                name__in=names):
+            static_labels[static_label.name] = static_label
+
+    replacing_labels = {}
+    for label_id in replaced_ids:
+        name = names_by_id[label_id]
+        if name not in static_labels:
+            # Raises the same error as without bulk lookups.
+            static_labels[name] = models.StaticLabel.smart_get(name)
+        replacing_labels[label_id] = static_labels[name]
+    return replacing_labels
+
+
+def get_current_jobs_and_special_tasks(host_ids):
+    """Find the job and special task running on each host, in bulk.
+
+    @param host_ids: A list of host ids.
+
+    @returns A tuple of two dictionaries:
+             - host id -> id of the job running on the host.
+             - host id -> "<id>-<task>" of the special task running on the
+               host, e.g. "12-verify".
+             Hosts running nothing are not in the dictionaries.  If a host
+             has more than one active entry or task, the first one is used.
+    """
+    current_jobs = {}
+    current_special_tasks = {}
+    for ids in _batches(host_ids):
+        entries = models.HostQueueEntry.objects.filter(
+                host_id__in=ids, active=True, complete=False).order_by('id')
+        for host_id, job_id in entries.values_list('host_id', 'job_id'):
+            current_jobs.setdefault(host_id, job_id)
+
+        tasks = models.SpecialTask.objects.filter(
+                host_id__in=ids, is_active=True, is_complete=False).order_by(
+                        'id')
+        for host_id, task_id, task in tasks.values_list('host_id', 'id',
+                                                        'task'):
+            current_special_tasks.setdefault(host_id,
+                                             '%d-%s' % (task_id, task.lower()))
+    return current_jobs, current_special_tasks
+
+
 # support for get_host_queue_entries_and_special_tasks()
 
 def _common_entry_to_dict(entry, type, job_dict, exec_path, status, started_on):
@@ -946,6 +1027,37 @@ def retrieve_shard(shard_hostname):
     return models.Shard.smart_get(shard_hostname)
 
 
+def update_host_statuses(known_host_ids, known_host_statuses):
+    """Update the statuses of hosts to the ones reported by a shard.
+
+    The hosts are read in one query, and the ones whose status changed are
+    updated with one query per new status.  Like Host.save(), each change is
+    logged and the ACLs of the changed hosts are checked, all at once.  Ids
+    of hosts that don't exist are ignored.
+
+    @param known_host_ids: List of ids of hosts the shard has.
+    @param known_host_statuses: List of the statuses of these hosts.
+
+    @raises AclAccessViolation if the current user doesn't have access to
+            a changed host.  No host is updated then.
+    """
+    reported_statuses = dict(zip(known_host_ids, known_host_statuses))
+    changed_hosts = []
+    changed_host_ids = collections.defaultdict(list)
+    for ids in _batches(reported_statuses.keys()):
+        for host in models.Host.objects.filter(id__in=ids):
+            new_status = reported_statuses[host.id]
+            if host.status != new_status:
+                logging.info('%s -> %s', host.hostname, new_status)
+                changed_hosts.append(host)
+                changed_host_ids[new_status].append(host.id)
+
+    models.AclGroup.check_for_acl_violation_hosts(changed_hosts)
+    for status, host_ids in changed_host_ids.iteritems():
+        for ids in _batches(host_ids):
+            models.Host.objects.filter(id__in=ids).update(status=status)
+
+
 def find_records_for_shard(shard, known_job_ids, known_host_ids):
     """Find records that should be sent to a shard.
 
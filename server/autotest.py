@@ -2,10 +2,14 @@
 #pylint: disable-msg=C0111
 
 import glob
+import hashlib
 import logging
 import os
 import re
+import stat
+import StringIO
 import sys
+import tarfile
 import tempfile
 import time
 import traceback
@@ -39,6 +43,25 @@ AUTOTEST_HTTP = 'http://test.kernel.org/svn/autotest/trunk/client'
 _CONFIG = global_config.global_config
 AUTOSERV_PREBUILD = _CONFIG.get_config_value(
         'AUTOSERV', 'enable_server_prebuild', type=bool, default=False)
+INCREMENTAL_CLIENT_INSTALL = _CONFIG.get_config_value(
+        'AUTOSERV', 'enable_incremental_client_install', type=bool,
+        default=False)
+
+# Directories of the client not installed with it, their content is fetched
+# as packages when needed.
+_CLIENT_DIRS_TO_EXCLUDE = frozenset(['tests', 'site_tests', 'deps',
+                                     'profilers', 'packages'])
+
+# Files in the autodir of a client installed incrementally: the manifest of
+# the files installed, and its hash.
+_MANIFEST_FILE = '.autotest_manifest'
+_MANIFEST_HASH_FILE = '.autotest_manifest.sha1'
+# Printed instead of the manifest when the installed client is up to date.
+_MANIFEST_MATCH = 'MANIFEST_MATCH'
+# Files of an incremental install, sent to the autodir in a tarball.
+_INSTALL_TARBALL = '.autotest_install.tar.gz'
+_NEW_MANIFEST_FILE = '.autotest_manifest.new'
+_REMOVED_FILES_FILE = '.autotest_manifest.removed'
 
 # Match on a line like this:
 # FAIL test_name  test_name timestamp=1 localtime=Nov 15 12:43:10 <fail_msg>
@@ -46,6 +69,72 @@ _FAIL_STATUS_RE = re.compile(
     r'\s*FAIL.*localtime=.*\s*.*\s*[0-9]+:[0-9]+:[0-9]+\s*(?P<fail_msg>.*)')
 
 
+def _clean_autodir_command(autodir):
+    """Return a command removing everything in the autodir but packages.
+
+    The packages and result_tools directories are kept.
+
+    @param autodir: Autotest directory on the host.
+    """
+    return ('cd %s && ls | grep -v "^packages$" | grep -v "^result_tools$"'
+            ' | xargs rm -rf && rm -rf .[!.]*' % autodir)
+
+
+def _compute_client_manifest(client_dir):
+    """Compute the manifest of the client files installed incrementally.
+
+    The manifest has one `<sha1> <mode> <path>` line per file, sorted by
+    path relative to the client directory.  The directories fetched as
+    packages and compiled python files are left out.
+
+    @param client_dir: Directory of the autotest client.
+
+    @return The manifest string.
+    """
+    lines = []
+    for root, dirs, files in os.walk(client_dir):
+        if root == client_dir:
+            dirs[:] = [d for d in dirs if d not in _CLIENT_DIRS_TO_EXCLUDE]
+        for name in files:
+            if name.endswith(('.pyc', '.pyo')):
+                continue
+            path = os.path.join(root, name)
+            # Like send_file, follow symlinks; skip broken ones.
+            if not os.path.isfile(path):
+                continue
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), ''):
+                    sha1.update(chunk)
+            lines.append('%s %o %s\n' % (
+                    sha1.hexdigest(), stat.S_IMODE(os.stat(path).st_mode),
+                    os.path.relpath(path, client_dir)))
+    lines.sort(key=lambda line: line.split(' ', 2)[2])
+    return ''.join(lines)
+
+
+def _parse_client_manifest(manifest):
+    """Parse a manifest computed by _compute_client_manifest.
+
+    @param manifest: Manifest string.
+
+    @return A dictionary mapping each file path to its manifest line.
+    """
+    entries = {}
+    for line in manifest.splitlines(True):
+        fields = line.rstrip('\n').split(' ', 2)
+        if len(fields) == 3:
+            entries[fields[2]] = line
+    return entries
+
+
+def _reset_tarinfo_owner(tarinfo):
+    """Make files extracted as root on the host owned by root."""
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = 'root'
+    return tarinfo
+
+
 class AutodirNotFoundError(Exception):
     """No Autotest installation could be found."""
 
@@ -101,6 +190,9 @@ class Autotest(installable_object.InstallableObject):
         self.got = False
         self.installed = False
         self.serverdir = utils.get_server_dir()
+        # Tuple of (source material, manifest) of the last incremental
+        # install.
+        self._client_manifest = None
         super(Autotest, self).__init__()
 
 
@@ -289,28 +381,124 @@ class Autotest(installable_object.InstallableObject):
         pkg_dir = os.path.join(autodir, 'packages')
         # clean up the autodir except for the packages and result_tools
         # directory.
-        host.run('cd %s && ls | grep -v "^packages$" | grep -v "^result_tools$"'
-                 ' | xargs rm -rf && rm -rf .[!.]*' % autodir)
+        host.run(_clean_autodir_command(autodir))
         pkgmgr.install_pkg('autotest', 'client', pkg_dir, autodir,
                            preserve_install_dir=True)
         self.installed = True
 
 
+    def _get_client_manifest(self):
+        """Return the manifest of the client in the source material.
+
+        The manifest is computed once, and shared by the installs on all
+        the hosts of the job.
+        """
+        if (self._client_manifest is None
+                or self._client_manifest[0] != self.source_material):
+            self._client_manifest = (
+                    self.source_material,
+                    _compute_client_manifest(self.source_material))
+        return self._client_manifest[1]
+
+
+    def _install_incrementally(self, host, autodir):
+        """Install the client by sending only the files that changed.
+
+        The manifest of the files installed is kept in the autodir.  One
+        command checks the hash of the installed manifest: if it matches,
+        the client is up to date and nothing else is done.  Otherwise, the
+        installed manifest is read back with the same command, and the
+        files that differ are sent in a tarball and extracted, and the
+        files no longer in the client are removed.
+
+        The installed manifest is removed when it is read back, before any
+        file is replaced, so an interrupted install is redone from scratch
+        the next time.
+
+        @param host: Host to install the client on.
+        @param autodir: Autotest directory on the host.
+        """
+        manifest = self._get_client_manifest()
+        manifest_hash = hashlib.sha1(manifest).hexdigest()
+        quoted_autodir = '"%s"' % utils.sh_escape(autodir)
+        result = host.run(
+                'cd %s && if [ "$(cat %s 2>/dev/null)" = "%s" ]; then '
+                'echo %s; else cat %s 2>/dev/null; rm -f %s %s; fi'
+                % (quoted_autodir, _MANIFEST_HASH_FILE, manifest_hash,
+                   _MANIFEST_MATCH, _MANIFEST_FILE, _MANIFEST_HASH_FILE,
+                   _MANIFEST_FILE))
+        if result.stdout.strip() == _MANIFEST_MATCH:
+            logging.info('Autotest client on %s is up to date.',
+                         host.hostname)
+            return
+
+        entries = _parse_client_manifest(manifest)
+        installed_entries = _parse_client_manifest(result.stdout)
+        if not installed_entries:
+            # Not installed incrementally before, start from a clean
+            # autodir like the packaging install does.
+            host.run(_clean_autodir_command(quoted_autodir))
+        changed = sorted(path for path, line in entries.iteritems()
+                         if installed_entries.get(path) != line)
+        removed = sorted(set(installed_entries) - set(entries))
+        logging.info('Installing %d changed files and removing %d files of '
+                     'the autotest client on %s.', len(changed), len(removed),
+                     host.hostname)
+        # Python 2 still imports a compiled file without its source.
+        removed += [path + 'c' for path in removed if path.endswith('.py')]
+
+        with tempfile.NamedTemporaryFile(suffix='.tar.gz') as tarball:
+            tar = tarfile.open(fileobj=tarball, mode='w:gz', dereference=True)
+            try:
+                for path in changed:
+                    tar.add(os.path.join(self.source_material, path),
+                            arcname=path, recursive=False,
+                            filter=_reset_tarinfo_owner)
+                for name, content in ((_NEW_MANIFEST_FILE, manifest),
+                                      (_REMOVED_FILES_FILE,
+                                       ''.join(p + '\n' for p in removed))):
+                    tarinfo = _reset_tarinfo_owner(tarfile.TarInfo(name))
+                    tarinfo.size = len(content)
+                    tarinfo.mtime = time.time()
+                    tar.addfile(tarinfo, StringIO.StringIO(content))
+            finally:
+                tar.close()
+            tarball.flush()
+            host.send_file(tarball.name, os.path.join(autodir,
+                                                      _INSTALL_TARBALL))
+
+        commands = ['cd %s' % quoted_autodir,
+                    'tar xzf %s' % _INSTALL_TARBALL,
+                    'rm -f %s' % _INSTALL_TARBALL,
+                    "tr '\\n' '\\0' <%s | xargs -0 rm -f"
+                    % _REMOVED_FILES_FILE,
+                    'rm -f %s' % _REMOVED_FILES_FILE]
+        # create empty dirs for all the stuff we excluded
+        for path in sorted(_CLIENT_DIRS_TO_EXCLUDE):
+            commands.append('mkdir -p %s' % path)
+            commands.append('touch %s/__init__.py' % path)
+        commands.append('mv %s %s' % (_NEW_MANIFEST_FILE, _MANIFEST_FILE))
+        commands.append('echo %s >%s' % (manifest_hash, _MANIFEST_HASH_FILE))
+        host.run(' && '.join(commands))
+
+
     def _install_using_send_file(self, host, autodir):
-        dirs_to_exclude = set(["tests", "site_tests", "deps", "profilers",
-                               "packages"])
         light_files = [os.path.join(self.source_material, f)
                        for f in os.listdir(self.source_material)
-                       if f not in dirs_to_exclude]
+                       if f not in _CLIENT_DIRS_TO_EXCLUDE]
         host.send_file(light_files, autodir, delete_dest=True)
 
         # create empty dirs for all the stuff we excluded
         commands = []
-        for path in dirs_to_exclude:
+        for path in _CLIENT_DIRS_TO_EXCLUDE:
             abs_path = os.path.join(autodir, path)
             abs_path = utils.sh_escape(abs_path)
             commands.append("mkdir -p '%s'" % abs_path)
             commands.append("touch '%s'/__init__.py" % abs_path)
+        # An incremental install would otherwise trust the files replaced.
+        for name in (_MANIFEST_HASH_FILE, _MANIFEST_FILE):
+            abs_path = utils.sh_escape(os.path.join(autodir, name))
+            commands.append("rm -f '%s'" % abs_path)
         host.run(';'.join(commands))
 
 
@@ -352,6 +540,19 @@ class Autotest(installable_object.InstallableObject):
 
         # Fetch the autotest client from the nearest repository
         if use_packaging:
+            if (INCREMENTAL_CLIENT_INSTALL and use_autoserv
+                    and self.source_material):
+                try:
+                    self._install_incrementally(host, autodir)
+                    logging.info("Installation of autotest completed "
+                                 "incrementally from %s.",
+                                 self.source_material)
+                    self.installed = True
+                    return
+                except (error.AutoservRunError, error.AutoservSSHTimeout,
+                        EnvironmentError, tarfile.TarError), e:
+                    logging.info("Could not install autotest incrementally: "
+                                 "%s. Trying other methods", e)
             try:
                 self._install_using_packaging(host, autodir)
                 logging.info("Installation of autotest completed using the "
@@ -1386,7 +1587,7 @@ class client_logger(object):
             pkg_name, dest_path, fifo_path = fetch_package_match.groups()
             serve_packages = global_config.global_config.get_config_value(
                 "PACKAGES", "serve_packages_from_autoserv", type=bool)
-            if serve_packages and pkg_name.endswith(".tar.bz2"):
+            if serve_packages and pkg_name.endswith((".tar.bz2", ".tar.zst")):
                 try:
                     self._send_tarball(pkg_name, dest_path)
                 except Exception:
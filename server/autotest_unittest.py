@@ -2,7 +2,8 @@
 #pylint: disable-msg=C0111
 __author__ = "raphtee@google.com (Travis Miller)"
 
-import unittest, os, tempfile, logging
+import hashlib, unittest, os, shutil, tarfile, tempfile, logging
+import mock as pymock
 
 import common
 from autotest_lib.server import autotest, utils, hosts, server_job, profilers
@@ -171,6 +172,33 @@ class TestAutotest(unittest.TestCase):
         self.god.check_playback()
 
 
+    def test_incremental_install(self):
+        self.record_install_prologue()
+        self.god.stub_with(autotest, 'INCREMENTAL_CLIENT_INSTALL', True)
+        self.god.stub_function(self.autotest, '_install_incrementally')
+        self.autotest._install_incrementally.expect_call(self.host, 'autodir')
+
+        # run and check
+        self.autotest.install()
+        self.assertTrue(self.autotest.installed)
+        self.god.check_playback()
+
+
+    def test_incremental_install_fallback(self):
+        self.record_install_prologue()
+        self.god.stub_with(autotest, 'INCREMENTAL_CLIENT_INSTALL', True)
+        self.god.stub_function(self.autotest, '_install_incrementally')
+        (self.autotest._install_incrementally.expect_call(self.host, 'autodir')
+         .and_raises(error.AutoservRunError('dummy', object())))
+        self.god.stub_function(self.autotest, '_install_using_packaging')
+        self.autotest._install_using_packaging.expect_call(self.host,
+                                                           'autodir')
+
+        # run and check
+        self.autotest.install()
+        self.god.check_playback()
+
+
     def test_run(self):
         self.construct()
 
@@ -315,5 +343,140 @@ class TestAutotest(unittest.TestCase):
                              '/autotest/dest/:/autotest/fifo3')
 
 
+class TestClientManifest(unittest.TestCase):
+    """Tests for the manifest of a client installed incrementally."""
+
+    def setUp(self):
+        self.client_dir = tempfile.mkdtemp()
+        for path, content in (('bin/autotest', 'autotest'),
+                              ('bin/job.py', 'job'),
+                              ('bin/job.pyc', 'compiled'),
+                              ('tests/sleeptest/control', 'control')):
+            path = os.path.join(self.client_dir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        os.chmod(os.path.join(self.client_dir, 'bin/autotest'), 0755)
+        os.chmod(os.path.join(self.client_dir, 'bin/job.py'), 0644)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.client_dir)
+
+
+    def test_compute(self):
+        """Test the files left out of the manifest."""
+        manifest = autotest._compute_client_manifest(self.client_dir)
+        self.assertEqual(
+                '%s 755 bin/autotest\n%s 644 bin/job.py\n'
+                % (hashlib.sha1('autotest').hexdigest(),
+                   hashlib.sha1('job').hexdigest()),
+                manifest)
+
+
+    def test_parse(self):
+        """Test parsing a manifest back, and an empty one."""
+        manifest = autotest._compute_client_manifest(self.client_dir)
+        entries = autotest._parse_client_manifest(manifest)
+        self.assertEqual(['bin/autotest', 'bin/job.py'], sorted(entries))
+        self.assertEqual(manifest,
+                         ''.join(entries[path] for path in sorted(entries)))
+        self.assertEqual({}, autotest._parse_client_manifest(''))
+
+
+class TestInstallIncrementally(unittest.TestCase):
+    """Tests for installing the client by sending the files that changed."""
+
+    def setUp(self):
+        self.client_dir = tempfile.mkdtemp()
+        for path in ('bin/autotest', 'bin/job.py', 'common_lib/utils.py'):
+            path = os.path.join(self.client_dir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(path)
+        with pymock.patch.object(utils, 'get_server_dir',
+                                 return_value='serverdir'):
+            self.autotest = autotest.Autotest()
+        self.autotest.source_material = self.client_dir
+        self.manifest = autotest._compute_client_manifest(self.client_dir)
+
+        self.host = pymock.Mock(hostname='host1')
+        self.sent_files = {}
+        self.host.send_file.side_effect = self._receive_tarball
+
+
+    def tearDown(self):
+        shutil.rmtree(self.client_dir)
+
+
+    def _receive_tarball(self, source, dest):
+        """Keep the content of the tarball sent, by member name."""
+        self.assertEqual('/autodir/' + autotest._INSTALL_TARBALL, dest)
+        with tarfile.open(source) as tar:
+            for member in tar.getmembers():
+                self.sent_files[member.name] = tar.extractfile(member).read()
+
+
+    def _install(self, installed_manifest):
+        """Install the client over a client with the given manifest.
+
+        @param installed_manifest: The manifest read back from the host.
+
+        @return The commands run on the host.
+        """
+        self.host.run.return_value = pymock.Mock(stdout=installed_manifest)
+        self.autotest._install_incrementally(self.host, '/autodir')
+        return [call[0][0] for call in self.host.run.call_args_list]
+
+
+    def test_up_to_date(self):
+        """Test that nothing is sent when the manifest hashes match."""
+        commands = self._install(autotest._MANIFEST_MATCH + '\n')
+        self.assertEqual(1, len(commands))
+        self.assertIn(hashlib.sha1(self.manifest).hexdigest(), commands[0])
+        self.assertFalse(self.host.send_file.called)
+
+
+    def test_changed_files(self):
+        """Test that only the changed files are sent."""
+        entries = autotest._parse_client_manifest(self.manifest)
+        entries['bin/job.py'] = '%s 644 bin/job.py\n' % ('0' * 40)
+        entries['bin/old.py'] = '%s 644 bin/old.py\n' % ('1' * 40)
+        commands = self._install(
+                ''.join(entries[path] for path in sorted(entries)))
+
+        self.assertEqual(2, len(commands))
+        self.assertEqual(
+                sorted(['bin/job.py', autotest._NEW_MANIFEST_FILE,
+                        autotest._REMOVED_FILES_FILE]),
+                sorted(self.sent_files))
+        self.assertEqual(os.path.join(self.client_dir, 'bin/job.py'),
+                         self.sent_files['bin/job.py'])
+        self.assertEqual(self.manifest,
+                         self.sent_files[autotest._NEW_MANIFEST_FILE])
+        # The compiled file of a removed module is removed too.
+        self.assertEqual('bin/old.py\nbin/old.pyc\n',
+                         self.sent_files[autotest._REMOVED_FILES_FILE])
+        self.assertIn('xargs -0 rm -f', commands[1])
+        self.assertIn('mv %s %s' % (autotest._NEW_MANIFEST_FILE,
+                                    autotest._MANIFEST_FILE), commands[1])
+
+
+    def test_no_manifest(self):
+        """Test that a client without a manifest is replaced."""
+        commands = self._install('')
+        self.assertEqual(3, len(commands))
+        self.assertEqual(autotest._clean_autodir_command('"/autodir"'),
+                         commands[1])
+        self.assertEqual(
+                sorted(['bin/autotest', 'bin/job.py', 'common_lib/utils.py',
+                        autotest._NEW_MANIFEST_FILE,
+                        autotest._REMOVED_FILES_FILE]),
+                sorted(self.sent_files))
+        self.assertEqual('', self.sent_files[autotest._REMOVED_FILES_FILE])
+
+
 if __name__ == "__main__":
     unittest.main()
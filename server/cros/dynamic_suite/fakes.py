@@ -5,6 +5,8 @@
 
 """Fakes for dynamic_suite-related unit tests."""
 
+from multiprocessing import pool
+
 import common
 from autotest_lib.client.common_lib import control_data
 
@@ -128,12 +130,13 @@ class FakeStatus(object):
 
 
 class FakeMultiprocessingPool(object):
-    """Fake multiprocessing pool to mock out the map method."""
+    """Fake multiprocessing pool running the tasks in threads, where the mocks
+    set up by the tests are seen."""
 
 
     def __init__(self, processes=None, initializer=None, initargs=(),
                  maxtasksperchild=None):
-        pass
+        self._pool = pool.ThreadPool(1)
 
 
     def map(self, func, iterable, chunksize=None):
@@ -141,9 +144,14 @@ class FakeMultiprocessingPool(object):
         return map(func, iterable)
 
 
+    def imap_unordered(self, func, iterable, chunksize=1):
+        """Use a thread pool instead of Pool.imap_unordered()"""
+        return self._pool.imap_unordered(func, iterable, chunksize)
+
+
     def close(self):
-        pass
+        self._pool.close()
 
 
     def join(self):
-        pass
+        self._pool.join()
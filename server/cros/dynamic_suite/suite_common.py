@@ -7,9 +7,12 @@
 from __future__ import division
 from __future__ import print_function
 
+import atexit
 import datetime
 import logging
 import multiprocessing
+import os
+import Queue
 import re
 
 import common
@@ -27,6 +30,14 @@ from autotest_lib.server.cros.dynamic_suite import tools
 ENABLE_CONTROLS_IN_BATCH = global_config.global_config.get_config_value(
         'CROS', 'enable_getting_controls_in_batch', type=bool, default=False)
 
+# Number of control files sent to a parse worker at once.
+_PARSE_CHUNK_SIZE = 16
+
+# The pool of processes parsing control files, started on first use and
+# kept for the life of the process that started it.
+_parse_pool = None
+_parse_pool_pid = None
+
 
 def canonicalize_suite_name(suite_name):
     """Canonicalize the suite's name.
@@ -307,6 +318,110 @@ def get_process_limit():
     return min(8, multiprocessing.cpu_count())
 
 
+def _get_parse_pool():
+    """Get the pool of processes parsing control files, starting it if needed.
+
+    A process forked after the pool was started gets its own pool, as the
+    threads managing the pool don't exist in the child.
+    """
+    global _parse_pool, _parse_pool_pid
+    if _parse_pool is None or _parse_pool_pid != os.getpid():
+        _parse_pool = multiprocessing.Pool(processes=get_process_limit())
+        _parse_pool_pid = os.getpid()
+    return _parse_pool
+
+
+@atexit.register
+def close_parse_pool():
+    """Stop the pool of processes parsing control files, if started."""
+    global _parse_pool, _parse_pool_pid
+    if _parse_pool is not None and _parse_pool_pid == os.getpid():
+        _parse_pool.close()
+        _parse_pool.join()
+    _parse_pool = None
+    _parse_pool_pid = None
+
+
+def parse_cf_text_chunk(chunk):
+    """Worker process for parsing a chunk of control file texts.
+
+    @param chunk: List of the parse_cf_text_process() arguments.
+
+    @returns: List of the parse_cf_text_process() results.
+    """
+    return [parse_cf_text_process(data) for data in chunk]
+
+
+def _iter_ready_results(results):
+    """Yield the results the parse pool already has, without waiting.
+
+    @param results: The iterator returned by imap_unordered.
+    """
+    while True:
+        try:
+            yield results.next(timeout=0)
+        except (multiprocessing.TimeoutError, StopIteration):
+            return
+
+
+def iter_parse_cf_text_many(control_file_texts,
+                            forgiving_error=False,
+                            test_args=None):
+    """Parse control file texts, yielding the tests as they are parsed.
+
+    Control files found in the control file index are parsed in this
+    process, which is faster than sending them to another process, and
+    yielded as they are read.  The others are sent to the parse pool in
+    chunks while control_file_texts is read, and their tests are yielded as
+    the chunks are parsed, in no particular order.
+
+    @param control_file_texts: iterable of (path, text) pairs
+    @param forgiving_error: If False, raise the parse errors instead of
+                            skipping the control files.
+    @param test_args: The test args to be injected into test control file.
+
+    @returns: a generator of (path, ControlData object) tuples
+    """
+    # Chunks of control files for the pool, read by the pool's task handler
+    # thread until None.
+    chunks = Queue.Queue()
+    chunk = []
+    results = None
+    try:
+        for path, text in control_file_texts:
+            if test_args:
+                text = tools.inject_vars(test_args, text)
+            data = (path, text, forgiving_error, None)
+            if control_data.is_control_string_indexed(text):
+                result = parse_cf_text_process(data)
+                if result is not None:
+                    yield result
+                continue
+            if results is None:
+                results = _get_parse_pool().imap_unordered(
+                        parse_cf_text_chunk, iter(chunks.get, None))
+            chunk.append(data)
+            if len(chunk) == _PARSE_CHUNK_SIZE:
+                chunks.put(chunk)
+                chunk = []
+            for chunk_results in _iter_ready_results(results):
+                for result in chunk_results:
+                    # Control files skipped because of errors have no
+                    # result.
+                    if result is not None:
+                        yield result
+        if chunk:
+            chunks.put(chunk)
+    finally:
+        chunks.put(None)
+
+    if results is not None:
+        for chunk_results in results:
+            for result in chunk_results:
+                if result is not None:
+                    yield result
+
+
 def parse_cf_text_many(control_file_texts,
                        forgiving_error=False,
                        test_args=None):
@@ -317,24 +432,9 @@ def parse_cf_text_many(control_file_texts,
 
     @returns: a dictionary of ControlData objects
     """
-    tests = {}
-
-    control_file_texts_all = list(control_file_texts)
-    if control_file_texts_all:
-        # Construct input data for worker processes. Each row contains the
-        # path, text, forgiving_error configuration, and test arguments.
-        paths, texts = zip(*control_file_texts_all)
-        worker_data = zip(paths, texts, [forgiving_error] * len(paths),
-                          [test_args] * len(paths))
-        pool = multiprocessing.Pool(processes=get_process_limit())
-        result_list = pool.map(parse_cf_text_process, worker_data)
-        pool.close()
-        pool.join()
-
-        # Convert [(path, test), ...] to {path: test, ...}
-        tests = dict(result_list)
-
-    return tests
+    return dict(iter_parse_cf_text_many(control_file_texts,
+                                        forgiving_error=forgiving_error,
+                                        test_args=test_args))
 
 
 def retrieve_control_data_for_test(cf_getter, test_name):
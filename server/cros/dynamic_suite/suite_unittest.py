@@ -12,6 +12,7 @@ from collections import OrderedDict
 import os
 import shutil
 import tempfile
+import time
 import unittest
 
 import mock
@@ -96,6 +97,8 @@ class SuiteTest(mox.MoxTestBase):
     def tearDown(self):
         """Teardown."""
         suite_common.ENABLE_CONTROLS_IN_BATCH = self.use_batch
+        # Each test expects its own pool to be started.
+        suite_common.close_parse_pool()
         super(SuiteTest, self).tearDown()
         shutil.rmtree(self.tmpdir, ignore_errors=True)
 
@@ -876,5 +879,35 @@ class _MemoryResultReporter(SuiteBase._ResultReporter):
         self.results.append(result)
 
 
+class IterParseCfTextManyTest(unittest.TestCase):
+    """Unit tests for suite_common.iter_parse_cf_text_many."""
+
+    _CONTROL = ("NAME = 'test_%d'\nAUTHOR = 'me'\nTIME = 'SHORT'\n"
+                "TEST_TYPE = 'client'\nDOC = 'doc'\n")
+
+
+    def tearDown(self):
+        """Teardown."""
+        suite_common.close_parse_pool()
+
+
+    def test_results_streamed(self):
+        """Tests are yielded before all the control files are read."""
+        read = []
+        def control_file_texts():
+            for i in xrange(100):
+                read.append(i)
+                # Give the pool the time to parse the first chunks.
+                time.sleep(0.02)
+                yield 'control.%d' % i, self._CONTROL % i
+
+        results = suite_common.iter_parse_cf_text_many(control_file_texts())
+        path, test = next(results)
+        self.assertLess(len(read), 100)
+        self.assertEqual(path.replace('control.', 'test_'), test.name)
+        self.assertEqual(set('control.%d' % i for i in xrange(100)),
+                         set([path] + [p for p, _ in results]))
+
+
 if __name__ == '__main__':
     unittest.main()
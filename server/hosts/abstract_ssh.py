@@ -15,12 +15,23 @@ from autotest_lib.server.hosts import host_info
 from autotest_lib.server.hosts import remote
 from autotest_lib.server.hosts import rpc_server_tracker
 from autotest_lib.server.hosts import ssh_multiplex
+from autotest_lib.server.hosts import ssh_shell_session
+
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = utils.metrics_mock
 
 # pylint: disable=C0111
 
 get_value = global_config.get_config_value
 enable_master_ssh = get_value('AUTOSERV', 'enable_master_ssh', type=bool,
                               default=False)
+enable_shell_session = get_value('AUTOSERV', 'enable_ssh_shell_session',
+                                 type=bool, default=False)
+
+# Number of seconds to wait for a shell session to start.
+_SHELL_SESSION_START_TIMEOUT_SECONDS = 30
 
 # Number of seconds to use the cached up status.
 _DEFAULT_UP_STATUS_EXPIRATION_SECONDS = 300
@@ -97,6 +108,14 @@ class AbstractSSHHost(remote.RemoteHost):
         # The timestamp when the value of _cached_up_status is set.
         self._cached_up_status_updated = None
 
+        # Persistent remote shell running the commands of run() and
+        # run_batch(), if enabled.  Started on first use.
+        self.use_shell_session = enable_shell_session
+        self._shell_session = None
+        # Whether the session failed to start.  It is not tried again
+        # until the master connection is restarted.
+        self._shell_session_failed = False
+
 
     @property
     def ip(self):
@@ -819,6 +838,7 @@ class AbstractSSHHost(remote.RemoteHost):
     def close(self):
         super(AbstractSSHHost, self).close()
         self.rpc_server_tracker.disconnect_all()
+        self.close_shell_session()
         if not self._connection_pool:
             self._master_ssh.close()
         if os.path.exists(self.known_hosts_file):
@@ -831,6 +851,9 @@ class AbstractSSHHost(remote.RemoteHost):
         resort when ssh commands fail and we don't understand why.
         """
         logging.debug('Restarting master ssh connection')
+        # The session goes through the master connection.
+        self.close_shell_session()
+        self._shell_session_failed = False
         self._master_ssh.close()
         self._master_ssh.maybe_start(timeout=30)
 
@@ -853,6 +876,215 @@ class AbstractSSHHost(remote.RemoteHost):
         self._master_ssh.maybe_start(timeout=timeout)
 
 
+    def _get_shell_session(self):
+        """Return the shell session, starting it if needed.
+
+        @return A running ShellSession, or None if it could not be
+                started.  Commands can then be run with plain ssh.
+        """
+        if self._shell_session and self._shell_session.is_alive():
+            return self._shell_session
+        if self._shell_session_failed:
+            return None
+        self.start_master_ssh()
+        command = '%s %s "exec /bin/sh"' % (
+                self.make_ssh_command(user=self.user, port=self.port,
+                                      opts=self._master_ssh.ssh_option,
+                                      hosts_file=self.known_hosts_file),
+                self.hostname)
+        session = ssh_shell_session.ShellSession(command)
+        try:
+            session.start(_SHELL_SESSION_START_TIMEOUT_SECONDS)
+        except ssh_shell_session.ShellSessionError as e:
+            logging.debug('Failed to start shell session on %s: %s',
+                          self.hostname, e)
+            self._shell_session_failed = True
+            return None
+        self._shell_session = session
+        return session
+
+
+    def close_shell_session(self):
+        """Stop the shell session, if any."""
+        if self._shell_session:
+            self._shell_session.close()
+            self._shell_session = None
+
+
+    def _make_shell_session_command(self, command, args=()):
+        """Prepare a command to run in the shell session, like run() does.
+
+        @param command: Command string or list.
+        @param args: Sequence of arguments to quote and append.
+
+        @return The command string.
+        """
+        if not isinstance(command, basestring):
+            command = ' '.join(command)
+        for arg in args:
+            command += ' "%s"' % utils.sh_escape(arg)
+        env = " ".join("=".join(pair) for pair in self.env.iteritems())
+        if env.strip():
+            command = 'export %s; %s' % (env, command)
+        return command
+
+
+    def _tee_and_check_results(self, results, ignore_status, stdout_tee,
+                               stderr_tee):
+        """Tee the output of commands run in the session and check them.
+
+        @param results: List of CmdResult objects.
+        @param ignore_status: Do not raise an exception on failures.
+        @param stdout_tee: Where to tee stdout, as for run().
+        @param stderr_tee: Where to tee stderr, as for run().
+
+        @raises AutoservRunError if a command failed and ignore_status is
+                False.
+        """
+        stderr_level = utils.get_stderr_level(ignore_status)
+        stdout_file = utils.get_stream_tee_file(
+                stdout_tee, utils.DEFAULT_STDOUT_LEVEL,
+                prefix=utils.STDOUT_PREFIX)
+        stderr_file = utils.get_stream_tee_file(
+                stderr_tee, stderr_level, prefix=utils.STDERR_PREFIX)
+        for result in results:
+            if stdout_file:
+                stdout_file.write(result.stdout)
+            if stderr_file:
+                stderr_file.write(result.stderr)
+        for result in results:
+            if not ignore_status and result.exit_status > 0:
+                msg = result.stderr.strip()
+                if not msg:
+                    msg = result.stdout.strip()
+                    if msg:
+                        msg = msg.splitlines()[-1]
+                raise error.AutoservRunError(
+                        "command execution error (%d): %s" %
+                        (result.exit_status, msg), result)
+
+
+    def _run_in_shell_session(self, command, timeout, ignore_status,
+                              stdout_tee, stderr_tee, args, ignore_timeout):
+        """Run a command in the shell session.
+
+        @param command: Command string.
+        @param timeout: Command execution timeout in seconds.
+        @param ignore_status: Do not raise an exception on failures.
+        @param stdout_tee: Where to tee stdout, as for run().
+        @param stderr_tee: Where to tee stderr, as for run().
+        @param args: Sequence of arguments to quote and append.
+        @param ignore_timeout: Return None instead of raising on timeout.
+
+        @return A CmdResult object, None on an ignored timeout, or
+                NotImplemented if the session could not be started, in
+                which case the command was not run.
+        @raises AutoservRunError if the command failed or the session
+                ended while it ran.
+        @raises CmdTimeoutError if the command timed out.
+        """
+        session = self._get_shell_session()
+        if session is None:
+            return NotImplemented
+        command = self._make_shell_session_command(command, args)
+        try:
+            result = session.run(command, timeout)
+        except error.CmdTimeoutError:
+            self._shell_session = None
+            if ignore_timeout:
+                self._count_shell_session_run('timeout', 'ignored_timeout')
+                return None
+            self._count_shell_session_run('exception', 'exception')
+            raise
+        except ssh_shell_session.ShellSessionError as e:
+            # Like ssh, report the lost connection with status 255.
+            self._shell_session = None
+            result = utils.CmdResult(command, stderr=str(e), exit_status=255)
+        if result.exit_status == 255:
+            failure_name = 'error_255'
+        elif result.exit_status > 0:
+            failure_name = 'nonzero_status'
+        else:
+            failure_name = None
+        if failure_name and not ignore_status:
+            self._count_shell_session_run(failure_name, 'final_run_error')
+        else:
+            self._count_shell_session_run(failure_name, failure_name)
+        self._tee_and_check_results([result], ignore_status, stdout_tee,
+                                    stderr_tee)
+        return result
+
+
+    def _count_shell_session_run(self, call_failure_name, run_failure_name):
+        """Record a command run in the session in the ssh metrics.
+
+        The counters are those of the commands run with plain ssh, each
+        command in the session being a single attempt.
+
+        @param call_failure_name: Outcome of the command, or None for
+                success.
+        @param run_failure_name: Outcome of the run() call, or None for
+                success.
+        """
+        metrics.Counter('chromeos/autotest/ssh/calls').increment(
+                fields={'error': call_failure_name or 'success', 'attempt': 1})
+        metrics.Counter('chromeos/autotest/ssh/runs').increment(
+                fields={'error': run_failure_name or 'success', 'attempt': 1})
+
+
+    def run_batch(self, commands, timeout=None, ignore_status=False,
+                  stdout_tee=utils.TEE_TO_LOGS, stderr_tee=utils.TEE_TO_LOGS):
+        """Run many short commands on the host, one after the other.
+
+        With the shell session, all the commands are sent in one round
+        trip.  Otherwise, each is run with run().  All the commands are
+        run, even if one fails.
+
+        @param commands: List of command strings.
+        @param timeout: Timeout in seconds for all the commands together.
+                Default is 1 hour.
+        @param ignore_status: Do not raise an exception if a command fails.
+        @param stdout_tee: Where to tee stdout, as for run().
+        @param stderr_tee: Where to tee stderr, as for run().
+
+        @return A list of CmdResult objects, one per command.
+        @raises AutoservRunError if a command failed and ignore_status is
+                False, or if the session ended.
+        @raises AutoservRunError if the commands timed out.
+        """
+        if timeout is None:
+            timeout = 3600
+        session = self.use_shell_session and self._get_shell_session()
+        if not session:
+            start_time = time.time()
+            results = []
+            for command in commands:
+                remaining = max(1, timeout - (time.time() - start_time))
+                results.append(self.run(command, timeout=remaining,
+                                        ignore_status=True,
+                                        stdout_tee=stdout_tee,
+                                        stderr_tee=stderr_tee))
+            self._tee_and_check_results(results, ignore_status, None, None)
+            return results
+
+        for command in commands:
+            logging.debug("Running (ssh session) '%s'", command)
+        try:
+            results = session.run_batch(
+                    [self._make_shell_session_command(c) for c in commands],
+                    timeout)
+        except error.CmdTimeoutError as e:
+            self._shell_session = None
+            raise error.AutoservRunError('Timeout encountered: %s' % e.args[0],
+                                         e.args[1])
+        except ssh_shell_session.ShellSessionError as e:
+            self._shell_session = None
+            raise error.AutoservRunError('ssh session ended: %s' % e, None)
+        self._tee_and_check_results(results, ignore_status, stdout_tee,
+                                    stderr_tee)
+        return results
+
+
     def clear_known_hosts(self):
         """Clears out the temporary ssh known_hosts file.
 
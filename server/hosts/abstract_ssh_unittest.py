@@ -0,0 +1,172 @@
+#!/usr/bin/python2
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest
+
+import mock
+
+import common
+
+from autotest_lib.client.common_lib import error
+from autotest_lib.server import utils
+from autotest_lib.server.hosts import abstract_ssh
+from autotest_lib.server.hosts import ssh_host
+from autotest_lib.server.hosts import ssh_shell_session
+
+
+class ShellSessionTest(unittest.TestCase):
+    """Tests running commands in the shell session of a host.
+
+    A local shell stands in for the ssh session.
+    """
+
+    def setUp(self):
+        self.host = ssh_host.SSHHost('host1')
+        self.addCleanup(self.host.close)
+        self.host.use_shell_session = True
+        self.host.env = {'FOO': 'bar'}
+        self.session = ssh_shell_session.ShellSession('exec /bin/sh')
+        self.session.start(timeout=10)
+        self.addCleanup(self.session.close)
+        self.host._shell_session = self.session
+        patcher = mock.patch.object(self.host, 'start_master_ssh')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def _run_in_shell_session(self, command, timeout=10, ignore_status=False,
+                              args=(), ignore_timeout=False):
+        return self.host._run_in_shell_session(
+                command, timeout, ignore_status, None, None, args,
+                ignore_timeout)
+
+
+    def test_run(self):
+        """The environment and the quoted arguments are passed."""
+        result = self._run_in_shell_session('echo $FOO', args=('a b',))
+        self.assertEqual('bar a b\n', result.stdout)
+        self.assertEqual(0, result.exit_status)
+        self.assertIs(self.session, self.host._shell_session)
+
+
+    def test_run_failure(self):
+        """A failed command raises unless its status is ignored."""
+        self.assertRaises(error.AutoservRunError, self._run_in_shell_session,
+                          'echo oops >&2; exit 3')
+        result = self._run_in_shell_session('exit 3', ignore_status=True)
+        self.assertEqual(3, result.exit_status)
+        self.assertIs(self.session, self.host._shell_session)
+
+
+    def test_run_session_ended(self):
+        """A session ending while a command runs is reported as ssh does."""
+        # $$ is the session shell, not the subshell running the command.
+        result = self._run_in_shell_session('kill -9 $$', ignore_status=True)
+        self.assertEqual(255, result.exit_status)
+        self.assertIsNone(self.host._shell_session)
+
+
+    def test_run_timeout(self):
+        """A timed out command drops the session."""
+        self.assertIsNone(self._run_in_shell_session(
+                'sleep 10', timeout=0.1, ignore_timeout=True))
+        self.assertIsNone(self.host._shell_session)
+
+
+    def test_run_metrics(self):
+        """Commands run in the session are counted like ssh commands."""
+        with mock.patch.object(abstract_ssh, 'metrics') as metrics:
+            self.assertRaises(error.AutoservRunError,
+                              self._run_in_shell_session, 'exit 3')
+        self.assertEqual(
+                [mock.call('chromeos/autotest/ssh/calls'),
+                 mock.call().increment(
+                         fields={'error': 'nonzero_status', 'attempt': 1}),
+                 mock.call('chromeos/autotest/ssh/runs'),
+                 mock.call().increment(
+                         fields={'error': 'final_run_error', 'attempt': 1})],
+                metrics.Counter.mock_calls)
+
+
+    def test_run_batch(self):
+        """All the commands are run, even after a failure."""
+        results = self.host.run_batch(
+                ['echo $FOO', 'exit 2', 'echo done'], ignore_status=True,
+                stdout_tee=None, stderr_tee=None)
+        self.assertEqual(['bar\n', '', 'done\n'],
+                         [result.stdout for result in results])
+        self.assertEqual([0, 2, 0],
+                         [result.exit_status for result in results])
+
+
+    def test_run_batch_failure(self):
+        """A failed command of a batch raises unless ignored."""
+        self.assertRaises(error.AutoservRunError, self.host.run_batch,
+                          ['true', 'exit 2'], stdout_tee=None,
+                          stderr_tee=None)
+
+
+class ShellSessionFallbackTest(unittest.TestCase):
+    """Tests running commands with plain ssh when the session can't be used.
+    """
+
+    def setUp(self):
+        self.host = ssh_host.SSHHost('host1')
+        self.addCleanup(self.host.close)
+        self.host.use_shell_session = True
+        for name in ('start_master_ssh', '_run'):
+            patcher = mock.patch.object(self.host, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(ssh_shell_session, 'ShellSession')
+        self.session_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def test_session_start_failure_cached(self):
+        """A session failing to start is not tried again on every run."""
+        self.session_class.return_value.start.side_effect = (
+                ssh_shell_session.ShellSessionError('no sh'))
+        self.host.run('true', verbose=False)
+        self.host.run('true', verbose=False)
+        self.assertEqual(1, self.session_class.call_count)
+        self.assertEqual(2, self.host._run.call_count)
+
+        with mock.patch.object(self.host, '_master_ssh'):
+            self.host.restart_master_ssh()
+        self.host.run('true', verbose=False)
+        self.assertEqual(2, self.session_class.call_count)
+
+
+    def test_ssh_failure_retry_ok(self):
+        """Commands that may be retried on ssh failures use plain ssh."""
+        self.host.run('true', verbose=False, ssh_failure_retry_ok=True)
+        self.assertFalse(self.session_class.called)
+        self.assertTrue(self.host._run.call_args[0][-1])
+
+
+    def test_run_in_session(self):
+        """Other commands are run in the session."""
+        session = self.session_class.return_value
+        session.run.return_value = utils.CmdResult('true', exit_status=0)
+        self.host.run('true', verbose=False, stdout_tee=None, stderr_tee=None)
+        self.assertTrue(session.run.called)
+        self.assertFalse(self.host._run.called)
+
+
+    def test_run_batch_without_session(self):
+        """Without the session, each command of a batch is run."""
+        self.host.use_shell_session = False
+        self.host._run.side_effect = [
+                utils.CmdResult('true', exit_status=0),
+                utils.CmdResult('false', exit_status=1)]
+        results = self.host.run_batch(['true', 'false'], ignore_status=True)
+        self.assertEqual([0, 1], [result.exit_status for result in results])
+        self.assertEqual(2, self.host._run.call_count)
+        self.assertFalse(self.session_class.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
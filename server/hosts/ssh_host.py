@@ -330,6 +330,15 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
             env = " ".join("=".join(pair) for pair in self.env.iteritems())
             elapsed = time.time() - start_time
             try:
+                # The session can't take stdin or extra ssh options, and
+                # the ssh failure retries restart the connection instead.
+                if (self.use_shell_session and stdin is None and not options
+                        and not ssh_failure_retry_ok):
+                    result = self._run_in_shell_session(
+                            command, timeout - elapsed, ignore_status,
+                            stdout_tee, stderr_tee, args, ignore_timeout)
+                    if result is not NotImplemented:
+                        return result
                 return self._run(command, timeout - elapsed, ignore_status,
                                  stdout_tee, stderr_tee, connect_timeout, env,
                                  options, stdin, args, ignore_timeout,
@@ -0,0 +1,244 @@
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Run many commands through one long-lived remote shell.
+
+A ShellSession starts a shell once, e.g. through `ssh host "exec /bin/sh"`,
+and sends it each command framed so the exit status, stdout and stderr of
+every command can be told apart.  After each command, the shell prints a
+marker line with a random token to stdout, with the exit status, and
+another one to stderr.  Commands sent together are read back together, so
+a batch of commands costs one round trip.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import select
+import subprocess
+import time
+import uuid
+
+from autotest_lib.client.common_lib import error
+from autotest_lib.server import utils
+
+# Maximum number of bytes to read from the shell at once.
+_READ_SIZE = 64 * 1024
+
+
+class ShellSessionError(Exception):
+    """The shell session ended or could not be started."""
+
+
+def _set_nonblocking(fd):
+    """Make reads and writes of a file descriptor nonblocking."""
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class ShellSession(object):
+    """A shell running commands sent to its stdin, one after the other."""
+
+    def __init__(self, command):
+        """Initialize the session; the shell is started by `start()`.
+
+        @param command: Command line starting the shell, e.g. an ssh
+                        command running `exec /bin/sh` on the host.
+        """
+        self._command = command
+        self._process = None
+        # Unlikely to appear in the output of any command.
+        self._token = 'AUTOTEST_SHELL_SESSION_%s' % uuid.uuid4().hex
+        self._next_id = 0
+        self._stdout = ''
+        self._stderr = ''
+
+
+    def is_alive(self):
+        """Return whether the shell is running."""
+        return self._process is not None and self._process.poll() is None
+
+
+    def start(self, timeout):
+        """Start the shell, and wait until it runs commands.
+
+        @param timeout: Seconds to wait for the shell.
+
+        @raises ShellSessionError if the shell could not be started.
+        """
+        self.close()
+        logging.debug('Starting shell session: %s', self._command)
+        self._process = subprocess.Popen(
+                self._command, shell=True, close_fds=True,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        for f in (self._process.stdin, self._process.stdout,
+                  self._process.stderr):
+            _set_nonblocking(f.fileno())
+        try:
+            result = self.run_batch(['true'], timeout)[0]
+        except error.CmdTimeoutError:
+            raise ShellSessionError('Shell session did not start within %d '
+                                    'seconds' % timeout)
+        if result.exit_status != 0:
+            self.close()
+            raise ShellSessionError('Shell session failed to start: %s'
+                                    % result.stderr.strip())
+
+
+    def close(self):
+        """Stop the shell."""
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            try:
+                self._process.kill()
+            except OSError:
+                pass
+        self._process.wait()
+        for f in (self._process.stdin, self._process.stdout,
+                  self._process.stderr):
+            f.close()
+        self._process = None
+        self._stdout = ''
+        self._stderr = ''
+
+
+    def _frame(self, command_id, command):
+        """Wrap a command to print the end markers after it.
+
+        The command runs in a subshell through eval, so that neither a
+        syntax error nor an `exit` ends the session, and with stdin from
+        /dev/null, so it can't read the commands that follow.
+
+        @param command_id: Number identifying the command in the session.
+        @param command: Command string.
+
+        @return The script to send to the shell.
+        """
+        return ('(eval "%s") </dev/null; '
+                'printf "\\n%s %d %%d\\n" $?; '
+                'printf "\\n%s %d\\n" >&2\n'
+                % (utils.sh_escape(command), self._token, command_id,
+                   self._token, command_id))
+
+
+    def _parse_result(self, command_id):
+        """Take the output of a command from the buffers, if complete.
+
+        @param command_id: Number identifying the command in the session.
+
+        @return A tuple of (stdout, stderr, exit status), or None if the
+                command didn't finish yet.
+        """
+        stdout_marker = '\n%s %d ' % (self._token, command_id)
+        stderr_marker = '\n%s %d\n' % (self._token, command_id)
+        stdout_end = self._stdout.find(stdout_marker)
+        if stdout_end < 0:
+            return None
+        status_start = stdout_end + len(stdout_marker)
+        status_end = self._stdout.find('\n', status_start)
+        stderr_end = self._stderr.find(stderr_marker)
+        if status_end < 0 or stderr_end < 0:
+            return None
+        result = (self._stdout[:stdout_end], self._stderr[:stderr_end],
+                  int(self._stdout[status_start:status_end]))
+        self._stdout = self._stdout[status_end + 1:]
+        self._stderr = self._stderr[stderr_end + len(stderr_marker):]
+        return result
+
+
+    def _read(self, fd):
+        """Read the available output of the shell into the buffers.
+
+        @param fd: File descriptor to read.
+
+        @raises ShellSessionError if the shell exited.
+        """
+        data = os.read(fd, _READ_SIZE)
+        if not data:
+            self.close()
+            raise ShellSessionError('Shell session ended')
+        if fd == self._process.stdout.fileno():
+            self._stdout += data
+        else:
+            self._stderr += data
+
+
+    def run_batch(self, commands, timeout):
+        """Run commands one after the other, sending them all at once.
+
+        @param commands: List of command strings.
+        @param timeout: Seconds to wait for all the commands to finish.
+
+        @return A list of CmdResult objects, one per command.
+        @raises error.CmdTimeoutError if the commands did not finish in
+                time.  The session is closed, as the shell is still busy.
+        @raises ShellSessionError if the shell exited.
+        """
+        if not self.is_alive():
+            raise ShellSessionError('Shell session is not running')
+        start_time = time.time()
+        deadline = start_time + timeout
+        ids = range(self._next_id, self._next_id + len(commands))
+        self._next_id += len(commands)
+        pending_input = ''.join(self._frame(command_id, command)
+                                for command_id, command in zip(ids, commands))
+
+        stdin_fd = self._process.stdin.fileno()
+        output_fds = [self._process.stdout.fileno(),
+                      self._process.stderr.fileno()]
+        results = []
+        while len(results) < len(commands):
+            parsed = self._parse_result(ids[len(results)])
+            if parsed is not None:
+                stdout, stderr, exit_status = parsed
+                now = time.time()
+                results.append(utils.CmdResult(
+                        commands[len(results)], stdout, stderr, exit_status,
+                        now - start_time))
+                start_time = now
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                command = commands[len(results)]
+                self.close()
+                raise error.CmdTimeoutError(
+                        command, utils.CmdResult(command),
+                        'Command did not complete within %d seconds'
+                        % timeout)
+            write_fds = [stdin_fd] if pending_input else []
+            try:
+                readable, writable, _ = select.select(
+                        output_fds, write_fds, [], remaining)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if writable:
+                try:
+                    written = os.write(stdin_fd, pending_input)
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        continue
+                    self.close()
+                    raise ShellSessionError('Shell session ended: %s' % e)
+                pending_input = pending_input[written:]
+            for fd in readable:
+                self._read(fd)
+        return results
+
+
+    def run(self, command, timeout):
+        """Run a single command.
+
+        @param command: Command string.
+        @param timeout: Seconds to wait for the command to finish.
+
+        @return A CmdResult object.
+        @raises error.CmdTimeoutError if the command did not finish in time.
+        @raises ShellSessionError if the shell exited.
+        """
+        return self.run_batch([command], timeout)[0]
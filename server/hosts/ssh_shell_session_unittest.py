@@ -0,0 +1,69 @@
+#!/usr/bin/python2
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest
+
+import common
+
+from autotest_lib.client.common_lib import error
+from autotest_lib.server.hosts import ssh_shell_session
+
+
+class ShellSessionTest(unittest.TestCase):
+    """Tests ShellSession with a local shell standing in for ssh."""
+
+    def setUp(self):
+        self.session = ssh_shell_session.ShellSession('exec /bin/sh')
+        self.session.start(timeout=10)
+        self.addCleanup(self.session.close)
+
+
+    def test_run(self):
+        """Exit status, stdout and stderr are kept apart."""
+        result = self.session.run('echo out; echo err >&2; exit 3', 10)
+        self.assertEqual('out\n', result.stdout)
+        self.assertEqual('err\n', result.stderr)
+        self.assertEqual(3, result.exit_status)
+
+
+    def test_run_batch(self):
+        """A batch returns one result per command, in order."""
+        results = self.session.run_batch(
+                ['printf no-newline', 'true', 'cat', 'syntax error (',
+                 'echo "quoted $((1 + 1))"'], 10)
+        self.assertEqual(['no-newline', '', '', '', 'quoted 2\n'],
+                         [r.stdout for r in results])
+        self.assertEqual([0, 0, 0, 2, 0],
+                         [r.exit_status for r in results])
+        self.assertTrue(results[3].stderr)
+        self.assertTrue(self.session.is_alive())
+
+
+    def test_timeout(self):
+        """A command running too long closes the session."""
+        with self.assertRaises(error.CmdTimeoutError):
+            self.session.run('sleep 10', 0.5)
+        self.assertFalse(self.session.is_alive())
+        with self.assertRaises(ssh_shell_session.ShellSessionError):
+            self.session.run('true', 10)
+
+
+    def test_large_output(self):
+        """Output larger than the pipe buffers is read completely."""
+        commands = ['head -c 200000 /dev/zero'] * 5
+        results = self.session.run_batch(commands, 30)
+        self.assertEqual([200000] * 5, [len(r.stdout) for r in results])
+
+
+    def test_session_ended(self):
+        """The shell exiting is reported as a session error."""
+        self.session.close()
+        session = ssh_shell_session.ShellSession('exit 255')
+        with self.assertRaises(ssh_shell_session.ShellSessionError):
+            session.start(timeout=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,6 +34,7 @@ from autotest_lib.client.bin import sysinfo
 from autotest_lib.client.common_lib import base_job
 from autotest_lib.client.common_lib import control_data
 from autotest_lib.client.common_lib import error
+from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import logging_manager
 from autotest_lib.client.common_lib import packages
 from autotest_lib.client.common_lib import utils
@@ -358,7 +359,10 @@ class server_job(base_job.base_job):
         self._indenter = status_indenter()
         self._logger = base_job.status_logger(
             self, self._indenter, 'status.log', 'status.log',
-            record_hook=server_job_record_hook(self))
+            record_hook=server_job_record_hook(self),
+            max_flush_delay=global_config.global_config.get_config_value(
+                    'AUTOSERV', 'status_log_max_flush_delay', type=float,
+                    default=0))
 
         # Initialize a flag to indicate DUT failure during the test, e.g.,
         # unexpected reboot.
@@ -447,6 +451,8 @@ class server_job(base_job.base_job):
             new_hosts = self.hosts - self._existing_hosts_on_fork
             for host in new_hosts:
                 host.close()
+            # the forked process exits without running exit handlers
+            self._logger.flush(sync=True)
         subcommand.subcommand.register_fork_hook(on_fork)
         subcommand.subcommand.register_join_hook(on_join)
 
@@ -681,6 +687,7 @@ class server_job(base_job.base_job):
             return True
 
         # parse the status logs
+        self._logger.flush()
         status_lines = open(status_log).readlines()
         parser.start(job)
         tests = parser.end(status_lines)
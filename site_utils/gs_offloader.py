@@ -6,7 +6,8 @@
 
 """Script to archive old Autotest results to Google Storage.
 
-Uses gsutil to archive files to the configured Google Storage bucket.
+Uses gsutil, or another uploader chosen with --uploader, to archive files
+to the configured Google Storage bucket.
 Upon successful copy, the local results directory is deleted.
 """
 
@@ -29,9 +30,11 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import urllib
 
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 
 import common
@@ -39,6 +42,7 @@ from autotest_lib.client.common_lib import file_utils
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import utils
 from autotest_lib.site_utils import job_directories
+from autotest_lib.site_utils import job_directory_watcher
 # For unittest, the cloud_console.proto is not compiled yet.
 try:
     from autotest_lib.site_utils import cloud_console_client
@@ -58,6 +62,21 @@ try:
 except ImportError:
     psutil = None
 
+try:
+    # Only needed by the gcs uploader.
+    from google.cloud import storage as gcs_storage
+except ImportError:
+    gcs_storage = None
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        # Backport of os.scandir for python 2, if installed.
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
 from chromite.lib import parallel
 try:
     from chromite.lib import metrics
@@ -111,6 +130,23 @@ LIMIT_FILE_COUNT = global_config.global_config.get_config_value(
 GS_OFFLOADER_MULTIPROCESSING = global_config.global_config.get_config_value(
         'CROS', 'gs_offloader_multiprocessing', type=bool, default=False)
 
+# Use inotify to find new job directories, instead of globbing the results
+# on every offload cycle.
+GS_OFFLOADER_WATCH_RESULTS = global_config.global_config.get_config_value(
+        'CROS', 'gs_offloader_watch_results', type=bool, default=False)
+
+# Seconds between full rescans of the results, when using inotify.
+WATCH_RESCAN_INTERVAL_SECS = 60 * 60
+
+# Backends to copy the results with, see `get_uploader()`.
+UPLOADERS = ('gsutil', 'gcs', 'fake')
+GS_OFFLOADER_UPLOADER = global_config.global_config.get_config_value(
+        'CROS', 'gs_offloader_uploader', default='gsutil')
+
+# Number of files uploaded concurrently by the gcs and fake uploaders.
+GS_OFFLOADER_UPLOAD_WORKERS = global_config.global_config.get_config_value(
+        'CROS', 'gs_offloader_upload_workers', type=int, default=16)
+
 D = '[0-9][0-9]'
 TIMESTAMP_PATTERN = '%s%s.%s.%s_%s.%s.%s' % (D, D, D, D, D, D, D)
 CTS_RESULT_PATTERN = 'testResult.xml'
@@ -214,33 +250,115 @@ def _get_finish_cmd_list(gs_path):
         ]
 
 
+class _ResultsManifest(object):
+    """Totals of a result directory, collected while sanitizing it.
+
+    Later stages of the offload use the totals instead of walking the
+    directory again.
+
+    @var file_count: Number of files, as counted by `_count_files()`.
+    @var disk_usage_bytes: Disk space used by the directory and its
+                           contents, as reported by `du`.
+    """
+
+    def __init__(self):
+        self.file_count = 0
+        self.disk_usage_bytes = 0
+
+
+    @property
+    def size_kibibytes(self):
+        """Disk space used by the directory in kibibytes."""
+        return self.disk_usage_bytes / 1024
+
+
+    def add(self, file_stat, is_file):
+        """Add an entry of the directory to the totals.
+
+        @param file_stat: lstat result of the entry.
+        @param is_file: True if `_count_files()` counts the entry as a
+                        file.
+        """
+        self.disk_usage_bytes += file_stat.st_blocks * 512
+        if is_file:
+            self.file_count += 1
+
+
 def sanitize_dir(dirpath):
     """Sanitize directory for gs upload.
 
-    Symlinks and FIFOS are converted to regular files to fix bugs.
+    Filenames are escaped, and Symlinks and FIFOS are converted to regular
+    files to fix bugs.  The directory tree is walked once, and the totals
+    collected on the way are returned for later stages of the offload.
 
     @param dirpath: Directory entry to be sanitized.
+
+    @returns: A _ResultsManifest of the directory, or None if it doesn't
+              exist.
     """
     if not os.path.exists(dirpath):
-        return
+        return None
     _escape_rename(dirpath)
-    _escape_rename_dir_contents(dirpath)
-    _sanitize_fifos(dirpath)
-    _sanitize_symlinks(dirpath)
+    manifest = _ResultsManifest()
+    manifest.add(os.lstat(dirpath), False)
+    symlinks = []
+    _sanitize_dir_contents(dirpath, manifest, symlinks)
+    # Symlinks are checked after all filenames are escaped, as escaping can
+    # break a link to a directory.
+    for path, file_stat in symlinks:
+        if os.path.isdir(path):
+            manifest.add(file_stat, False)
+        else:
+            _replace_symlink_with_file(path)
+            manifest.add(os.lstat(path), True)
+    return manifest
+
 
+def _list_dir_lstat(dirpath):
+    """List the entries of a directory with their lstat results.
 
-def _escape_rename_dir_contents(dirpath):
-    """Recursively rename directory to escape filenames for gs upload.
+    @param dirpath: Directory path string.
+
+    @yields: Tuples of (name, lstat result).
+    """
+    if _scandir is not None:
+        for entry in _scandir(dirpath):
+            yield entry.name, entry.stat(follow_symlinks=False)
+    else:
+        for filename in os.listdir(dirpath):
+            yield filename, os.lstat(os.path.join(dirpath, filename))
+
+
+def _sanitize_dir_contents(dirpath, manifest, symlinks):
+    """Recursively sanitize the contents of a directory in a single pass.
+
+    Filenames are escaped for gs upload, FIFOs are replaced with marker
+    files, and every entry but symlinks is added to `manifest`.  Symlinks
+    are not followed.
 
     @param dirpath: Directory path string.
+    @param manifest: _ResultsManifest to add the entries to.
+    @param symlinks: List to append (path, lstat result) of the symlinks
+                     found to.
     """
-    for filename in os.listdir(dirpath):
+    for filename, file_stat in list(_list_dir_lstat(dirpath)):
         path = os.path.join(dirpath, filename)
-        _escape_rename(path)
-    for filename in os.listdir(dirpath):
-        path = os.path.join(dirpath, filename)
-        if os.path.isdir(path):
-            _escape_rename_dir_contents(path)
+        sanitized_filename = gslib.escape(filename)
+        if sanitized_filename != filename:
+            sanitized_path = os.path.join(dirpath, sanitized_filename)
+            os.rename(path, sanitized_path)
+            path = sanitized_path
+
+        if stat.S_ISDIR(file_stat.st_mode):
+            manifest.add(file_stat, False)
+            _sanitize_dir_contents(path, manifest, symlinks)
+        elif stat.S_ISLNK(file_stat.st_mode):
+            symlinks.append((path, file_stat))
+        elif stat.S_ISFIFO(file_stat.st_mode):
+            _replace_fifo_with_file(path)
+            manifest.add(os.lstat(path), True)
+        else:
+            manifest.add(file_stat, True)
 
 
 def _escape_rename(path):
@@ -254,19 +372,6 @@ def _escape_rename(path):
     os.rename(path, sanitized_path)
 
 
-def _sanitize_fifos(dirpath):
-    """Convert fifos to regular files (fixes crbug.com/684122).
-
-    @param dirpath: Directory path string.
-    """
-    for root, _, files in os.walk(dirpath):
-        for filename in files:
-            path = os.path.join(root, filename)
-            file_stat = os.lstat(path)
-            if stat.S_ISFIFO(file_stat.st_mode):
-                _replace_fifo_with_file(path)
-
-
 def _replace_fifo_with_file(path):
     """Replace a fifo with a normal file.
 
@@ -279,19 +384,6 @@ def _replace_fifo_with_file(path):
         f.write('<FIFO>')
 
 
-def _sanitize_symlinks(dirpath):
-    """Convert Symlinks to regular files (fixes crbug.com/692788).
-
-    @param dirpath: Directory path string.
-    """
-    for root, _, files in os.walk(dirpath):
-        for filename in files:
-            path = os.path.join(root, filename)
-            file_stat = os.lstat(path)
-            if stat.S_ISLNK(file_stat.st_mode):
-                _replace_symlink_with_file(path)
-
-
 def _replace_symlink_with_file(path):
     """Replace a symlink with a normal file.
 
@@ -309,6 +401,19 @@ def _replace_symlink_with_file(path):
 _MAX_FILE_COUNT = 3000
 _FOLDERS_NEVER_ZIP = ['debug', 'ssp_logs', 'autoupdate_logs']
 
+# Compression level of the tarballs made by limit_file_count(), from 1
+# (fastest) to 9 (smallest).
+TARBALL_COMPRESS_LEVEL = global_config.global_config.get_config_value(
+        'CROS', 'gs_offloader_tarball_compress_level', type=int, default=1)
+
+# Number of folders limit_file_count() compresses concurrently.
+TARBALL_WORKERS = global_config.global_config.get_config_value(
+        'CROS', 'gs_offloader_tarball_workers', type=int, default=4)
+
+# Maximum number of seconds limit_file_count() spends compressing the
+# folders of a job.  Folders not compressed in time are offloaded as is.
+TARBALL_TIMEOUT_SECS = 15 * 60
+
 
 def _get_zippable_folders(dir_entry):
     folders_list = []
@@ -320,7 +425,7 @@ def _get_zippable_folders(dir_entry):
     return folders_list
 
 
-def limit_file_count(dir_entry):
+def limit_file_count(dir_entry, manifest=None):
     """Limit the number of files in given directory.
 
     The method checks the total number of files in the given directory.
@@ -329,14 +434,23 @@ def limit_file_count(dir_entry):
     _FOLDERS_NEVER_ZIP.
 
     @param dir_entry: Directory entry to be checked.
+    @param manifest: _ResultsManifest of the directory returned by
+                     `sanitize_dir()`, to use its file count instead of
+                     walking the directory again.
+
+    @returns: True if any folder was compressed, False otherwise.
     """
-    try:
-        count = _count_files(dir_entry)
-    except ValueError:
-        logging.warning('Fail to get the file count in folder %s.', dir_entry)
-        return
+    if manifest is not None:
+        count = manifest.file_count
+    else:
+        try:
+            count = _count_files(dir_entry)
+        except ValueError:
+            logging.warning('Fail to get the file count in folder %s.',
+                            dir_entry)
+            return False
     if count < _MAX_FILE_COUNT:
-        return
+        return False
 
     # For test job, zip folders in a second level, e.g. 123-debug/host1.
     # This is to allow autoserv debug folder still be accessible.
@@ -351,8 +465,18 @@ def limit_file_count(dir_entry):
             subfolders.extend(_get_zippable_folders(folder))
         folders = subfolders
 
-    for folder in folders:
-        _make_into_tarball(folder)
+    if not folders:
+        return False
+    deadline = time.time() + TARBALL_TIMEOUT_SECS
+    pool = ThreadPool(min(TARBALL_WORKERS, len(folders)))
+    try:
+        compressed = pool.map(
+                lambda folder: _try_make_into_tarball(folder, deadline),
+                folders)
+    finally:
+        pool.close()
+        pool.join()
+    return any(compressed)
 
 
 def _count_files(dirpath):
@@ -363,15 +487,102 @@ def _count_files(dirpath):
     return sum(len(files) for _path, _dirs, files in os.walk(dirpath))
 
 
-def _make_into_tarball(dirpath):
+class _TarballTimeoutError(Exception):
+    """Making a tarball took longer than allowed.
+
+    @var count: The number of files added before giving up.
+    """
+
+    def __init__(self, path):
+        super(_TarballTimeoutError, self).__init__(path)
+        self.count = 0
+
+
+def _add_to_tarball(tar, path, arcname, deadline):
+    """Add a path to a tarball recursively, like `TarFile.add()`.
+
+    @param tar: TarFile object open for writing.
+    @param path: Path to add.
+    @param arcname: Name of the path in the tarball.
+    @param deadline: time.time() value after which to give up, or None.
+
+    @return The number of files added.
+    @raises _TarballTimeoutError if the deadline passed.
+    """
+    if deadline is not None and time.time() > deadline:
+        raise _TarballTimeoutError(path)
+    # The file content is streamed from disk into the compressor.
+    tar.add(path, arcname=arcname, recursive=False)
+    if not os.path.isdir(path) or os.path.islink(path):
+        return 1
+    count = 0
+    for name in sorted(os.listdir(path)):
+        try:
+            count += _add_to_tarball(tar, os.path.join(path, name),
+                                     os.path.join(arcname, name), deadline)
+        except _TarballTimeoutError as e:
+            e.count += count
+            raise
+    return count
+
+
+def _make_into_tarball(dirpath, deadline=None):
     """Make directory into tarball.
 
+    The tarball is written under a temporary name, so the directory is
+    left undisturbed if the deadline passes.
+
     @param dirpath: Directory path string.
+    @param deadline: time.time() value after which to give up, or None.
+
+    @return The number of files in the tarball.
+    @raises _TarballTimeoutError if the deadline passed.
     """
     tarpath = '%s.tgz' % dirpath
-    with tarfile.open(tarpath, 'w:gz') as tar:
-        tar.add(dirpath, arcname=os.path.basename(dirpath))
+    temp_path = '%s.tmp' % tarpath
+    try:
+        with tarfile.open(temp_path, 'w:gz',
+                          compresslevel=TARBALL_COMPRESS_LEVEL) as tar:
+            count = _add_to_tarball(tar, dirpath, os.path.basename(dirpath),
+                                    deadline)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.rename(temp_path, tarpath)
     shutil.rmtree(dirpath)
+    return count
+
+
+def _try_make_into_tarball(dirpath, deadline):
+    """Make directory into tarball, unless the deadline passes.
+
+    @param dirpath: Directory path string.
+    @param deadline: time.time() value after which to give up.
+
+    @return True if the directory was replaced by a tarball.
+    """
+    start_time = time.time()
+    count = 0
+    try:
+        count = _make_into_tarball(dirpath, deadline)
+        status = 'success'
+    except _TarballTimeoutError as e:
+        logging.warning('Ran out of time to compress %s, offloading it '
+                        'as is.', dirpath)
+        count = e.count
+        status = 'timed_out'
+    duration = time.time() - start_time
+    logging.debug('Compressed %d files of %s in %.2f seconds (%s).',
+                  count, dirpath, duration, status)
+    fields = {'status': status}
+    metrics.SecondsDistribution(
+            'chromeos/autotest/gs_offloader/tarball_duration').add(
+                    duration, fields=fields)
+    metrics.Counter(
+            'chromeos/autotest/gs_offloader/tarball_files').increment_by(
+                    count, fields=fields)
+    return status == 'success'
 
 
 def correct_results_folder_permission(dir_entry):
@@ -651,6 +862,346 @@ def _handle_dir_os_error(dir_entry, fix_permission=False):
     metrics.Counter(m_permission_error).increment(fields=metrics_fields)
 
 
+class BaseUploader(object):
+
+    """Interface of the backends copying a result directory to storage.
+
+    `GSOffloader` hands every job directory to an uploader, then asks
+    it to mark the destination as finished.  Uploaders are created in
+    the main process and used in the offload worker processes.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def upload(self, dir_entry, gs_path, stdout_file, stderr_file):
+        """Copy a directory entry to `gs_path`.
+
+        The directory is copied to `<gs_path>/<basename of dir_entry>`.
+
+        @param dir_entry: Directory entry to offload.
+        @param gs_path: gs:// url of the remote directory to copy into.
+        @param stdout_file: Log file.
+        @param stderr_file: Log file for errors.
+
+        @return The return code of the upload, 0 on success.
+        """
+
+    @abc.abstractmethod
+    def mark_finished(self, gs_path, stdout_file, stderr_file):
+        """Mark a remote directory as finished uploading.
+
+        Uploaders may defer writing the marker until `flush()`.
+
+        @param gs_path: gs:// url of the remote directory.
+        @param stdout_file: Log file.
+        @param stderr_file: Log file for errors.
+        """
+
+    def abort(self):
+        """Stop the upload in progress, after a timeout."""
+
+    def flush(self):
+        """Write out any deferred work, e.g. the finished markers."""
+
+
+class GsutilUploader(BaseUploader):
+
+    """Uploader running one gsutil process per directory."""
+
+    def __init__(self, multiprocessing):
+        """Initialize the uploader.
+
+        @param multiprocessing: True to turn on -m option for gsutil.
+        """
+        self._multiprocessing = multiprocessing
+        self._process = None
+
+    def upload(self, dir_entry, gs_path, stdout_file, stderr_file):
+        """Copy a directory entry to `gs_path` with gsutil.
+
+        See `BaseUploader.upload()`.
+        """
+        cmd = _get_cmd_list(self._multiprocessing, dir_entry, gs_path)
+        logging.debug('Attempting an offload command %s', cmd)
+        self._process = subprocess.Popen(
+                cmd, stdout=stdout_file, stderr=stderr_file)
+        self._process.wait()
+        logging.debug('Offload command %s completed; '
+                      'marking offload complete.', cmd)
+        return self._process.returncode
+
+    def mark_finished(self, gs_path, stdout_file, stderr_file):
+        """Mark a remote directory as finished with gsutil.
+
+        See `BaseUploader.mark_finished()`.
+        """
+        _mark_upload_finished(gs_path, stdout_file, stderr_file)
+
+    def abort(self):
+        """Terminate the gsutil process, if it is still running."""
+        # We don't bother calling process.poll(); that inherently races
+        # because the child can die any time it wants.
+        if self._process:
+            try:
+                self._process.terminate()
+            except OSError:
+                # We don't expect any error other than "No such
+                # process".
+                pass
+
+
+def _split_gs_url(url):
+    """Split a gs:// url into its bucket and object name.
+
+    @param url: gs:// url string.
+
+    @return A tuple of (bucket, object name).
+    """
+    bucket, _, name = url[len('gs://'):].partition('/')
+    return bucket, name
+
+
+class _PooledUploader(BaseUploader):
+
+    """Uploader copying the files of a directory in a pool of threads.
+
+    The pool and one connection per thread are kept for the life of the
+    offload worker process, so each file only costs a request on an
+    already open connection.  The finished markers are collected and
+    written once per remote directory in `flush()`, as the jobs of an
+    offload cycle mostly share a few parent directories.
+
+    Subclasses implement the connection and the copy of a single file.
+    """
+
+    def __init__(self, workers=None):
+        """Initialize the uploader.
+
+        @param workers: Number of files to upload concurrently.
+        """
+        self._workers = workers or GS_OFFLOADER_UPLOAD_WORKERS
+        self._pool = None
+        self._pool_pid = None
+        self._local = threading.local()
+        # Each upload or flush tags its copies with a new generation, so
+        # that aborting one skips its queued copies but not those of the
+        # next one.
+        self._generation = 0
+        self._aborted_generation = 0
+        self._pending_markers = set()
+
+    @abc.abstractmethod
+    def _connect(self):
+        """Open a connection for the calling thread.
+
+        @return A connection object passed to `_put_file()`.
+        """
+
+    @abc.abstractmethod
+    def _put_file(self, connection, path, url):
+        """Copy a single local file.
+
+        @param connection: The calling thread's connection.
+        @param path: Path of the local file, or None for an empty object.
+        @param url: gs:// url of the destination object.
+        """
+
+    def _get_pool(self):
+        """Return the worker pool, created in the current process."""
+        # Threads don't survive a fork, so a pool created before the
+        # offload worker processes were forked can't be used.
+        if self._pool_pid != os.getpid():
+            self._pool = ThreadPool(self._workers)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _copy(self, item):
+        """Copy a file using the calling thread's connection.
+
+        @param item: A tuple of (generation, local path, gs:// url of the
+                     destination object).  The path is None for an empty
+                     object.
+
+        @return An error message, or None on success.
+        """
+        generation, path, url = item
+        if generation <= self._aborted_generation:
+            return 'Aborted before copying %s' % path
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        try:
+            self._put_file(connection, path, url)
+        except Exception as e:
+            # Reconnect for the next file, in case the connection
+            # was broken.
+            self._local.connection = None
+            return 'Failed to copy %s to %s: %s' % (path, url, e)
+        return None
+
+    def _list_files(self, dir_entry, gs_path):
+        """List the files to copy, in the same layout as gsutil.
+
+        Symlinks are skipped, like `gsutil -e`.
+
+        @param dir_entry: Directory entry to offload.
+        @param gs_path: gs:// url of the remote directory to copy into.
+
+        @yield Tuples of (local path, gs:// url).
+        """
+        target = os.path.join(gs_path, os.path.basename(dir_entry))
+        for dirpath, dirnames, filenames in os.walk(dir_entry):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path):
+                    continue
+                yield path, os.path.join(
+                        target, os.path.relpath(path, dir_entry))
+
+    def _copy_all(self, files):
+        """Copy the files in the pool, as a new generation of copies.
+
+        @param files: Iterable of (local path, gs:// url) tuples.
+
+        @return An iterator over the error message, or None, of each copy
+                as it finishes.
+        """
+        self._generation += 1
+        generation = self._generation
+        return self._get_pool().imap_unordered(
+                self._copy, ((generation, path, url) for path, url in files))
+
+    def upload(self, dir_entry, gs_path, stdout_file, stderr_file):
+        """Copy a directory entry to `gs_path` in the worker pool.
+
+        See `BaseUploader.upload()`.
+        """
+        start_time = time.time()
+        files = list(self._list_files(dir_entry, gs_path))
+        errors = 0
+        for error in self._copy_all(files):
+            if error:
+                errors += 1
+                stderr_file.write(error + '\n')
+        stdout_file.write('Copied %d of %d files from %s in %.2f seconds.\n' %
+                          (len(files) - errors, len(files), dir_entry,
+                           time.time() - start_time))
+        return 1 if errors else 0
+
+    def mark_finished(self, gs_path, stdout_file, stderr_file):
+        """Queue the finished marker of a remote directory.
+
+        See `BaseUploader.mark_finished()`.
+        """
+        self._pending_markers.add(os.path.join(gs_path, '.finished_offload'))
+
+    def abort(self):
+        """Skip the files of the current upload not copied yet."""
+        self._aborted_generation = self._generation
+
+    def flush(self):
+        """Write the queued finished markers."""
+        if not self._pending_markers:
+            return
+        markers = sorted(self._pending_markers)
+        self._pending_markers.clear()
+        logging.debug('Marking %d remote directories as finished',
+                      len(markers))
+        for error in self._copy_all([(None, url) for url in markers]):
+            if error:
+                logging.warning(error)
+
+
+class GCSUploader(_PooledUploader):
+
+    """Uploader using the Google Cloud Storage client library."""
+
+    def _connect(self):
+        """Create a storage client, keeping its HTTP connections open."""
+        return gcs_storage.Client()
+
+    def _put_file(self, connection, path, url):
+        """Upload a single file to Google Storage.
+
+        See `_PooledUploader._put_file()`.
+        """
+        bucket, name = _split_gs_url(url)
+        blob = connection.bucket(bucket).blob(name)
+        if path is None:
+            blob.upload_from_string('')
+        else:
+            blob.upload_from_filename(path)
+
+
+class FakeBucketUploader(_PooledUploader):
+
+    """Uploader copying to a local directory standing in for the buckets.
+
+    `gs://<bucket>/<name>` is copied to `<root_dir>/<bucket>/<name>`, so
+    the offload can be tested and benchmarked without Google Storage.
+    """
+
+    def __init__(self, root_dir, workers=None):
+        """Initialize the uploader.
+
+        @param root_dir: Local directory holding the fake buckets.
+        @param workers: Number of files to copy concurrently.
+        """
+        super(FakeBucketUploader, self).__init__(workers)
+        self._root_dir = root_dir
+
+    def get_local_path(self, url):
+        """Return the local path of a gs:// url.
+
+        @param url: gs:// url string.
+        """
+        bucket, name = _split_gs_url(url)
+        return os.path.join(self._root_dir, bucket, name)
+
+    def _connect(self):
+        """The fake buckets don't need a connection."""
+        return True
+
+    def _put_file(self, connection, path, url):
+        """Copy a single file into the fake bucket.
+
+        See `_PooledUploader._put_file()`.
+        """
+        dest = self.get_local_path(url)
+        file_utils.make_leaf_dir(os.path.dirname(dest))
+        if path is None:
+            with open(dest, 'w'):
+                pass
+        else:
+            shutil.copyfile(path, dest)
+
+
+def get_uploader(name, multiprocessing, fake_bucket_dir=None, workers=None):
+    """Create the uploader for the given backend name.
+
+    @param name: One of `UPLOADERS`.
+    @param multiprocessing: True to turn on -m option for gsutil.
+    @param fake_bucket_dir: Local directory holding the fake buckets, for
+                            the 'fake' uploader.
+    @param workers: Number of files to upload concurrently, for the
+                    pooled uploaders.
+
+    @return A BaseUploader instance.
+    """
+    if name == 'gcs':
+        if gcs_storage is None:
+            raise ValueError('The gcs uploader needs the google-cloud-storage '
+                             'package.')
+        return GCSUploader(workers)
+    if name == 'fake':
+        if not fake_bucket_dir:
+            raise ValueError('The fake uploader needs a fake bucket '
+                             'directory.')
+        return FakeBucketUploader(fake_bucket_dir, workers)
+    return GsutilUploader(multiprocessing)
+
+
 class BaseGSOffloader(object):
 
     """Google Storage offloader interface."""
@@ -703,23 +1254,37 @@ class BaseGSOffloader(object):
                                   database.
         """
 
+    def flush(self):
+        """Finish any work deferred by the offloads of this process.
+
+        Called in each offload worker process once the jobs of an
+        offload cycle are processed.
+        """
+
 
 class GSOffloader(BaseGSOffloader):
     """Google Storage Offloader."""
 
     def __init__(self, gs_uri, multiprocessing, delete_age,
-            console_client=None):
+            console_client=None, uploader=None):
         """Returns the offload directory function for the given gs_uri
 
         @param gs_uri: Google storage bucket uri to offload to.
         @param multiprocessing: True to turn on -m option for gsutil.
         @param console_client: The cloud console client. If None,
           cloud console APIs are  not called.
+        @param uploader: BaseUploader to copy the results with.  If None,
+          results are copied with gsutil.
         """
         self._gs_uri = gs_uri
         self._multiprocessing = multiprocessing
         self._delete_age = delete_age
         self._console_client = console_client
+        self._uploader = uploader or GsutilUploader(multiprocessing)
+
+    def flush(self):
+        """Write the finished markers deferred by the uploader."""
+        self._uploader.flush()
 
     @metrics.SecondsTimerDecorator(
             'chromeos/autotest/gs_offloader/job_offload_duration')
@@ -809,29 +1374,25 @@ class GSOffloader(BaseGSOffloader):
           logging.debug('Failed to load the side effects config in %s.',
                         dir_entry)
         try:
-            sanitize_dir(dir_entry)
+            manifest = sanitize_dir(dir_entry)
             if DEFAULT_CTS_RESULTS_GSURI and cts_enabled:
                 _upload_cts_testresult(dir_entry, self._multiprocessing)
 
-            if LIMIT_FILE_COUNT:
-                limit_file_count(dir_entry)
+            if LIMIT_FILE_COUNT and limit_file_count(dir_entry, manifest):
+                # The totals changed when folders were compressed.
+                manifest = None
 
-            process = None
             with timeout_util.Timeout(OFFLOAD_TIMEOUT_SECS):
                 gs_path = '%s%s' % (self._gs_uri, dest_path)
-                cmd = _get_cmd_list(self._multiprocessing, dir_entry, gs_path)
-                logging.debug('Attempting an offload command %s', cmd)
-                process = subprocess.Popen(
-                    cmd, stdout=stdout_file, stderr=stderr_file)
-                process.wait()
-                logging.debug('Offload command %s completed; '
-                              'marking offload complete.', cmd)
-                _mark_upload_finished(gs_path, stdout_file, stderr_file)
-
-            _emit_gs_returncode_metric(process.returncode)
-            if process.returncode != 0:
+                returncode = self._uploader.upload(
+                        dir_entry, gs_path, stdout_file, stderr_file)
+                self._uploader.mark_finished(
+                        gs_path, stdout_file, stderr_file)
+
+            _emit_gs_returncode_metric(returncode)
+            if returncode != 0:
                 raise error_obj
-            _emit_offload_metrics(dir_entry)
+            _emit_offload_metrics(dir_entry, manifest)
 
             if self._console_client:
                 gcs_uri = os.path.join(gs_path,
@@ -844,17 +1405,7 @@ class GSOffloader(BaseGSOffloader):
         except timeout_util.TimeoutError:
             m_timeout = 'chromeos/autotest/errors/gs_offloader/timed_out_count'
             metrics.Counter(m_timeout).increment(fields=metrics_fields)
-            # If we finished the call to Popen(), we may need to
-            # terminate the child process.  We don't bother calling
-            # process.poll(); that inherently races because the child
-            # can die any time it wants.
-            if process:
-                try:
-                    process.terminate()
-                except OSError:
-                    # We don't expect any error other than "No such
-                    # process".
-                    pass
+            self._uploader.abort()
             logging.error('Offloading %s timed out after waiting %d '
                           'seconds.', dir_entry, OFFLOAD_TIMEOUT_SECS)
             raise error_obj
@@ -973,40 +1524,81 @@ class OptionalMemoryCache(object):
 job_timestamp_cache = OptionalMemoryCache()
 
 
-def _cached_get_timestamp_if_finished(job):
+def _cached_get_timestamp_if_finished(job, timestamps=None):
     """Retrieve a job finished timestamp from cache or AFE.
     @param job       _JobDirectory instance to retrieve
                      finished timestamp of..
+    @param timestamps  A dictionary of job dirname: timestamp looked up
+                       by `_prefetch_timestamps()` in this offload cycle.
+                       Jobs found in it are not looked up again.
 
     @returns: None if the job is not finished, or the
               last job finished time recorded by Autotest.
     """
     job_timestamp = job_timestamp_cache.get(job.dirname)
     if not job_timestamp:
-        job_timestamp = job.get_timestamp_if_finished()
+        if timestamps is not None and job.dirname in timestamps:
+            job_timestamp = timestamps[job.dirname]
+        else:
+            job_timestamp = job.get_timestamp_if_finished()
         if job_timestamp:
             job_timestamp_cache.add(job.dirname, job_timestamp)
     return job_timestamp
 
 
-def _is_expired(job, age_limit):
+def _prefetch_timestamps(jobs):
+    """Look up the finished timestamps of jobs missing from the cache.
+
+    Jobs are grouped by class, and each class looks up all its jobs
+    with a few batched queries, rather than one or two AFE RPCs per
+    job.  Timestamps of finished jobs are added to
+    `job_timestamp_cache`.
+
+    @param jobs: A list of _JobDirectory instances.
+
+    @returns: A dictionary of job dirname: timestamp for the jobs
+              looked up.  The timestamp is None if the job is not
+              finished.
+    """
+    jobs_by_class = {}
+    for job in jobs:
+        if not job_timestamp_cache.get(job.dirname):
+            jobs_by_class.setdefault(type(job), []).append(job)
+    timestamps = {}
+    for cls, cls_jobs in jobs_by_class.iteritems():
+        timestamps.update(cls.get_timestamps_if_finished(cls_jobs))
+    for dirname, timestamp in timestamps.iteritems():
+        if timestamp:
+            job_timestamp_cache.add(dirname, timestamp)
+    return timestamps
+
+
+def _is_expired(job, age_limit, timestamps=None):
     """Return whether job directory is expired for uploading
 
     @param job: _JobDirectory instance.
     @param age_limit:  Minimum age in days at which a job may be offloaded.
+    @param timestamps: A dictionary of job dirname: timestamp looked up in
+                       this offload cycle, see `_prefetch_timestamps()`.
     """
-    job_timestamp = _cached_get_timestamp_if_finished(job)
+    job_timestamp = _cached_get_timestamp_if_finished(job, timestamps)
     if not job_timestamp:
         return False
     return job_directories.is_job_expired(age_limit, job_timestamp)
 
 
-def _emit_offload_metrics(dirpath):
+def _emit_offload_metrics(dirpath, manifest=None):
     """Emit gs offload metrics.
 
     @param dirpath: Offloaded directory path.
+    @param manifest: _ResultsManifest of the directory returned by
+                     `sanitize_dir()`, to use its size instead of running
+                     `du` on the directory.
     """
-    dir_size = file_utils.get_directory_size_kibibytes(dirpath)
+    if manifest is not None:
+        dir_size = manifest.size_kibibytes
+    else:
+        dir_size = file_utils.get_directory_size_kibibytes(dirpath)
     metrics_fields = _get_metrics_fields(dirpath)
 
     m_offload_count = (
@@ -1019,6 +1611,10 @@ def _emit_offload_metrics(dirpath):
             dir_size, fields=metrics_fields)
 
 
+# Name of the file marking a job directory as uploaded.
+_UPLOADED_MARKER_NAME = '.GS_UPLOADED'
+
+
 def _is_uploaded(dirpath):
     """Return whether directory has been uploaded.
 
@@ -1054,7 +1650,7 @@ def _get_uploaded_marker_file(dirpath):
 
     @param dirpath: Directory path string.
     """
-    return '%s/.GS_UPLOADED' % (dirpath,)
+    return '%s/%s' % (dirpath, _UPLOADED_MARKER_NAME)
 
 
 def _format_job_for_failure_reporting(job):
@@ -1130,9 +1726,12 @@ class Offloader(object):
             if (cloud_console_client and
                     cloud_console_client.is_cloud_notification_enabled()):
                 console_client = cloud_console_client.PubSubBasedClient()
+            uploader = get_uploader(options.uploader, multiprocessing,
+                                    options.fake_bucket_dir)
+            logging.info('Offloader uploader is set to:%s', options.uploader)
             self._gs_offloader = GSOffloader(
                     self.gs_uri, multiprocessing, self._delete_age_limit,
-                    console_client)
+                    console_client, uploader=uploader)
         classlist = [
                 job_directories.SwarmingJobDirectory,
         ]
@@ -1142,6 +1741,15 @@ class Offloader(object):
             classlist.append(job_directories.RegularJobDirectory)
         self._jobdir_classes = classlist
         assert self._jobdir_classes
+        self._watcher = None
+        if options.watch_results:
+            try:
+                self._watcher = job_directory_watcher.JobDirectoryWatcher(
+                        classlist, _UPLOADED_MARKER_NAME,
+                        WATCH_RESCAN_INTERVAL_SECS)
+            except OSError as e:
+                logging.warning('Failed to watch the results, globbing them '
+                                'on every cycle instead: %s', e)
         self._processes = options.parallelism
         self._open_jobs = {}
         self._pusub_topic = None
@@ -1156,23 +1764,45 @@ class Offloader(object):
 
         """
         new_job_count = 0
-        for cls in self._jobdir_classes:
-            for resultsdir in cls.get_job_directories():
-                if resultsdir in self._open_jobs:
-                    continue
-                self._open_jobs[resultsdir] = cls(resultsdir)
-                new_job_count += 1
+        for resultsdir, cls in self._get_job_directories():
+            if resultsdir in self._open_jobs:
+                continue
+            self._open_jobs[resultsdir] = cls(resultsdir)
+            new_job_count += 1
         logging.debug('Start of offload cycle - found %d new jobs',
                       new_job_count)
 
 
+    def _get_job_directories(self):
+        """Find the job directories, with the watcher if there is one.
+
+        @return An iterable of tuples of (job directory, job directory
+                class).
+        """
+        if self._watcher:
+            self._watcher.update()
+            return self._watcher.get_job_directories().items()
+        return ((resultsdir, cls) for cls in self._jobdir_classes
+                for resultsdir in cls.get_job_directories())
+
+
+    def _is_offloaded(self, dirname):
+        """Return whether a job directory is removed or uploaded.
+
+        @param dirname: Job directory.
+        """
+        if self._watcher:
+            return self._watcher.is_offloaded(dirname)
+        return not os.path.exists(dirname) or _is_uploaded(dirname)
+
+
     def _remove_offloaded_jobs(self):
         """Removed offloaded jobs from `self._open_jobs`."""
+        if self._watcher:
+            self._watcher.update()
         removed_job_count = 0
         for jobkey, job in self._open_jobs.items():
-            if (
-                    not os.path.exists(job.dirname)
-                    or _is_uploaded(job.dirname)):
+            if self._is_offloaded(job.dirname):
                 del self._open_jobs[jobkey]
                 removed_job_count += 1
         logging.debug('End of offload cycle - cleared %d jobs, '
@@ -1212,10 +1842,13 @@ class Offloader(object):
         """
         self._add_new_jobs()
         self._report_current_jobs_count()
+        timestamps = _prefetch_timestamps(self._open_jobs.values())
         with parallel.BackgroundTaskRunner(
-                self._gs_offloader.offload, processes=self._processes) as queue:
+                self._gs_offloader.offload, processes=self._processes,
+                onexit=self._gs_offloader.flush) as queue:
             for job in self._open_jobs.values():
-                _enqueue_offload(job, queue, self._upload_age_limit)
+                _enqueue_offload(job, queue, self._upload_age_limit,
+                                 timestamps)
         self._give_up_on_jobs_over_limit()
         self._remove_offloaded_jobs()
         self._report_failed_jobs()
@@ -1268,7 +1901,7 @@ class Offloader(object):
                 len(failed_jobs))
 
 
-def _enqueue_offload(job, queue, age_limit):
+def _enqueue_offload(job, queue, age_limit, timestamps=None):
     """Enqueue the job for offload, if it's eligible.
 
     The job is eligible for offloading if the database has marked
@@ -1285,15 +1918,18 @@ def _enqueue_offload(job, queue, age_limit):
     @param age_limit Minimum age for a job to be offloaded.  A value
                      of 0 means that the job will be offloaded as
                      soon as it is finished.
+    @param timestamps  A dictionary of job dirname: timestamp looked up
+                       in this offload cycle, see
+                       `_prefetch_timestamps()`.
 
     """
     if not job.offload_count:
-        if not _is_expired(job, age_limit):
+        if not _is_expired(job, age_limit, timestamps):
             return
         job.first_offload_start = time.time()
     job.offload_count += 1
     if job.process_gs_instructions():
-        timestamp = _cached_get_timestamp_if_finished(job)
+        timestamp = _cached_get_timestamp_if_finished(job, timestamps)
         queue.put([job.dirname, os.path.dirname(job.dirname), timestamp])
 
 
@@ -1356,6 +1992,25 @@ def parse_options():
                       dest='enable_timestamp_cache',
                       action='store_true',
                       help='Cache the finished timestamps from AFE.')
+    parser.add_option('-w', '--watch_results', dest='watch_results',
+                      action='store_true',
+                      default=GS_OFFLOADER_WATCH_RESULTS,
+                      help='Find new results with inotify, instead of '
+                      'globbing the results directory on every cycle. If '
+                      'not set, the global config setting '
+                      'gs_offloader_watch_results under CROS section is '
+                      'applied.')
+    parser.add_option('--uploader', dest='uploader', type='choice',
+                      choices=UPLOADERS, default=GS_OFFLOADER_UPLOADER,
+                      help='Backend to copy the results with: gsutil runs '
+                      'a gsutil process per job, gcs uploads the files '
+                      'from a pool of threads, fake copies them to the '
+                      'local --fake_bucket_dir. If not set, the global '
+                      'config setting gs_offloader_uploader under CROS '
+                      'section is applied.')
+    parser.add_option('--fake_bucket_dir', dest='fake_bucket_dir',
+                      help='Local directory holding the buckets, for the '
+                      'fake uploader.')
 
     options = parser.parse_args()[0]
     if options.process_all and options.process_hosts_only:
@@ -1416,7 +2071,7 @@ def main():
                                              debug_file=options.metrics_file):
         with metrics.SuccessCounter('chromeos/autotest/gs_offloader/exit'):
             offloader = Offloader(options)
-            if not options.delete_only:
+            if not options.delete_only and options.uploader != 'fake':
                 wait_for_gs_write_access(offloader.gs_uri)
             while True:
                 offloader.offload_once()
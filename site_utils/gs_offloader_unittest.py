@@ -22,6 +22,7 @@ import mock
 import mox
 
 import common
+from autotest_lib.client.common_lib import file_utils
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import utils
 #For unittest without cloud_client.proto compiled.
@@ -117,14 +118,16 @@ class OffloaderOptionsTests(mox.MoxTestBase):
             cloud_console_client.is_cloud_notification_enabled().AndReturn(True)
             gs_offloader.GSOffloader(
                     expected_gsuri, multiprocessing, delete_age,
-                    mox.IsA(cloud_console_client.PubSubBasedClient)).AndReturn(
+                    mox.IsA(cloud_console_client.PubSubBasedClient),
+                    uploader=mox.IsA(gs_offloader.GsutilUploader)).AndReturn(
                         sub_offloader)
         else:
             if cloud_console_client:
                 cloud_console_client.is_cloud_notification_enabled().AndReturn(
                         False)
             gs_offloader.GSOffloader(
-                expected_gsuri, multiprocessing, delete_age, None).AndReturn(
+                expected_gsuri, multiprocessing, delete_age, None,
+                uploader=mox.IsA(gs_offloader.GsutilUploader)).AndReturn(
                     sub_offloader)
         self.mox.ReplayAll()
         return sub_offloader
@@ -753,6 +756,29 @@ class OffloadDirectoryTests(_TempResultsDirTestBase):
         shutil.rmtree(results_folder)
 
 
+    def test_sanitize_dir_manifest(self):
+        """Test the totals returned by sanitize_dir match a directory walk.
+        """
+        results_folder = tempfile.mkdtemp()
+        folder = os.path.join(results_folder, 'folder_[1]', 'sub')
+        os.makedirs(folder)
+        for i in range(20):
+            with open(os.path.join(folder, 'file_%d#' % i), 'w') as f:
+                f.write('x' * 1000 * i)
+        os.mkfifo(os.path.join(results_folder, 'test_fifo'))
+        os.symlink(os.path.join(results_folder, 'no-such-file'),
+                   os.path.join(results_folder, 'broken-link'))
+        os.symlink(folder, os.path.join(results_folder, 'folder-link'))
+
+        manifest = gs_offloader.sanitize_dir(results_folder)
+        self.assertEqual(gs_offloader._count_files(results_folder),
+                         manifest.file_count)
+        self.assertEqual(
+                file_utils.get_directory_size_kibibytes(results_folder),
+                manifest.size_kibibytes)
+        shutil.rmtree(results_folder)
+
+
     def check_limit_file_count(self, is_test_job=True):
         """Test that folder with too many files can be compressed.
 
@@ -793,6 +819,68 @@ class OffloadDirectoryTests(_TempResultsDirTestBase):
         self.check_limit_file_count(is_test_job=False)
 
 
+    def test_limit_file_count_timeout(self):
+        """Test that folders are left as is when compressing times out."""
+        results_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, results_folder)
+        sysinfo_folder = os.path.join(results_folder, 'lab1-host1', 'sysinfo')
+        os.makedirs(sysinfo_folder)
+        for i in range(10):
+            with open(os.path.join(sysinfo_folder, str(i)), 'w') as f:
+                f.write('test')
+
+        gs_offloader._MAX_FILE_COUNT = 1
+        with mock.patch.object(gs_offloader, 'TARBALL_TIMEOUT_SECS', -1):
+            self.assertFalse(gs_offloader.limit_file_count(results_folder))
+        self.assertEqual(10, len(os.listdir(sysinfo_folder)))
+        self.assertEqual(['sysinfo'],
+                         os.listdir(os.path.dirname(sysinfo_folder)))
+
+
+    def test_make_into_tarball(self):
+        """Test that the tarball has the same content as the folder."""
+        results_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, results_folder)
+        folder = os.path.join(results_folder, 'sysinfo')
+        os.makedirs(os.path.join(folder, 'var', 'log'))
+        for name in ['a', 'var/b', 'var/log/c']:
+            with open(os.path.join(folder, name), 'w') as f:
+                f.write(name)
+        os.symlink('a', os.path.join(folder, 'link'))
+
+        self.assertEqual(4, gs_offloader._make_into_tarball(folder))
+        self.assertFalse(os.path.exists(folder))
+        with tarfile.open(folder + '.tgz') as tar:
+            self.assertEqual(
+                    ['sysinfo', 'sysinfo/a', 'sysinfo/link', 'sysinfo/var',
+                     'sysinfo/var/b', 'sysinfo/var/log',
+                     'sysinfo/var/log/c'],
+                    sorted(tar.getnames()))
+            self.assertTrue(tar.getmember('sysinfo/link').issym())
+            self.assertEqual('var/log/c',
+                             tar.extractfile('sysinfo/var/log/c').read())
+
+
+    def test_make_into_tarball_timeout(self):
+        """Test that a timed out tarball reports the files it compressed."""
+        results_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, results_folder)
+        folder = os.path.join(results_folder, 'sysinfo')
+        os.makedirs(os.path.join(folder, 'var'))
+        for name in ['a', 'b', 'var/c', 'var/d']:
+            with open(os.path.join(folder, name), 'w') as f:
+                f.write(name)
+
+        # The deadline passes after sysinfo, a, b, var and var/c are added.
+        with mock.patch.object(gs_offloader, 'time') as fake_time:
+            fake_time.time.side_effect = [0] * 5 + [10]
+            with self.assertRaises(gs_offloader._TarballTimeoutError) as cm:
+                gs_offloader._make_into_tarball(folder, deadline=5)
+        self.assertEqual(3, cm.exception.count)
+        self.assertTrue(os.path.isdir(folder))
+        self.assertEqual(['sysinfo'], os.listdir(results_folder))
+
+
     def test_is_valid_result(self):
         """Test _is_valid_result."""
         release_build = 'veyron_minnie-cheets-release/R52-8248.0.0'
@@ -1059,7 +1147,8 @@ class OffladerConfigTests(_TempResultsDirTestBase):
                          stderr=stderr).AndReturn(_get_fake_process())
         gs_offloader._OffloadError(mox.IgnoreArg())
         gs_offloader._emit_gs_returncode_metric(mox.IgnoreArg()).AndReturn(True)
-        gs_offloader._emit_offload_metrics(mox.IgnoreArg()).AndReturn(True)
+        gs_offloader._emit_offload_metrics(
+                mox.IgnoreArg(), mox.IgnoreArg()).AndReturn(True)
         sub_offloader = gs_offloader.GSOffloader(results_dir, True, 0, None)
         subprocess.Popen(mox.IgnoreArg(),
                          stdout=stdout,
@@ -1256,6 +1345,55 @@ class JobDirectoryOffloadTests(_TempResultsDirTestBase):
         self._offload_expired_job(_TEST_EXPIRATION_AGE)
 
 
+class _BatchedMockJobDirectory(_MockJobDirectory):
+    """`_MockJobDirectory` counting lookups of its timestamps."""
+
+    lookup_count = 0
+
+
+    def get_timestamp_if_finished(self):
+        type(self).lookup_count += 1
+        return self._timestamp
+
+
+    @classmethod
+    def get_timestamps_if_finished(cls, jobs):
+        cls.lookup_count += 1
+        return dict((job.dirname, job._timestamp) for job in jobs)
+
+
+class PrefetchTimestampsTests(_TempResultsDirTestBase):
+    """Tests for `_prefetch_timestamps()`."""
+
+    def setUp(self):
+        super(PrefetchTimestampsTests, self).setUp()
+        _BatchedMockJobDirectory.lookup_count = 0
+        self._jobs = []
+        for i in range(100):
+            jobdir = '%d-prefetch' % (1000 + i)
+            os.makedirs(jobdir)
+            job = _BatchedMockJobDirectory(jobdir)
+            if i % 2:
+                job.set_expired(_TEST_EXPIRATION_AGE)
+            self._jobs.append(job)
+
+
+    def test_lookups_per_cycle(self):
+        """Test timestamps of all jobs are looked up at once per cycle.
+
+        Enqueueing the jobs of an offload cycle doesn't look up any
+        timestamp again.
+
+        """
+        queue = Queue.Queue()
+        timestamps = gs_offloader._prefetch_timestamps(self._jobs)
+        for job in self._jobs:
+            gs_offloader._enqueue_offload(job, queue, _TEST_EXPIRATION_AGE,
+                                          timestamps)
+        self.assertEqual(1, _BatchedMockJobDirectory.lookup_count)
+        self.assertEqual(50, queue.qsize())
+
+
 class GetJobDirectoriesTests(_TempResultsDirTestBase):
     """Tests for `_JobDirectory.get_job_directories()`."""
 
@@ -1477,6 +1615,92 @@ class ReportingTests(_TempResultsDirTestBase):
         self._run_update(new_jobs)
 
 
+class FakeBucketUploaderTests(_TempResultsDirTestCase):
+    """Tests for `FakeBucketUploader`."""
+
+    def setUp(self):
+        super(FakeBucketUploaderTests, self).setUp()
+        self._bucket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._bucket_dir)
+        self._uploader = gs_offloader.FakeBucketUploader(self._bucket_dir,
+                                                         workers=4)
+        self._job = self.make_job(self.SPECIAL_JOBLIST[0])
+        self._files = ['status.log', 'debug/autoserv.DEBUG']
+        for name in self._files:
+            path = os.path.join(self._job.dirname, name)
+            file_utils.make_leaf_dir(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(name)
+        os.symlink('status.log', os.path.join(self._job.dirname, 'link'))
+
+
+    def _upload(self, gs_path):
+        """Upload the test job to `gs_path`.
+
+        @return The return code of the upload.
+        """
+        with tempfile.TemporaryFile('w+') as stdout_file, \
+             tempfile.TemporaryFile('w+') as stderr_file:
+            return self._uploader.upload(self._job.dirname, gs_path,
+                                         stdout_file, stderr_file)
+
+
+    def test_upload(self):
+        """Test that the files are copied in the gsutil layout."""
+        self.assertEqual(0, self._upload('gs://bucket/hosts/host1'))
+        target = os.path.join(self._bucket_dir, 'bucket', self._job.dirname)
+        for name in self._files:
+            with open(os.path.join(target, name)) as f:
+                self.assertEqual(name, f.read())
+        # Symlinks are skipped, like `gsutil -e`.
+        self.assertFalse(os.path.lexists(os.path.join(target, 'link')))
+
+
+    def test_upload_error(self):
+        """Test that a failed copy fails the upload."""
+        with mock.patch.object(shutil, 'copyfile',
+                               side_effect=IOError('fubar')):
+            self.assertNotEqual(0, self._upload('gs://bucket/hosts/host1'))
+
+
+    def test_abort(self):
+        """Test that aborting skips the rest of the current upload only."""
+        self._uploader = gs_offloader.FakeBucketUploader(self._bucket_dir,
+                                                         workers=1)
+        def abort_during_copy(connection, path, url):
+            # Times out while copying the first file.
+            self._uploader.abort()
+        with mock.patch.object(self._uploader, '_put_file',
+                               side_effect=abort_during_copy) as put_file:
+            self.assertNotEqual(0, self._upload('gs://bucket/hosts/host1'))
+            self.assertEqual(1, put_file.call_count)
+        stale_copy = (self._uploader._generation, None, 'gs://bucket/stale')
+
+        self.assertEqual(0, self._upload('gs://bucket/hosts/host1'))
+        target = os.path.join(self._bucket_dir, 'bucket', self._job.dirname)
+        for name in self._files:
+            self.assertTrue(os.path.isfile(os.path.join(target, name)))
+        # A copy left over from the aborted upload is still skipped.
+        self.assertTrue(self._uploader._copy(stale_copy))
+        self.assertFalse(os.path.exists(
+                self._uploader.get_local_path('gs://bucket/stale')))
+
+
+    def test_mark_finished_batched(self):
+        """Test that the markers are written once per directory on flush."""
+        gs_path = 'gs://bucket/hosts/host1'
+        marker = self._uploader.get_local_path(
+                os.path.join(gs_path, '.finished_offload'))
+        with mock.patch.object(self._uploader, '_put_file',
+                               wraps=self._uploader._put_file) as put_file:
+            self._uploader.mark_finished(gs_path, None, None)
+            self._uploader.mark_finished(gs_path, None, None)
+            self.assertFalse(os.path.exists(marker))
+            self._uploader.flush()
+            self.assertEqual(1, put_file.call_count)
+        self.assertTrue(os.path.isfile(marker))
+
+
 class GsOffloaderMockTests(_TempResultsDirTestCase):
     """Tests using mock instead of mox."""
 
@@ -1511,6 +1735,30 @@ class GsOffloaderMockTests(_TempResultsDirTestCase):
             self.assertTrue(os.path.isdir(self._job.queue_args[0]))
 
 
+    def test_offload_fake_bucket(self):
+        """Test that `offload_dir()` works with the fake bucket uploader."""
+        bucket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bucket_dir)
+        uploader = gs_offloader.FakeBucketUploader(bucket_dir)
+        with open(os.path.join(self._job.queue_args[0], 'status.log'),
+                  'w') as f:
+            f.write('GOOD')
+        with mock.patch.object(gs_offloader, '_upload_cts_testresult',
+                               autospec=True) as upload:
+            upload.return_value = None
+            sub_offloader = gs_offloader.GSOffloader(
+                    'gs://bucket/', False, 0, uploader=uploader)
+            sub_offloader.offload(self._job.queue_args[0],
+                                  self._job.queue_args[1],
+                                  self._job.queue_args[2])
+            sub_offloader.flush()
+        self.assertFalse(os.path.isdir(self._job.queue_args[0]))
+        self.assertTrue(os.path.isfile(os.path.join(
+                bucket_dir, 'bucket', self._job.queue_args[0], 'status.log')))
+        self.assertTrue(os.path.isfile(os.path.join(
+                bucket_dir, 'bucket', '.finished_offload')))
+
+
     # TODO(ayatane): This tests passes when run locally, but it fails
     # when run on trybot.  I have no idea why, but the assert isdir
     # fails.
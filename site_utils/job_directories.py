@@ -21,6 +21,9 @@ except ImportError:
 
 SPECIAL_TASK_PATTERN = '.*/hosts/[^/]+/(\d+)-[^/]+'
 
+# Maximum number of job or task ids to look up in one AFE RPC.
+_AFE_LOOKUP_BATCH_SIZE = 500
+
 def is_job_expired(age_limit, timestamp):
   """Check whether a job timestamp is older than an age limit.
 
@@ -129,6 +132,15 @@ class _JobDirectory(object):
     """Return a list of directories of jobs that need offloading."""
     return [d for d in glob.glob(cls.GLOB_PATTERN) if os.path.isdir(d)]
 
+  @classmethod
+  def get_glob_patterns(cls):
+    """Return the glob patterns matching the job directories of this class.
+
+    The job directories found by `get_job_directories()` are those
+    matching one of the patterns.
+    """
+    return [cls.GLOB_PATTERN]
+
   @abc.abstractmethod
   def get_timestamp_if_finished(self):
     """Return this job's timestamp from the database.
@@ -144,6 +156,22 @@ class _JobDirectory(object):
     """
     raise NotImplementedError("_JobDirectory.get_timestamp_if_finished")
 
+  @classmethod
+  def get_timestamps_if_finished(cls, jobs):
+    """Return the timestamps of many jobs of this class.
+
+    This is the batched form of `get_timestamp_if_finished()`.
+    Subclasses looking up the database override it to look up all
+    the jobs in a few queries.
+
+    @param jobs: A list of instances of this class.
+
+    @return A dictionary mapping each job's `dirname` to the value
+            `get_timestamp_if_finished()` returns for the job.
+    """
+    return dict((job.dirname, job.get_timestamp_if_finished())
+                for job in jobs)
+
   def process_gs_instructions(self):
     """Process any gs_offloader instructions for this special task.
 
@@ -198,6 +226,66 @@ class RegularJobDirectory(_JobDirectory):
     # While most Jobs have 1 HQE, some can have multiple, so check them all.
     return max([hqe.finished_on for hqe in hqes])
 
+  @classmethod
+  def get_timestamps_if_finished(cls, jobs):
+    """Get the timestamps to use for many finished jobs.
+
+    The jobs are looked up with batched `id__in` queries, instead
+    of two RPCs per job.
+
+    @param jobs: A list of RegularJobDirectory instances.
+
+    @returns A dictionary mapping each job's `dirname` to the
+             timestamp `get_timestamp_if_finished()` returns.
+    """
+    timestamps = dict((job.dirname, None) for job in jobs)
+    jobs_by_id = _group_jobs_by_id(jobs)
+    created_on = {}
+    for ids in _batches(sorted(jobs_by_id)):
+      for entry in _cached_afe().get_jobs(id__in=ids, finished=True):
+        created_on[entry.id] = entry.created_on
+    # Query the raw HQEs, as `get_host_queue_entries()` of the AFE
+    # also looks up the hosts of the entries.
+    finished_on = {}
+    for ids in _batches(sorted(created_on)):
+      for hqe in _cached_afe().run('get_host_queue_entries',
+                                   finished_on__isnull=False,
+                                   job__id__in=ids):
+        job_id = hqe['job']['id']
+        finished_on[job_id] = max(finished_on.get(job_id),
+                                  hqe['finished_on'])
+    for job_id, timestamp in created_on.iteritems():
+      for job in jobs_by_id.get(job_id, []):
+        timestamps[job.dirname] = finished_on.get(job_id) or timestamp
+    return timestamps
+
+
+def _group_jobs_by_id(jobs):
+    """Group job directories by their integer job or task id.
+
+    @param jobs: A list of _JobDirectory instances.
+
+    @returns A dictionary mapping each id to a list of the job
+             directories with that id.  Jobs without an id are left
+             out.
+    """
+    jobs_by_id = {}
+    for job in jobs:
+        if job._id and job._id.isdigit():
+            jobs_by_id.setdefault(int(job._id), []).append(job)
+    return jobs_by_id
+
+
+def _batches(ids):
+    """Split a list of ids into batches to look up in one AFE RPC.
+
+    @param ids: A list of ids.
+
+    @yields Lists of at most `_AFE_LOOKUP_BATCH_SIZE` ids.
+    """
+    for i in xrange(0, len(ids), _AFE_LOOKUP_BATCH_SIZE):
+        yield ids[i:i + _AFE_LOOKUP_BATCH_SIZE]
+
 
 def _remove_log_directory_contents(dirpath):
     """Remove log directory contents.
@@ -225,6 +313,24 @@ class SpecialJobDirectory(_JobDirectory):
     entry = _cached_afe().get_special_tasks(id=self._id, is_complete=True)
     return entry[0].time_finished if entry else None
 
+  @classmethod
+  def get_timestamps_if_finished(cls, jobs):
+    """Get the timestamps of many special tasks in batched queries.
+
+    @param jobs: A list of SpecialJobDirectory instances.
+
+    @returns A dictionary mapping each job's `dirname` to the
+             timestamp `get_timestamp_if_finished()` returns.
+    """
+    timestamps = dict((job.dirname, None) for job in jobs)
+    jobs_by_id = _group_jobs_by_id(jobs)
+    for ids in _batches(sorted(jobs_by_id)):
+      for task in _cached_afe().get_special_tasks(id__in=ids,
+                                                  is_complete=True):
+        for job in jobs_by_id.get(task.id, []):
+          timestamps[job.dirname] = task.time_finished
+    return timestamps
+
 
 _OFFLOAD_MARKER = ".ready_for_offload"
 _marker_parse_error_metric = metrics.Counter(
@@ -255,7 +361,10 @@ class SwarmingJobDirectory(_JobDirectory):
       jobdirs += subdirs
     return jobdirs
 
-
+  @classmethod
+  def get_glob_patterns(cls):
+    """Return the glob patterns matching the swarming job directories."""
+    return ['swarming-[0-9a-f]*[1-9a-f]', 'swarming-[0-9a-f]*0/[1-9a-f]*']
 
   def get_timestamp_if_finished(self):
     """Get the timestamp to use for finished jobs.
@@ -244,6 +244,62 @@ class JobDirectorySubclassTests(mox.MoxTestBase):
         self.mox.VerifyAll()
 
 
+class BatchedTimestampTests(unittest.TestCase):
+    """Tests for `get_timestamps_if_finished()` of job directories."""
+
+    def setUp(self):
+        self._afe = _FakeAFE()
+        self._old_afe = job_directories._AFE
+        job_directories._AFE = self._afe
+
+
+    def tearDown(self):
+        job_directories._AFE = self._old_afe
+
+
+    def test_regular_jobs(self):
+        """Test timestamps of regular jobs take a constant number of RPCs.
+
+        One `get_jobs` and one `get_host_queue_entries` RPC are made
+        for a batch of jobs, regardless of the number of jobs.
+
+        """
+        jobs = [job_directories.RegularJobDirectory('%d-fubar' % i)
+                for i in range(1, 201)]
+        timestamps = job_directories.RegularJobDirectory.\
+                get_timestamps_if_finished(jobs)
+        self.assertEqual(2, self._afe.rpc_count)
+        self.assertEqual(len(jobs), len(timestamps))
+        self.assertIsNone(timestamps['1-fubar'])
+        self.assertEqual(_FakeAFE.CREATED_ON, timestamps['2-fubar'])
+        self.assertEqual(_FakeAFE.LAST_FINISHED_ON, timestamps['4-fubar'])
+
+
+    def test_regular_jobs_in_batches(self):
+        """Test jobs are looked up in batches of a limited size."""
+        jobs = [job_directories.RegularJobDirectory('%d-fubar' % i)
+                for i in range(1, 2 * job_directories._AFE_LOOKUP_BATCH_SIZE
+                               + 1)]
+        timestamps = job_directories.RegularJobDirectory.\
+                get_timestamps_if_finished(jobs)
+        # The finished jobs fit in a single batch of HQE lookups.
+        self.assertEqual(3, self._afe.rpc_count)
+        self.assertEqual(len(jobs), len(timestamps))
+
+
+    def test_special_jobs(self):
+        """Test timestamps of special tasks take a single RPC."""
+        jobs = [job_directories.SpecialJobDirectory(
+                        'hosts/host1/%d-reset' % i)
+                for i in range(1, 201)]
+        timestamps = job_directories.SpecialJobDirectory.\
+                get_timestamps_if_finished(jobs)
+        self.assertEqual(1, self._afe.rpc_count)
+        self.assertIsNone(timestamps['hosts/host1/1-reset'])
+        self.assertEqual(_FakeAFE.FINISHED_ON,
+                         timestamps['hosts/host1/2-reset'])
+
+
 class JobExpirationTests(unittest.TestCase):
     """Tests to exercise `job_directories.is_job_expired()`."""
 
@@ -275,8 +331,9 @@ _TEST_EXPIRATION_AGE = 7
 
 class _MockJob(object):
     """Class to mock the return value of `AFE.get_jobs()`."""
-    def __init__(self, created):
+    def __init__(self, created, job_id=None):
         self.created_on = created
+        self.id = job_id
 
 
 class _MockHostQueueEntry(object):
@@ -287,8 +344,53 @@ class _MockHostQueueEntry(object):
 
 class _MockSpecialTask(object):
     """Class to mock the return value of `AFE.get_special_tasks()`."""
-    def __init__(self, finished):
+    def __init__(self, finished, task_id=None):
         self.time_finished = finished
+        self.id = task_id
+
+
+class _FakeAFE(object):
+    """Fake AFE counting the RPCs made by batched timestamp lookups.
+
+    Jobs and special tasks with an even id are finished, and jobs
+    with an id divisible by 4 have two finished HQEs.
+    """
+
+    CREATED_ON = '2017-01-01 00:00:00'
+    FINISHED_ON = '2017-01-01 01:00:00'
+    LAST_FINISHED_ON = '2017-01-01 02:00:00'
+
+    def __init__(self):
+        self.rpc_count = 0
+
+
+    def get_jobs(self, id__in, finished):
+        """Fake `AFE.get_jobs()` with an `id__in` filter."""
+        assert finished
+        self.rpc_count += 1
+        return [_MockJob(self.CREATED_ON, i) for i in id__in if i % 2 == 0]
+
+
+    def run(self, call, finished_on__isnull, job__id__in):
+        """Fake the `get_host_queue_entries` RPC with a job id filter."""
+        assert call == 'get_host_queue_entries' and not finished_on__isnull
+        self.rpc_count += 1
+        hqes = []
+        for i in job__id__in:
+            if i % 4 == 0:
+                hqes.append({'job': {'id': i},
+                             'finished_on': self.LAST_FINISHED_ON})
+                hqes.append({'job': {'id': i},
+                             'finished_on': self.FINISHED_ON})
+        return hqes
+
+
+    def get_special_tasks(self, id__in, is_complete):
+        """Fake `AFE.get_special_tasks()` with an `id__in` filter."""
+        assert is_complete
+        self.rpc_count += 1
+        return [_MockSpecialTask(self.FINISHED_ON, i)
+                for i in id__in if i % 2 == 0]
 
 
 @contextlib.contextmanager
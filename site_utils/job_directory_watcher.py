@@ -0,0 +1,376 @@
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Keep track of the job result directories with inotify.
+
+The watcher keeps the set of job directories found under the current
+directory, and which of them are marked as uploaded, up to date from
+inotify events, instead of globbing the whole results directory on every
+offload cycle.  The watched directories are:
+  * the directories the job directories are created in, e.g. `.`,
+    `hosts` and `hosts/<host>`, for job directories added and removed.
+  * the job directories, for the uploaded marker file.
+
+A full rescan is still done periodically, when events were lost because
+the kernel queue overflowed, and on every update if inotify can't be
+used at all, e.g. when the limit of watches is reached.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import logging
+import os
+import struct
+import time
+
+
+# Flags of inotify_init1(), see inotify(7).
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+# Events and flags of inotify_add_watch(), see inotify(7).
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_MASK_ADD = 0x20000000
+_IN_ISDIR = 0x40000000
+
+_IN_ADDED = _IN_CREATE | _IN_MOVED_TO
+_IN_REMOVED = _IN_DELETE | _IN_MOVED_FROM
+_IN_SELF_REMOVED = _IN_DELETE_SELF | _IN_MOVE_SELF
+
+# Events watched on the directories the job directories are created in.
+_PARENT_MASK = _IN_ADDED | _IN_REMOVED | _IN_SELF_REMOVED | _IN_ONLYDIR
+# Events watched on the job directories.
+_JOB_MASK = _IN_ADDED | _IN_REMOVED | _IN_ONLYDIR
+
+# struct inotify_event, followed by the name of `len` bytes.
+_EVENT_FORMAT = 'iIII'
+_EVENT_SIZE = struct.calcsize(_EVENT_FORMAT)
+_READ_SIZE = 64 * 1024
+
+
+class _Inotify(object):
+    """Minimal wrapper of the Linux inotify API."""
+
+    def __init__(self):
+        """Create the inotify instance.
+
+        @raises OSError if inotify is not available.
+        """
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._check(
+                self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC))
+
+    def _check(self, result):
+        """Raise the errno of a failed libc call.
+
+        @param result: Return value of the call.
+
+        @return The return value, if the call succeeded.
+        @raises OSError if the call failed.
+        """
+        if result < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return result
+
+    def add_watch(self, path, mask):
+        """Watch a path, adding to the events already watched.
+
+        @param path: Path to watch.
+        @param mask: Events to watch.
+
+        @return The watch descriptor.
+        @raises OSError if the path can't be watched.
+        """
+        return self._check(self._libc.inotify_add_watch(
+                self._fd, path, mask | _IN_MASK_ADD))
+
+    def rm_watch(self, wd):
+        """Stop watching, ignoring watches already removed by the kernel.
+
+        @param wd: Watch descriptor.
+        """
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self):
+        """Read the queued events without blocking.
+
+        @return A list of (wd, mask, name) tuples.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from(_EVENT_FORMAT, data,
+                                                         offset)
+                offset += _EVENT_SIZE
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        """Close the inotify instance."""
+        os.close(self._fd)
+
+
+def _split_path(path):
+    """Split a relative path into its components."""
+    return path.split(os.sep)
+
+
+def _join(path, name):
+    """Join a name to a directory path, as glob does from `.`."""
+    return name if path == '.' else os.path.join(path, name)
+
+
+class JobDirectoryWatcher(object):
+    """Job directories under the current directory, kept up to date.
+
+    @var rescan_count: Number of full rescans done, for monitoring.
+    """
+
+    def __init__(self, jobdir_classes, marker_name, rescan_interval_secs):
+        """Initialize the watcher.
+
+        @param jobdir_classes: List of `_JobDirectory` classes of the job
+                               directories to keep track of.
+        @param marker_name: Name of the file marking a job directory as
+                            uploaded.
+        @param rescan_interval_secs: Seconds between full rescans.
+
+        @raises OSError if inotify is not available.
+        """
+        self._jobdir_classes = jobdir_classes
+        self._patterns = [(cls, _split_path(pattern))
+                          for cls in jobdir_classes
+                          for pattern in cls.get_glob_patterns()]
+        self._marker_name = marker_name
+        self._rescan_interval_secs = rescan_interval_secs
+        self._inotify = _Inotify()
+        self._last_rescan = None
+        self._wd_paths = {}
+        self._path_wds = {}
+        self._jobs = {}
+        self._uploaded = set()
+        self.rescan_count = 0
+
+    def close(self):
+        """Stop watching."""
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def update(self):
+        """Apply the events received since the last update.
+
+        Rescan the whole directory instead if it's due, or if the events
+        can't be relied on.
+        """
+        if (self._inotify is None or self._last_rescan is None
+                or time.time() - self._last_rescan
+                   >= self._rescan_interval_secs):
+            self._rescan()
+            return
+        for wd, mask, name in self._inotify.read_events():
+            if mask & _IN_Q_OVERFLOW:
+                logging.warning('inotify queue overflowed; rescanning.')
+                self._rescan()
+                return
+            self._handle_event(wd, mask, name)
+
+    def get_job_directories(self):
+        """Return the job directories present.
+
+        @return A dictionary mapping each job directory to its
+                `_JobDirectory` class.
+        """
+        return self._jobs
+
+    def is_offloaded(self, dirname):
+        """Return whether a job directory is removed or marked uploaded.
+
+        @param dirname: Job directory.
+        """
+        return dirname not in self._jobs or dirname in self._uploaded
+
+    def _classify(self, path):
+        """Find what a directory is to the watcher.
+
+        @param path: Directory path, relative to the current directory.
+
+        @return A tuple of (is_parent, job class).  `is_parent` is True if
+                job directories may be created below the directory.  The
+                job class is None if the directory is not a job
+                directory.
+        """
+        if path == '.':
+            return True, None
+        parts = _split_path(path)
+        # Like glob, wildcards don't match hidden names.
+        if any(part.startswith('.') for part in parts):
+            return False, None
+        is_parent = False
+        job_class = None
+        for cls, pattern in self._patterns:
+            if len(parts) > len(pattern):
+                continue
+            if all(fnmatch.fnmatchcase(part, pattern_part)
+                   for part, pattern_part in zip(parts, pattern)):
+                if len(parts) == len(pattern):
+                    job_class = job_class or cls
+                else:
+                    is_parent = True
+        return is_parent, job_class
+
+    def _watch(self, path, mask):
+        """Watch a directory.
+
+        If the directory can't be watched, e.g. when the limit of
+        watches is reached, stop using inotify and rescan on every
+        update.
+
+        @param path: Directory path.
+        @param mask: Events to watch.
+
+        @return True if the directory is watched.
+        """
+        if self._inotify is None:
+            return False
+        try:
+            wd = self._inotify.add_watch(path, mask)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                # Removed already.
+                return False
+            logging.warning('Failed to watch %s, falling back to rescanning '
+                            'results on every cycle: %s', path, e)
+            self.close()
+            return False
+        self._wd_paths[wd] = path
+        self._path_wds[path] = wd
+        return True
+
+    def _add_directory(self, path):
+        """Keep track of a directory added, and of the directories in it.
+
+        @param path: Directory path.
+        """
+        is_parent, job_class = self._classify(path)
+        if is_parent and self._watch(path, _PARENT_MASK):
+            # Directories created before the watch was added didn't send
+            # any event.
+            try:
+                names = os.listdir(path)
+            except OSError:
+                names = []
+            for name in names:
+                child = _join(path, name)
+                if os.path.isdir(child):
+                    self._add_directory(child)
+        if job_class:
+            self._jobs[path] = job_class
+            self._watch(path, _JOB_MASK)
+            if os.path.exists(os.path.join(path, self._marker_name)):
+                self._uploaded.add(path)
+
+    def _remove_directory(self, path):
+        """Forget a directory removed, and everything below it.
+
+        @param path: Directory path.
+        """
+        prefix = path + os.sep
+        for paths in (self._jobs.keys(), list(self._uploaded)):
+            for p in paths:
+                if p == path or p.startswith(prefix):
+                    self._jobs.pop(p, None)
+                    self._uploaded.discard(p)
+        for p in self._path_wds.keys():
+            if p == path or p.startswith(prefix):
+                wd = self._path_wds.pop(p)
+                del self._wd_paths[wd]
+                # The kernel already removed the watch of a deleted
+                # directory, but not of a directory moved away.
+                if self._inotify:
+                    self._inotify.rm_watch(wd)
+
+    def _handle_event(self, wd, mask, name):
+        """Apply an inotify event.
+
+        @param wd: Watch descriptor of the directory.
+        @param mask: Event mask.
+        @param name: Name of the file the event is about, in the
+                     directory.
+        """
+        path = self._wd_paths.get(wd)
+        if path is None:
+            return
+        if mask & _IN_IGNORED:
+            del self._wd_paths[wd]
+            if self._path_wds.get(path) == wd:
+                del self._path_wds[path]
+            return
+        if mask & _IN_SELF_REMOVED:
+            if path == '.':
+                logging.warning('Results directory was removed; rescanning.')
+                self._last_rescan = None
+            return
+        if not name:
+            return
+        child = _join(path, name)
+        if mask & _IN_ISDIR:
+            if mask & _IN_ADDED:
+                self._add_directory(child)
+            elif mask & _IN_REMOVED:
+                self._remove_directory(child)
+        elif name == self._marker_name and path in self._jobs:
+            if mask & _IN_ADDED:
+                self._uploaded.add(path)
+            elif mask & _IN_REMOVED:
+                self._uploaded.discard(path)
+
+    def _rescan(self):
+        """Rebuild the job directories from a full scan."""
+        self.rescan_count += 1
+        self._last_rescan = time.time()
+        self._jobs = {}
+        self._uploaded = set()
+        if self._inotify:
+            # Directories may have been moved away without an event, e.g.
+            # when the queue overflowed, so start again from no watches.
+            for wd in self._wd_paths:
+                self._inotify.rm_watch(wd)
+        self._wd_paths = {}
+        self._path_wds = {}
+        if self._inotify:
+            # The watches are added before the directories are listed,
+            # so nothing created in between is missed.  Adding a watch
+            # again is harmless.
+            self._add_directory('.')
+            if self._inotify:
+                return
+        # Without inotify, fall back to what the job classes find.
+        for cls in self._jobdir_classes:
+            for dirname in cls.get_job_directories():
+                self._jobs.setdefault(dirname, cls)
+                if os.path.exists(os.path.join(dirname, self._marker_name)):
+                    self._uploaded.add(dirname)
@@ -0,0 +1,142 @@
+#!/usr/bin/python2
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Tests for job_directory_watcher."""
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import common
+from autotest_lib.site_utils import job_directories
+from autotest_lib.site_utils import job_directory_watcher
+
+
+_MARKER = '.GS_UPLOADED'
+
+_CLASSES = [job_directories.SwarmingJobDirectory,
+            job_directories.RegularJobDirectory,
+            job_directories.SpecialJobDirectory]
+
+
+class JobDirectoryWatcherTests(unittest.TestCase):
+    """Tests for `JobDirectoryWatcher`."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._resultsroot = tempfile.mkdtemp()
+        os.chdir(self._resultsroot)
+        for d in ['118-debug', 'hosts/host1/333-reset',
+                  'swarming-3e4391423c3a4311', 'swarming-3e4391423c3a4310/1',
+                  'not-a-job', 'hosts/host1/not-a-task']:
+            os.makedirs(d)
+        self._watcher = job_directory_watcher.JobDirectoryWatcher(
+                _CLASSES, _MARKER, 3600)
+        self.addCleanup(self._watcher.close)
+
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._resultsroot)
+
+
+    def _get_globbed_jobs(self):
+        """Return the job directories found by the job classes."""
+        jobs = {}
+        for cls in _CLASSES:
+            for d in cls.get_job_directories():
+                jobs[d] = cls
+        return jobs
+
+
+    def _check_jobs(self):
+        """Check the watcher's jobs are those found by globbing."""
+        self._watcher.update()
+        self.assertEqual(self._get_globbed_jobs(),
+                         self._watcher.get_job_directories())
+
+
+    def test_rescan(self):
+        """Test that the first update finds the existing jobs."""
+        self._check_jobs()
+        self.assertEqual(1, self._watcher.rescan_count)
+
+
+    def test_events(self):
+        """Test that jobs added and removed later are found from events."""
+        self._check_jobs()
+        for d in ['119-debug', 'hosts/host2/334-reset',
+                  'swarming-4e4391423c3a4310/2', 'hosts/host1/not-a-task2']:
+            os.makedirs(d)
+        self._check_jobs()
+        self.assertTrue(self._watcher.get_job_directories().has_key(
+                'hosts/host2/334-reset'))
+
+        shutil.rmtree('hosts/host1')
+        os.rename('118-debug', '.118-debug')
+        self._check_jobs()
+        self.assertTrue(self._watcher.is_offloaded('118-debug'))
+        self.assertEqual(1, self._watcher.rescan_count)
+
+
+    def test_uploaded_marker(self):
+        """Test that the uploaded marker is tracked."""
+        self._watcher.update()
+        self.assertFalse(self._watcher.is_offloaded('118-debug'))
+        with open(os.path.join('118-debug', _MARKER), 'a'):
+            pass
+        self._watcher.update()
+        self.assertTrue(self._watcher.is_offloaded('118-debug'))
+        self.assertFalse(self._watcher.is_offloaded('hosts/host1/333-reset'))
+
+        with open(os.path.join('hosts/host1/333-reset', _MARKER), 'a'):
+            pass
+        self._watcher.update()
+        self.assertTrue(self._watcher.is_offloaded('hosts/host1/333-reset'))
+        self.assertEqual(1, self._watcher.rescan_count)
+
+
+    def test_overflow(self):
+        """Test that a queue overflow causes a rescan."""
+        self._watcher.update()
+        with mock.patch.object(
+                self._watcher._inotify, 'read_events',
+                return_value=[(-1, job_directory_watcher._IN_Q_OVERFLOW, '')]):
+            self._watcher.update()
+        self.assertEqual(2, self._watcher.rescan_count)
+
+
+    def test_overflow_forgets_moved_directories(self):
+        """Test that a rescan drops the watches of moved directories."""
+        self._watcher.update()
+        os.rename('hosts/host1', 'hosts/host2')
+        with mock.patch.object(
+                self._watcher._inotify, 'read_events',
+                return_value=[(-1, job_directory_watcher._IN_Q_OVERFLOW, '')]):
+            self._watcher.update()
+        self.assertNotIn('hosts/host1', self._watcher._path_wds)
+        self.assertEqual(
+                self._watcher._path_wds,
+                dict((path, wd)
+                     for wd, path in self._watcher._wd_paths.iteritems()))
+        self._check_jobs()
+
+
+    def test_watch_limit(self):
+        """Test falling back to rescans when a directory can't be watched."""
+        with mock.patch.object(self._watcher._inotify, 'add_watch',
+                               side_effect=OSError(errno.ENOSPC, 'full')):
+            self._check_jobs()
+        os.makedirs('119-debug')
+        self._check_jobs()
+        self.assertEqual(2, self._watcher.rescan_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
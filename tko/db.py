@@ -16,6 +16,7 @@ except ImportError:
 
     driver = UtterlyFakeDb
 
+import collections
 import math
 import os
 import random
@@ -58,19 +59,93 @@ class MySQLTooManyRows(Exception):
     pass
 
 
+def _same_value(stored, wanted):
+    """Compare a value read back from the database with one to be written.
+
+    Floats are compared with a tolerance, as FLOAT columns do not round-trip
+    double precision values.
+
+    @param stored: The value from the database.
+    @param wanted: The value to be written.
+    """
+    if isinstance(stored, float) and isinstance(wanted, (float, int, long)):
+        return abs(stored - wanted) <= 1e-6 * max(abs(stored), abs(wanted))
+    return stored == wanted
+
+
 def _connection_retry_callback():
     """Callback method used to increment a retry metric."""
     metrics.Counter('chromeos/autotest/tko/connection_retries').increment()
 
 
+class _LookupCache(object):
+    """Bounded LRU map of lookup keys to row ids, with hit/miss counters."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+
+    def get(self, key):
+        """Return the cached id for key, or None.
+
+        @param key: The lookup key.
+        """
+        value = self._entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = value
+        return value
+
+
+    def put(self, key, value):
+        """Cache value for key, evicting the least recently used entry.
+
+        @param key: The lookup key.
+        @param value: The row id; None is not cached.
+        """
+        if value is None or self.max_size <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+    def clear(self):
+        """Drop all entries, keeping the counters."""
+        self._entries.clear()
+
+
 class db_sql(object):
     """Data access."""
 
+    # Upper bound on the number of rows packed into a single multi-row
+    # INSERT statement, to stay well below max_allowed_packet.
+    _MAX_ROWS_PER_INSERT = 1000
+
     def __init__(self, debug=False, autocommit=True, host=None,
-                 database=None, user=None, password=None):
+                 database=None, user=None, password=None, bulk_insert=None,
+                 lookup_cache_size=None, diff_reparse=None):
         self.debug = debug
         self.autocommit = autocommit
         self._load_config(host, database, user, password)
+        if bulk_insert is not None:
+            self.bulk_insert = bulk_insert
+        if lookup_cache_size is not None:
+            self.lookup_cache_size = lookup_cache_size
+        if diff_reparse is not None:
+            self.diff_reparse = diff_reparse
+
+        # Row ids looked up or inserted through this connection. They are
+        # dropped whenever uncommitted work may have been lost.
+        self._kernel_cache = _LookupCache(self.lookup_cache_size)
+        self._machine_cache = _LookupCache(self.lookup_cache_size)
+        self._task_reference_cache = _LookupCache(self.lookup_cache_size)
 
         self.con = None
         self._init_db()
@@ -151,12 +226,30 @@ class db_sql(object):
         self.port = global_config.global_config.get_config_value(
                 "AUTOTEST_WEB", "global_db_port", type=str, default='')
 
+        # Whether insert_tests writes a job's tests with multi-row INSERTs
+        # instead of one statement per row.
+        self.bulk_insert = global_config.global_config.get_config_value(
+                "AUTOTEST_WEB", "tko_bulk_insert", type=bool, default=False)
+
+        # Whether insert_tests only rewrites the rows of reparsed tests that
+        # changed.
+        self.diff_reparse = global_config.global_config.get_config_value(
+                "AUTOTEST_WEB", "tko_diff_reparse", type=bool, default=False)
+
+        # Maximum number of entries of each kernel/machine/task reference
+        # lookup cache; 0 disables caching.
+        self.lookup_cache_size = global_config.global_config.get_config_value(
+                "AUTOTEST_WEB", "tko_lookup_cache_size", type=int,
+                default=1000)
+
 
     def _init_db(self):
         # make sure we clean up any existing connection
         if self.con:
             self.con.close()
             self.con = None
+        # anything uncommitted is gone with the old connection
+        self.clear_lookup_caches()
 
         # create the db connection and cursor
         self.con = self.connect(self.host, self.database,
@@ -251,9 +344,31 @@ class db_sql(object):
 
     def rollback(self):
         """Rollback the sql transaction."""
+        self.clear_lookup_caches()
         self.con.rollback()
 
 
+    def clear_lookup_caches(self):
+        """Drop the cached kernel, machine and task reference ids."""
+        self._kernel_cache.clear()
+        self._machine_cache.clear()
+        self._task_reference_cache.clear()
+
+
+    def lookup_cache_stats(self):
+        """Get the hit and miss counters of the lookup caches.
+
+        @return: A dict mapping cache name to a (hits, misses) tuple.
+        """
+        return {
+                'kernel': (self._kernel_cache.hits, self._kernel_cache.misses),
+                'machine': (self._machine_cache.hits,
+                            self._machine_cache.misses),
+                'task_reference': (self._task_reference_cache.hits,
+                                   self._task_reference_cache.misses),
+        }
+
+
     def get_last_autonumber_value(self):
         """Gets the last auto number.
 
@@ -412,6 +527,79 @@ class db_sql(object):
         self._exec_sql_with_commit(cmd, values, commit)
 
 
+    def insert_many(self, table, fields, rows, commit=None):
+        """\
+                'insert into table (fields) values (%s ... %s), ...', values
+
+                Rows are written in chunks of at most _MAX_ROWS_PER_INSERT
+                rows per statement.
+
+        @param table: The name of the table.
+        @param fields: The list of field names.
+        @param rows: A list of value sequences, ordered like fields.
+        @param commit: If commit the transaction .
+        """
+        if not rows:
+            return
+        row_refs = '(%s)' % ','.join(['%s'] * len(fields))
+        quoted_fields = ','.join(self._quote(field) for field in fields)
+        for start in xrange(0, len(rows), self._MAX_ROWS_PER_INSERT):
+            chunk = rows[start:start + self._MAX_ROWS_PER_INSERT]
+            cmd = ('insert into %s (%s) values %s' %
+                   (table, quoted_fields, ','.join([row_refs] * len(chunk))))
+            values = [value for row in chunk for value in row]
+            self.dprint('%s %s' % (cmd, values))
+            self._exec_sql_with_commit(cmd, values, commit)
+
+
+    def delete_many(self, table, fields, keys, where=None, commit=None):
+        """\
+                'delete from table where (fields) in ((%s ... %s), ...)', keys
+
+        @param table: The name of the table.
+        @param fields: The list of field names identifying a row.
+        @param keys: A list of value sequences, ordered like fields.
+        @param where: Optional dict of additional field=value conditions.
+        @param commit: If commit the transaction .
+        """
+        if commit is None:
+            commit = self.autocommit
+        extra_where, extra_values = self._where_clause(where)
+        key_refs = '(%s)' % ','.join(['%s'] * len(fields))
+        quoted_fields = ','.join(self._quote(field) for field in fields)
+        for start in xrange(0, len(keys), self._MAX_ROWS_PER_INSERT):
+            chunk = keys[start:start + self._MAX_ROWS_PER_INSERT]
+            sql = ('delete from %s WHERE (%s) in (%s)' %
+                   (table, quoted_fields, ','.join([key_refs] * len(chunk))))
+            values = [value for key in chunk for value in key]
+            if extra_where:
+                sql += ' and ' + extra_where[len(' WHERE '):]
+                values += extra_values
+            self.dprint('%s %s' % (sql, values))
+            self._exec_sql_with_commit(sql, values, commit)
+
+
+    def delete_tests(self, test_idxs, commit=None):
+        """Delete tests and all the rows that refer to them.
+
+        Tests are deleted in chunks of at most _MAX_ROWS_PER_INSERT tests.
+
+        @param test_idxs: A list of test_idx values.
+        @param commit: If commit the transaction .
+        """
+        test_idxs = list(test_idxs)
+        for start in xrange(0, len(test_idxs), self._MAX_ROWS_PER_INSERT):
+            chunk = test_idxs[start:start + self._MAX_ROWS_PER_INSERT]
+            where = self._in_clause('test_idx', chunk)
+            self.delete('tko_iteration_result', where, commit)
+            self.delete('tko_iteration_perf_value', where, commit)
+            self.delete('tko_iteration_attributes', where, commit)
+            self.delete('tko_test_attributes', where, commit)
+            self.delete('tko_test_labels_tests',
+                        self._in_clause('test_id', chunk), commit)
+            self.delete('tko_tests', where, commit)
+
+
     def delete(self, table, where, commit = None):
         """Delete entries.
 
@@ -466,16 +654,8 @@ class db_sql(object):
         @param commit: If commit the transaction .
         """
         job_idx = self.find_job(tag)
-        for test_idx in self.find_tests(job_idx):
-            where = {'test_idx' : test_idx}
-            self.delete('tko_iteration_result', where)
-            self.delete('tko_iteration_perf_value', where)
-            self.delete('tko_iteration_attributes', where)
-            self.delete('tko_test_attributes', where)
-            self.delete('tko_test_labels_tests', {'test_id': test_idx})
-        where = {'job_idx' : job_idx}
-        self.delete('tko_tests', where)
-        self.delete('tko_jobs', where)
+        self.delete_tests(self.find_tests(job_idx))
+        self.delete('tko_jobs', {'job_idx' : job_idx})
 
 
     def insert_job(self, tag, job, commit=None):
@@ -548,6 +728,7 @@ class db_sql(object):
         else:
             self.insert('tko_task_references', data, commit=commit)
             job.task_reference_id = self.get_last_autonumber_value()
+            self._task_reference_cache.put(job.job_idx, job.task_reference_id)
 
 
     def update_job_keyvals(self, job, commit=None):
@@ -630,6 +811,214 @@ class db_sql(object):
                 self.insert('tko_test_labels_tests', data, commit=commit)
 
 
+    def insert_tests(self, job, tests, commit=None):
+        """Inserts or updates all the given tests of a job.
+
+        Unless bulk_insert or diff_reparse is set, this is just insert_test
+        for every test. Otherwise the tests, iterations, attributes and
+        labels are written with a handful of multi-row statements,
+        independent of the number of tests and keyvals.  With autocommit
+        disabled, they all end up in the caller's transaction.
+
+        With diff_reparse, the rows of tests that are already in the
+        database are compared with the new ones, and only rows that changed
+        are deleted and re-inserted.
+
+        @param job: The job object.
+        @param tests: A list of test objects.
+        @param commit: If commit the transaction .
+        """
+        if not (self.bulk_insert or self.diff_reparse):
+            for test in tests:
+                self.insert_test(job, test, commit=commit)
+            return
+        if commit is None:
+            commit = self.autocommit
+
+        new_tests = []
+        updated_tests = []
+        for test in tests:
+            kver = self.insert_kernel(test.kernel, commit=False)
+            data = {'job_idx':job.job_idx, 'test':test.testname,
+                    'subdir':test.subdir, 'kernel_idx':kver,
+                    'status':self.status_idx[test.status],
+                    'reason':test.reason, 'machine_idx':job.machine_idx,
+                    'started_time': test.started_time,
+                    'finished_time':test.finished_time}
+            if hasattr(test, 'test_idx'):
+                updated_tests.append((test, data))
+            else:
+                new_tests.append((test, data))
+
+        updated_idxs = [test.test_idx for test, _ in updated_tests]
+        if self.diff_reparse:
+            updated_tests = self._find_changed_tests(updated_tests)
+        for test, data in updated_tests:
+            self.update('tko_tests', data, {'test_idx': test.test_idx},
+                        commit=False)
+        if updated_idxs:
+            where = self._in_clause('test_idx', updated_idxs)
+            self.delete('tko_iteration_perf_value', where, commit=False)
+            if not self.diff_reparse:
+                self.delete('tko_iteration_result', where, commit=False)
+                self.delete('tko_iteration_attributes', where, commit=False)
+                self.delete('tko_test_attributes',
+                            (where[0] + ' and user_created = 0', where[1]),
+                            commit=False)
+
+        if new_tests:
+            # The new rows get test_idx values above those of all the rows
+            # already stored, including stale duplicates of the job's tests.
+            max_idx = self.select('max(test_idx)', 'tko_tests',
+                                  {'job_idx': job.job_idx})[0][0] or 0
+            fields = new_tests[0][1].keys()
+            self.insert_many('tko_tests', fields,
+                             [[data[f] for f in fields]
+                              for _, data in new_tests],
+                             commit=False)
+            self._assign_new_test_idxs(job, [t for t, _ in new_tests],
+                                       max_idx)
+
+        iteration_attributes = []
+        iteration_results = []
+        test_attributes = []
+        labels = []
+        for test in tests:
+            for i in test.iterations:
+                for key, value in i.attr_keyval.iteritems():
+                    iteration_attributes.append(
+                            (test.test_idx, i.index, key, value))
+                for key, value in i.perf_keyval.iteritems():
+                    if math.isnan(value) or math.isinf(value):
+                        value = None
+                    iteration_results.append(
+                            (test.test_idx, i.index, key, value))
+            for key, value in test.attributes.iteritems():
+                test_attributes.append((test.test_idx, key, value))
+        for test, _ in new_tests:
+            for label_index in test.labels:
+                labels.append((test.test_idx, label_index))
+
+        iteration_keys = ['test_idx', 'iteration', 'attribute']
+        if self.diff_reparse and updated_idxs:
+            iteration_attributes = self._diff_rows(
+                    'tko_iteration_attributes', iteration_keys,
+                    iteration_attributes, updated_idxs)
+            iteration_results = self._diff_rows(
+                    'tko_iteration_result', iteration_keys,
+                    iteration_results, updated_idxs)
+            test_attributes = self._diff_rows(
+                    'tko_test_attributes', ['test_idx', 'attribute'],
+                    test_attributes, updated_idxs, {'user_created': 0})
+
+        iteration_fields = iteration_keys + ['value']
+        self.insert_many('tko_iteration_attributes', iteration_fields,
+                         iteration_attributes, commit=False)
+        self.insert_many('tko_iteration_result', iteration_fields,
+                         iteration_results, commit=False)
+        try:
+            self.insert_many('tko_test_attributes',
+                             ['test_idx', 'attribute', 'value'],
+                             test_attributes, commit=False)
+        except:
+            _log_error('Uploading %d attributes for job %s'
+                       % (len(test_attributes), job.job_idx))
+            raise
+        self.insert_many('tko_test_labels_tests', ['test_id', 'testlabel_id'],
+                         labels, commit=False)
+        if commit:
+            self.commit()
+
+
+    def _in_clause(self, field, values):
+        """Build a where tuple matching field against a list of values.
+
+        @param field: The field name.
+        @param values: A non-empty list of values.
+        """
+        return ('%s in (%s)' % (self._quote(field),
+                                ','.join(['%s'] * len(values))),
+                list(values))
+
+
+    def _find_changed_tests(self, tests):
+        """Filter out tests whose tko_tests row is already up to date.
+
+        @param tests: A list of (test, tko_tests data) tuples of tests that
+                      have a test_idx.
+        @return: The sublist of tests whose row differs from data.
+        """
+        if not tests:
+            return []
+        fields = sorted(tests[0][1].keys())
+        rows = self.select(
+                ','.join(['test_idx'] + [self._quote(f) for f in fields]),
+                'tko_tests',
+                self._in_clause('test_idx', [t.test_idx for t, _ in tests]))
+        existing = dict((row[0], row[1:]) for row in rows)
+        return [(test, data) for test, data in tests
+                if existing.get(test.test_idx) !=
+                tuple(data[f] for f in fields)]
+
+
+    def _diff_rows(self, table, key_fields, rows, test_idxs, where=None):
+        """Reconcile the stored rows of some tests with the wanted ones.
+
+        Stored rows of the given tests that are missing from rows, or hold
+        another value, are deleted. The rows that still need inserting are
+        returned.
+
+        @param table: The name of the table.
+        @param key_fields: The fields identifying a row, starting with
+                           test_idx; the remaining field is 'value'.
+        @param rows: Wanted rows, as key_fields values followed by the value.
+        @param test_idxs: The test_idx list of the tests already in table.
+        @param where: Optional dict restricting the stored rows considered.
+        @return: The subset of rows to insert.
+        """
+        in_where = self._in_clause('test_idx', test_idxs)
+        extra_where, extra_values = self._where_clause(where)
+        if extra_where:
+            in_where = ('%s and %s' % (in_where[0],
+                                       extra_where[len(' WHERE '):]),
+                        in_where[1] + extra_values)
+        fields = [self._quote(f) for f in key_fields + ['value']]
+        stored = dict((tuple(row[:-1]), row[-1]) for row in
+                      self.select(','.join(fields), table, in_where))
+
+        known_idxs = set(test_idxs)
+        wanted = dict((tuple(row[:-1]), row[-1]) for row in rows
+                      if row[0] in known_idxs)
+        stale = [key for key, value in stored.iteritems()
+                 if key not in wanted or not _same_value(value, wanted[key])]
+        self.delete_many(table, key_fields, stale, where, commit=False)
+        return [row for row in rows
+                if row[0] not in known_idxs
+                or tuple(row[:-1]) not in stored
+                or not _same_value(stored[tuple(row[:-1])], row[-1])]
+
+
+    def _assign_new_test_idxs(self, job, new_tests, max_idx):
+        """Sets test_idx on freshly bulk-inserted tests.
+
+        LAST_INSERT_ID() is not guaranteed to describe a consecutive range
+        for multi-row inserts, so the new rows are read back and matched on
+        (test, subdir), in insertion order for duplicate keys.
+
+        @param job: The job object.
+        @param new_tests: The test objects just inserted, in insertion order.
+        @param max_idx: The highest test_idx of the job before the insert.
+        """
+        rows = self.select('test_idx,test,subdir', 'tko_tests',
+                           ('job_idx = %s and test_idx > %s',
+                            [job.job_idx, max_idx]))
+        idxs_by_key = {}
+        for test_idx, testname, subdir in sorted(rows):
+            idxs_by_key.setdefault((testname, subdir), []).append(test_idx)
+        for test in new_tests:
+            test.test_idx = idxs_by_key[(test.testname, test.subdir)].pop(0)
+
+
     def read_machine_map(self):
         """Reads the machine map."""
         if self.machine_group or not self.machine_map:
@@ -683,6 +1072,9 @@ class db_sql(object):
         """
         if job.job_idx is None:
             return None
+        task_reference_id = self._task_reference_cache.get(job.job_idx)
+        if task_reference_id is not None:
+            return task_reference_id
         rows = self.select(
                 'id', 'tko_task_references', {'tko_job_idx': job.job_idx})
         if not rows:
@@ -690,6 +1082,7 @@ class db_sql(object):
         if len(rows) > 1:
             raise MySQLTooManyRows('Got %d tko_task_references for tko_job %d'
                                    % (len(rows), job.job_idx))
+        self._task_reference_cache.put(job.job_idx, rows[0][0])
         return rows[0][0]
 
 
@@ -701,7 +1094,9 @@ class db_sql(object):
         """
         machine_info = self.machine_info_dict(job)
         self.insert('tko_machines', machine_info, commit=commit)
-        return self.get_last_autonumber_value()
+        machine_idx = self.get_last_autonumber_value()
+        self._machine_cache.put(machine_info['hostname'], machine_idx)
+        return machine_idx
 
 
     def _update_machine_information(self, job, commit = None):
@@ -721,9 +1116,13 @@ class db_sql(object):
 
         @param hostname: The hostname as string.
         """
+        machine_idx = self._machine_cache.get(hostname)
+        if machine_idx is not None:
+            return machine_idx
         where = { 'hostname' : hostname }
         rows = self.select('machine_idx', 'tko_machines', where)
         if rows:
+            self._machine_cache.put(hostname, rows[0][0])
             return rows[0][0]
         else:
             return None
@@ -734,9 +1133,13 @@ class db_sql(object):
 
         @param kernel: The kernel object.
         """
+        kernel_idx = self._kernel_cache.get(kernel.kernel_hash)
+        if kernel_idx is not None:
+            return kernel_idx
         rows = self.select('kernel_idx', 'tko_kernels',
                                 {'kernel_hash':kernel.kernel_hash})
         if rows:
+            self._kernel_cache.put(kernel.kernel_hash, rows[0][0])
             return rows[0][0]
         else:
             return None
@@ -777,6 +1180,7 @@ class db_sql(object):
 
         for patch in kernel.patches:
             self.insert_patch(kver, patch, commit=commit)
+        self._kernel_cache.put(kernel.kernel_hash, kver)
         return kver
 
 
@@ -1,8 +1,10 @@
 #!/usr/bin/python2
 
+import re
 import sys
 import unittest
 
+import mock
 from cStringIO import StringIO
 
 import common
@@ -36,5 +38,306 @@ class FormatOperationalErrorTestCase(unittest.TestCase):
         self.assertIn('An operational error occurred', got)
 
 
+class _FakeCursor(object):
+    """Records statements and emulates the few tko queries insert_* needs."""
+
+    def __init__(self):
+        self.statements = []
+        self.stored_rows = {}
+        self._result = []
+        self._tests = []
+
+
+    def execute(self, sql, values):
+        """Record sql and prepare the result of the next fetchall."""
+        self.statements.append((sql, values))
+        self._result = []
+        for prefix, rows in self.stored_rows.iteritems():
+            if sql.startswith(prefix):
+                self._result = rows
+                return
+        if sql.startswith('insert into tko_tests'):
+            fields = re.findall('`(\\w+)`', sql)
+            for start in xrange(0, len(values), len(fields)):
+                row = dict(zip(fields, values[start:start + len(fields)]))
+                self._tests.append((len(self._tests) + 1, row['test'],
+                                    row['subdir']))
+        elif sql.startswith('select status_idx, word from tko_status'):
+            self._result = [(1, 'GOOD'), (2, 'FAIL')]
+        elif sql.startswith('select kernel_idx from tko_kernels'):
+            self._result = [(1,)]
+        elif sql.startswith('select machine_idx from tko_machines'):
+            self._result = [(1,)]
+        elif sql.startswith('select max(test_idx) from tko_tests'):
+            self._result = [(len(self._tests) or None,)]
+        elif sql.startswith('select test_idx,test,subdir from tko_tests'):
+            self._result = [t for t in self._tests if t[0] > values[-1]]
+        elif sql == 'SELECT LAST_INSERT_ID()':
+            self._result = [(len(self._tests),)]
+
+
+    def fetchall(self):
+        """Return the result of the last statement."""
+        return self._result
+
+
+class _Record(object):
+    """Stand-in for the tko.models objects, which need server imports."""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class _FakeCursorTestCase(unittest.TestCase):
+    """Base class for tests of db_sql on top of a _FakeCursor."""
+
+    def setUp(self):
+        self.cursor = _FakeCursor()
+
+        def init_db(db_self):
+            db_self.con = mock.Mock()
+            db_self.cur = self.cursor
+
+        patchers = [
+                mock.patch.object(db.db_sql, '_load_config'),
+                mock.patch.object(db.db_sql, '_init_db', init_db),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+    def _make_db(self, bulk_insert, lookup_cache_size=0, diff_reparse=False):
+        return db.db_sql(autocommit=False, bulk_insert=bulk_insert,
+                         lookup_cache_size=lookup_cache_size,
+                         diff_reparse=diff_reparse)
+
+
+    def _make_job(self, num_tests, keyvals_per_test):
+        kernel = _Record(base='3.18', patches=[], kernel_hash='abc')
+        job = _Record(job_idx=1, machine_idx=1, tests=[])
+        for t in xrange(num_tests):
+            perf = dict(('perf_%d' % k, float(k))
+                        for k in xrange(keyvals_per_test))
+            perf['perf_nan'] = float('nan')
+            iteration = _Record(index=1, attr_keyval={'attr': 'x'},
+                                perf_keyval=perf)
+            job.tests.append(_Record(
+                    subdir='subdir_%d' % t, testname='test_%d' % t,
+                    status='GOOD', reason='', kernel=kernel,
+                    started_time=None, finished_time=None,
+                    iterations=[iteration], attributes={'version': '1'},
+                    labels=[1, 2]))
+        return job
+
+
+    def _statements(self, prefix):
+        return [s for s, _ in self.cursor.statements if s.startswith(prefix)]
+
+
+    def _inserts(self):
+        return self._statements('insert')
+
+
+class InsertTestsTestCase(_FakeCursorTestCase):
+    """Tests for db_sql.insert_tests()."""
+
+
+    def test_bulk_insert_assigns_test_idx(self):
+        """New tests get the test_idx of their own row."""
+        job = self._make_job(3, 2)
+        self._make_db(True).insert_tests(job, job.tests)
+        self.assertEqual([t.test_idx for t in job.tests], [1, 2, 3])
+
+
+    def test_bulk_insert_statement_count(self):
+        """A synthetic 5k-keyval job: per-row vs multi-row statements."""
+        job = self._make_job(5, 1000)
+        self._make_db(False).insert_tests(job, job.tests)
+        per_row = len(self.cursor.statements)
+        self.assertGreater(len(self._inserts()), 5000)
+
+        self.cursor.statements = []
+        job = self._make_job(5, 1000)
+        self._make_db(True).insert_tests(job, job.tests)
+        bulk = len(self.cursor.statements)
+        # tko_tests, iteration attributes/results (1000 rows per statement),
+        # test attributes and labels.
+        self.assertEqual(len(self._inserts()), 1 + 1 + 6 + 1 + 1)
+        self.assertLess(bulk * 100, per_row)
+
+
+    def test_bulk_update_deletes_with_one_statement_per_table(self):
+        """Reparsed tests have their rows replaced with IN (...) deletes."""
+        job = self._make_job(3, 2)
+        for i, test in enumerate(job.tests):
+            test.test_idx = i + 1
+        self._make_db(True).insert_tests(job, job.tests)
+        deletes = self._statements('delete')
+        self.assertEqual(len(deletes), 4)
+        self.assertFalse(any('tko_test_labels_tests' in s
+                             for s in self._inserts()))
+
+
+    def test_bulk_reparse_with_duplicate_tests(self):
+        """New tests don't take the test_idx of stale duplicate rows."""
+        # Two stored reboot rows without subdir, only the first one matched.
+        self.cursor._tests = [(1, 'reboot', None), (2, 'reboot', None)]
+        job = self._make_job(2, 1)
+        for test in job.tests:
+            test.testname, test.subdir = 'reboot', None
+        job.tests[0].test_idx = 1
+        self._make_db(True).insert_tests(job, job.tests)
+        self.assertEqual([1, 3], [t.test_idx for t in job.tests])
+        attributes = [v for s, v in self.cursor.statements
+                      if s.startswith('insert into tko_test_attributes')]
+        self.assertEqual([[1, 'version', '1', 3, 'version', '1']], attributes)
+
+
+class DiffReparseTestCase(_FakeCursorTestCase):
+    """Tests for db_sql.insert_tests() with diff_reparse."""
+
+    def setUp(self):
+        super(DiffReparseTestCase, self).setUp()
+        self.job = self._make_job(2, 2)
+        for i, test in enumerate(self.job.tests):
+            test.test_idx = i + 1
+        self.cursor.stored_rows = {
+                'select test_idx,`finished_time`': [
+                        (1, None, 1, 1, 1, '', None, 1, 'subdir_0', 'test_0'),
+                        (2, None, 1, 1, 1, 'old', None, 1, 'subdir_1',
+                         'test_1'),
+                ],
+                'select `test_idx`,`iteration`,`attribute`,`value` from '
+                'tko_iteration_attributes': [
+                        (1, 1, 'attr', 'x'), (2, 1, 'attr', 'x'),
+                ],
+                'select `test_idx`,`iteration`,`attribute`,`value` from '
+                'tko_iteration_result': [
+                        (1, 1, 'perf_0', 0.0), (1, 1, 'perf_1', 1.0),
+                        (1, 1, 'perf_nan', None),
+                        (2, 1, 'perf_0', 0.0), (2, 1, 'perf_1', 5.0),
+                        (2, 1, 'perf_nan', None), (2, 1, 'perf_gone', 1.0),
+                ],
+                'select `test_idx`,`attribute`,`value` from '
+                'tko_test_attributes': [
+                        (1, 'version', '1'), (2, 'version', '1'),
+                ],
+        }
+
+
+    def test_only_changed_rows_are_rewritten(self):
+        """Unchanged tests, iterations and attributes are left alone."""
+        self._make_db(False, diff_reparse=True).insert_tests(
+                self.job, self.job.tests)
+        updates = [v for s, v in self.cursor.statements
+                   if s.startswith('update tko_tests')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0][-1], 2)
+
+        deletes = [(s, v) for s, v in self.cursor.statements
+                   if s.startswith('delete')]
+        self.assertEqual(
+                [s.split()[2] for s, _ in deletes],
+                ['tko_iteration_perf_value', 'tko_iteration_result'])
+        self.assertEqual(sorted(deletes[1][1]),
+                         sorted([2, 1, 'perf_1', 2, 1, 'perf_gone']))
+
+        inserts = [(s, v) for s, v in self.cursor.statements
+                   if s.startswith('insert')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(inserts[0][1], [2, 1, 'perf_1', 1.0])
+
+
+class DeleteTestsTestCase(_FakeCursorTestCase):
+    """Tests for db_sql.delete_tests()."""
+
+    def test_one_statement_per_table(self):
+        """Deleting many tests costs one DELETE per table."""
+        self._make_db(False).delete_tests(range(100))
+        self.assertEqual(len(self._statements('delete')), 6)
+
+
+    def test_chunked(self):
+        """The IN lists are bounded by _MAX_ROWS_PER_INSERT."""
+        tko_db = self._make_db(False)
+        tko_db._MAX_ROWS_PER_INSERT = 40
+        tko_db.delete_tests(range(100))
+        deletes = [(s, v) for s, v in self.cursor.statements
+                   if s.startswith('delete')]
+        self.assertEqual(len(deletes), 18)
+        self.assertEqual(max(len(values) for _, values in deletes), 40)
+        self.assertEqual(
+                sorted(value for sql, values in deletes
+                       if sql.split()[2] == 'tko_tests' for value in values),
+                range(100))
+
+
+class LookupCacheTestCase(unittest.TestCase):
+    """Tests for _LookupCache."""
+
+    def test_evicts_least_recently_used(self):
+        """The oldest untouched entry is dropped first."""
+        cache = db._LookupCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+    def test_disabled(self):
+        """A zero size cache never stores anything."""
+        cache = db._LookupCache(0)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+
+class LookupCachingTestCase(_FakeCursorTestCase):
+    """Tests for the kernel/machine lookup caches of db_sql."""
+
+    def _parse_jobs(self, tko_db, num_jobs):
+        for _ in xrange(num_jobs):
+            job = self._make_job(20, 5)
+            job.machine = 'host1'
+            job.machine_group = 'group'
+            job.machine_owner = None
+            tko_db.insert_or_update_machine(job)
+            tko_db.insert_tests(job, job.tests)
+
+
+    def _selects(self):
+        return self._statements('select')
+
+
+    def test_caches_remove_selects(self):
+        """Repeated kernels and machines are only looked up once per job."""
+        self._parse_jobs(self._make_db(True, lookup_cache_size=0), 5)
+        uncached = len(self._selects())
+
+        self.cursor.statements = []
+        tko_db = self._make_db(True, lookup_cache_size=100)
+        self._parse_jobs(tko_db, 5)
+        # One status, kernel and machine lookup in total, plus the highest
+        # test_idx lookup and the test_idx read back of every job.
+        self.assertEqual(len(self._selects()), 3 + 2 * 5)
+        self.assertGreater(uncached, 100)
+        self.assertEqual(tko_db.lookup_cache_stats()['kernel'], (99, 1))
+
+
+    def test_rollback_clears_caches(self):
+        """Ids possibly created in a rolled back transaction are dropped."""
+        tko_db = self._make_db(True, lookup_cache_size=100)
+        self._parse_jobs(tko_db, 1)
+        tko_db.rollback()
+        self.cursor.statements = []
+        self._parse_jobs(tko_db, 1)
+        self.assertIn('select machine_idx from tko_machines  WHERE '
+                      '`hostname`=%s', self._selects())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,14 +1,20 @@
 #!/usr/bin/python2 -u
 
 import collections
+import cPickle as pickle
 import errno
 import fcntl
+import itertools
 import json
+import multiprocessing
 import optparse
 import os
+import Queue
 import socket
+import SocketServer
 import subprocess
 import sys
+import threading
 import time
 import traceback
 
@@ -39,7 +45,7 @@ except ImportError:
 _ParseOptions = collections.namedtuple(
     'ParseOptions', ['reparse', 'mail_on_failure', 'dry_run', 'suite_report',
                      'datastore_creds', 'export_to_gcloud_path',
-                     'disable_perf_upload'])
+                     'disable_perf_upload', 'stream_status_log'])
 
 _HARDCODED_CONTROL_FILE_NAMES = (
         # client side test control, as saved in old Autotest paths.
@@ -50,6 +56,16 @@ _HARDCODED_CONTROL_FILE_NAMES = (
         'control.from_control_name',
 )
 
+# Number of status log lines fed to the parser at a time when streaming.
+_STATUS_LOG_CHUNK_LINES = 1000
+
+# Number of chunks between two checkpoints of a streaming parse.
+_STATUS_LOG_CHECKPOINT_INTERVAL = 10
+
+# File in the results directory recording how far a streaming parse of the
+# status log got, so that an interrupted parse can resume from there.
+_STATUS_LOG_CHECKPOINT_FILE = '.parse_status_checkpoint'
+
 
 def parse_args():
     """Parse args."""
@@ -111,10 +127,35 @@ def parse_args():
                       help=("Do not upload perf results to chrome perf."),
                       dest="disable_perf_upload", action="store_true",
                       default=False)
+    parser.add_option("--workers",
+                      help=("Number of processes parsing the job directories "
+                            "of a multi-machine job in parallel."),
+                      type="int", dest="workers", default=1)
+    parser.add_option("--service-threads",
+                      help=("In service mode, the number of threads parsing "
+                            "jobs concurrently."),
+                      type="int", dest="service_threads", default=1)
+    parser.add_option("--serve-socket",
+                      help=("Run as a long-lived parse service, accepting "
+                            "results directories, one per line, on this unix "
+                            "socket."),
+                      dest="serve_socket", action="store", default=None)
+    parser.add_option("--serve-queue-dir",
+                      help=("Run as a long-lived parse service, parsing the "
+                            "results directory named in each file dropped "
+                            "into this directory."),
+                      dest="serve_queue_dir", action="store", default=None)
+    parser.add_option("--stream-status-log",
+                      help=("Feed the status log to the parser in chunks "
+                            "instead of reading it whole, checkpointing "
+                            "progress so an interrupted parse can resume."),
+                      dest="stream_status_log", action="store_true",
+                      default=False)
     options, args = parser.parse_args()
 
-    # we need a results directory
-    if len(args) == 0:
+    # we need a results directory, unless we are a parse service
+    serving = options.serve_socket or options.serve_queue_dir
+    if len(args) == 0 and not serving:
         tko_utils.dprint("ERROR: at least one results directory must "
                          "be provided")
         parser.print_help()
@@ -357,7 +398,8 @@ def parse_one(db, pid_file_manager, jobname, path, parse_options):
     if not status_log_path:
         tko_utils.dprint("! Unable to parse job, no status file")
         return
-    _parse_status_log(parser, job, status_log_path)
+    _parse_status_log(parser, job, status_log_path,
+                      streaming=parse_options.stream_status_log)
 
     if old_job_idx is not None:
         job.job_idx = old_job_idx
@@ -547,8 +589,9 @@ def _write_job_to_db(db, jobname, job):
             'skylab' if tko_utils.is_skylab_task(jobname) else 'afe',
     )
     db.update_job_keyvals(job)
-    for test in job.tests:
-        db.insert_test(job, test)
+    db.insert_tests(job, job.tests)
+    tko_utils.dprint('Lookup cache (hits, misses): %s'
+                     % db.lookup_cache_stats())
 
 
 def _find_status_log_path(path):
@@ -559,7 +602,12 @@ def _find_status_log_path(path):
     return ""
 
 
-def _parse_status_log(parser, job, status_log_path):
+def _parse_status_log(parser, job, status_log_path, streaming=False):
+    if streaming:
+        for _ in _stream_status_log(parser, job, status_log_path):
+            pass
+        return
+
     status_lines = open(status_log_path).readlines()
     parser.start(job)
     tests = parser.end(status_lines)
@@ -573,6 +621,122 @@ def _parse_status_log(parser, job, status_log_path):
             job.tests.append(test)
 
 
+def _stream_status_log(parser, job, status_log_path,
+                       chunk_lines=_STATUS_LOG_CHUNK_LINES):
+    """Parse a status log incrementally, yielding tests as they appear.
+
+    The log is fed to the parser _STATUS_LOG_CHUNK_LINES lines at a time, so
+    only the tests of the job are held in memory, not the lines of the log.
+    job.tests is filled in as a side effect.
+
+    Whenever the parser reports a resumable state, the byte offset reached
+    and the tests produced so far are saved next to the status log. If such
+    a checkpoint exists for the same log, parsing resumes from it.
+
+    @param parser: A tko parser instance.
+    @param job: tko.models.job object.
+    @param status_log_path: Path of the status log.
+    @param chunk_lines: Number of lines to feed to the parser at a time.
+
+    @yields: tko.models.test objects, each one once.
+    """
+    checkpoint_path = os.path.join(os.path.dirname(status_log_path),
+                                   _STATUS_LOG_CHECKPOINT_FILE)
+    status_log_inode = os.stat(status_log_path).st_ino
+    checkpoint = _load_status_log_checkpoint(checkpoint_path, status_log_inode)
+    if checkpoint:
+        tko_utils.dprint('Resuming parse of %s at byte %d'
+                         % (status_log_path, checkpoint['offset']))
+        offset = checkpoint['offset']
+        job.tests = checkpoint['tests']
+        parser.start(job, resume_state=checkpoint['resume_state'])
+    else:
+        offset = 0
+        job.tests = []
+        parser.start(job)
+
+    # parser.process_lines can return the same object multiple times, so
+    # filter out dups.
+    already_added = set(job.tests)
+    chunks_since_checkpoint = 0
+    with open(status_log_path) as status_log:
+        status_log.seek(offset)
+        lines = iter(status_log.readline, '')
+        while True:
+            chunk = list(itertools.islice(lines, chunk_lines))
+            if chunk:
+                tests = parser.process_lines(chunk)
+            else:
+                tests = parser.end()
+            offset += sum(len(line) for line in chunk)
+            for test in tests:
+                if test not in already_added:
+                    already_added.add(test)
+                    job.tests.append(test)
+                    yield test
+            if not chunk:
+                break
+            chunks_since_checkpoint += 1
+            if (parser.resume_state is not None and chunks_since_checkpoint >=
+                _STATUS_LOG_CHECKPOINT_INTERVAL):
+                _save_status_log_checkpoint(
+                        checkpoint_path, status_log_inode, offset,
+                        parser.resume_state, job.tests)
+                chunks_since_checkpoint = 0
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def _load_status_log_checkpoint(checkpoint_path, status_log_inode):
+    """Load a status log checkpoint, if there is a usable one.
+
+    @param checkpoint_path: Path of the checkpoint file.
+    @param status_log_inode: Inode number of the status log being parsed.
+
+    @returns: The checkpoint dict, or None.
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    try:
+        with open(checkpoint_path, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except Exception as e:
+        tko_utils.dprint('Ignoring unreadable checkpoint %s: %s'
+                         % (checkpoint_path, e))
+        return None
+    if checkpoint.get('inode') != status_log_inode:
+        tko_utils.dprint('Ignoring checkpoint %s of another status log'
+                         % checkpoint_path)
+        return None
+    return checkpoint
+
+
+def _save_status_log_checkpoint(checkpoint_path, status_log_inode, offset,
+                                resume_state, tests):
+    """Atomically write a status log checkpoint.
+
+    @param checkpoint_path: Path of the checkpoint file.
+    @param status_log_inode: Inode number of the status log being parsed.
+    @param offset: Byte offset of the first line not yet parsed.
+    @param resume_state: The parser's resume_state at that offset.
+    @param tests: Tests produced so far.
+    """
+    # The running SERVER_JOB entry is recreated by the resumed parser.
+    tests = [test for test in tests
+             if not (test.testname == 'SERVER_JOB' and test.subdir == '----')]
+    checkpoint = {
+            'inode': status_log_inode,
+            'offset': offset,
+            'resume_state': resume_state,
+            'tests': tests,
+    }
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, checkpoint_path)
+
+
 def _match_existing_tests(db, job):
     """Find entries in the DB corresponding to the job's tests, update job.
 
@@ -599,14 +763,7 @@ def _match_existing_tests(db, job):
 
 
 def _delete_tests_from_db(db, tests):
-    for test_idx in tests.itervalues():
-        where = {'test_idx' : test_idx}
-        db.delete('tko_iteration_result', where)
-        db.delete('tko_iteration_perf_value', where)
-        db.delete('tko_iteration_attributes', where)
-        db.delete('tko_test_attributes', where)
-        db.delete('tko_test_labels_tests', {'test_id': test_idx})
-        db.delete('tko_tests', where)
+    db.delete_tests(tests.values())
 
 
 def _get_job_subdirs(path):
@@ -666,29 +823,103 @@ def parse_path(db, pid_file_manager, path, level, parse_options):
               set(['123-chromeos-test/host1', '123-chromeos-test/host2'])
     """
     processed_jobs = set()
-    job_subdirs = _get_job_subdirs(path)
-    if job_subdirs is not None:
-        # parse status.log in current directory, if it exists. multi-machine
-        # synchronous server side tests record output in this directory. without
-        # this check, we do not parse these results.
-        if os.path.exists(os.path.join(path, 'status.log')):
-            new_job = parse_leaf_path(db, pid_file_manager, path, level,
-                                      parse_options)
-            processed_jobs.add(new_job)
-        # multi-machine job
-        for subdir in job_subdirs:
-            jobpath = os.path.join(path, subdir)
-            new_jobs = parse_path(db, pid_file_manager, jobpath, level + 1,
-                                  parse_options)
-            processed_jobs.update(new_jobs)
-    else:
-        # single machine job
-        new_job = parse_leaf_path(db, pid_file_manager, path, level,
+    for leaf_path, leaf_level in _get_leaf_paths(path, level):
+        new_job = parse_leaf_path(db, pid_file_manager, leaf_path, leaf_level,
                                   parse_options)
         processed_jobs.add(new_job)
     return processed_jobs
 
 
+def parse_path_in_pool(pool, pid_file_manager, path, level, parse_options):
+    """Parse a path, spreading its job directories over a worker pool.
+
+    Each worker parses with its own database connection, see
+    _init_parse_worker. The tests failed in the workers are added to
+    pid_file_manager.
+
+    @param pool: multiprocessing.Pool created by _make_parse_pool.
+    @param pid_file_manager: pidfile.PidFileManager object.
+    @param path: The path to the results to be parsed.
+    @param level: Integer, level of subdirectories to include in the job name.
+    @param parse_options: _ParseOptions instance.
+
+    @returns: A set of job names of the parsed jobs.
+    """
+    # The namedtuple class can not be pickled under its own name.
+    results = [pool.apply_async(_parse_leaf_path_in_worker,
+                                (leaf_path, leaf_level, tuple(parse_options)))
+               for leaf_path, leaf_level in _get_leaf_paths(path, level)]
+    processed_jobs = set()
+    for result in results:
+        jobname, num_tests_failed = result.get()
+        pid_file_manager.num_tests_failed += num_tests_failed
+        processed_jobs.add(jobname)
+    return processed_jobs
+
+
+def _get_leaf_paths(path, level):
+    """Find the job directories to parse under a path.
+
+    @param path: The path to the results to be parsed.
+    @param level: Integer, level of subdirectories to include in the job name.
+
+    @returns: A list of (path, level) tuples, one per job directory.
+    """
+    job_subdirs = _get_job_subdirs(path)
+    if job_subdirs is None:
+        # single machine job
+        return [(path, level)]
+
+    leaf_paths = []
+    # parse status.log in current directory, if it exists. multi-machine
+    # synchronous server side tests record output in this directory. without
+    # this check, we do not parse these results.
+    if os.path.exists(os.path.join(path, 'status.log')):
+        leaf_paths.append((path, level))
+    # multi-machine job
+    for subdir in job_subdirs:
+        leaf_paths.extend(_get_leaf_paths(os.path.join(path, subdir),
+                                          level + 1))
+    return leaf_paths
+
+
+# Database handle of a parse worker process, see _init_parse_worker.
+_worker_db = None
+
+
+def _make_parse_pool(workers, db_args):
+    """Create the pool of parse worker processes.
+
+    @param workers: Number of worker processes.
+    @param db_args: Keyword arguments for tko_db.db.
+    """
+    return multiprocessing.Pool(workers, _init_parse_worker, (db_args,))
+
+
+def _init_parse_worker(db_args):
+    """Open the database connection of a parse worker process.
+
+    @param db_args: Keyword arguments for tko_db.db.
+    """
+    global _worker_db
+    _worker_db = tko_db.db(autocommit=False, **db_args)
+
+
+def _parse_leaf_path_in_worker(path, level, parse_options):
+    """Parse a leaf path in a parse worker process.
+
+    @param path: The path to the results to be parsed.
+    @param level: Integer, level of subdirectories to include in the job name.
+    @param parse_options: _ParseOptions fields, as a tuple.
+
+    @returns: A (job name, number of failed tests) tuple.
+    """
+    pid_file_manager = pidfile.PidFileManager("parser", path)
+    jobname = parse_leaf_path(_worker_db, pid_file_manager, path, level,
+                              _ParseOptions(*parse_options))
+    return jobname, pid_file_manager.num_tests_failed
+
+
 def _detach_from_parent_process():
     """Allow reparenting the parse process away from caller.
 
@@ -703,6 +934,13 @@ def main():
     """tko_parse entry point."""
     options, args = parse_args()
 
+    if options.serve_socket or options.serve_queue_dir:
+        # The service lives long enough for the regular flushing thread.
+        with site_utils.SetupTsMonGlobalState('tko_parse_service',
+                                              indirect=True):
+            _ParseService(options).serve_forever()
+        return
+
     # We are obliged to use indirect=False, not use the SetupTsMonGlobalState
     # context manager, and add a manual flush, because tko/parse is expected to
     # be a very short lived (<1 min) script when working effectively, and we
@@ -731,11 +969,7 @@ def _main_with_options(options, args):
 
     _update_db_config_from_json(options, results_dir)
 
-    parse_options = _ParseOptions(options.reparse, options.mailit,
-                                  options.dry_run, options.suite_report,
-                                  options.datastore_creds,
-                                  options.export_to_gcloud_path,
-                                  options.disable_perf_upload)
+    parse_options = _make_parse_options(options)
 
     pid_file_manager = pidfile.PidFileManager("parser", results_dir)
 
@@ -744,40 +978,33 @@ def _main_with_options(options, args):
 
     try:
         # build up the list of job dirs to parse
-        if options.singledir:
-            jobs_list = [results_dir]
-        else:
-            jobs_list = [os.path.join(results_dir, subdir)
-                         for subdir in os.listdir(results_dir)]
+        jobs_list = _get_jobs_list(options, results_dir)
 
         # build up the database
-        db = tko_db.db(autocommit=False, host=options.db_host,
-                       user=options.db_user, password=options.db_pass,
-                       database=options.db_name)
+        db_args = _get_db_args(options)
+        if options.workers > 1:
+            db = None
+            pool = _make_parse_pool(options.workers, db_args)
+        else:
+            db = tko_db.db(autocommit=False, **db_args)
+            pool = None
 
         # parse all the jobs
-        for path in jobs_list:
-            lockfile = open(os.path.join(path, ".parse.lock"), "w")
-            flags = fcntl.LOCK_EX
-            if options.noblock:
-                flags |= fcntl.LOCK_NB
-            try:
-                fcntl.flock(lockfile, flags)
-            except IOError, e:
-                # lock is not available and nonblock has been requested
-                if e.errno == errno.EWOULDBLOCK:
-                    lockfile.close()
-                    continue
-                else:
-                    raise # something unexpected happened
-            try:
-                new_jobs = parse_path(db, pid_file_manager, path, options.level,
-                                      parse_options)
-                processed_jobs.update(new_jobs)
-
-            finally:
-                fcntl.flock(lockfile, fcntl.LOCK_UN)
-                lockfile.close()
+        try:
+            processed_jobs.update(_parse_jobs_list(
+                    db, pool, pid_file_manager, jobs_list, options.level,
+                    options.noblock, parse_options))
+        except:
+            # Do not leave the workers parsing the rest of the jobs.
+            if pool:
+                pool.terminate()
+            raise
+        else:
+            if pool:
+                pool.close()
+        finally:
+            if pool:
+                pool.join()
 
     except Exception as e:
         pid_file_manager.close_file(1)
@@ -786,6 +1013,264 @@ def _main_with_options(options, args):
         pid_file_manager.close_file(0)
 
 
+def _make_parse_options(options):
+    """Build the _ParseOptions of the parsed command line options."""
+    return _ParseOptions(options.reparse, options.mailit,
+                         options.dry_run, options.suite_report,
+                         options.datastore_creds,
+                         options.export_to_gcloud_path,
+                         options.disable_perf_upload,
+                         options.stream_status_log)
+
+
+def _get_db_args(options):
+    """Get the tko_db.db keyword arguments of the parsed options."""
+    return {'host': options.db_host, 'user': options.db_user,
+            'password': options.db_pass, 'database': options.db_name}
+
+
+def _get_jobs_list(options, results_dir):
+    """List the job dirs to parse for a results directory."""
+    if options.singledir:
+        return [results_dir]
+    return [os.path.join(results_dir, subdir)
+            for subdir in os.listdir(results_dir)]
+
+
+def _parse_jobs_list(db, pool, pid_file_manager, jobs_list, level, noblock,
+                     parse_options):
+    """Parse job dirs, each under its .parse.lock.
+
+    @param db: database handle, used when pool is None.
+    @param pool: multiprocessing.Pool from _make_parse_pool, or None.
+    @param pid_file_manager: pidfile.PidFileManager object.
+    @param jobs_list: List of paths to parse.
+    @param level: Integer, level of subdirectories to include in the job name.
+    @param noblock: If True, skip paths that are already being parsed.
+    @param parse_options: _ParseOptions instance.
+
+    @returns: A set of job names of the parsed jobs.
+    """
+    processed_jobs = set()
+    for path in jobs_list:
+        lockfile = open(os.path.join(path, ".parse.lock"), "w")
+        flags = fcntl.LOCK_EX
+        if noblock:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lockfile, flags)
+        except IOError, e:
+            # lock is not available and nonblock has been requested
+            if e.errno == errno.EWOULDBLOCK:
+                lockfile.close()
+                continue
+            else:
+                raise # something unexpected happened
+        try:
+            if pool:
+                new_jobs = parse_path_in_pool(pool, pid_file_manager, path,
+                                              level, parse_options)
+            else:
+                new_jobs = parse_path(db, pid_file_manager, path, level,
+                                      parse_options)
+            processed_jobs.update(new_jobs)
+
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+    return processed_jobs
+
+
+class _ParseService(object):
+    """Long-lived parser, fed results directories through a queue.
+
+    Results directories arrive on a unix socket, one per line, and/or as
+    files dropped into a queue directory, each holding one results
+    directory. options.service_threads threads take them off the queue, each
+    parsing with its own long-lived database connection, so connection
+    setup, tko_status loading and the db_sql lookup caches are paid for
+    once per thread instead of once per job.
+
+    The database settings are those given at startup; per-job
+    side_effects_config.json files are not consulted.
+    """
+
+    _QUEUE_DEPTH_METRIC = 'chromeos/autotest/tko_parse/service/queue_depth'
+    _LATENCY_METRIC = 'chromeos/autotest/tko_parse/service/latency'
+    _PARSE_DURATION_METRIC = (
+            'chromeos/autotest/tko_parse/service/parse_duration')
+    _RUNS_METRIC = 'chromeos/autotest/tko_parse/runs'
+
+    # Seconds between two scans of the queue directory.
+    _QUEUE_DIR_POLL_INTERVAL = 1
+
+    # Seconds to wait before reconnecting to the database, doubled after
+    # every failed attempt up to _CONNECT_RETRY_MAX_DELAY.
+    _CONNECT_RETRY_DELAY = 1
+    _CONNECT_RETRY_MAX_DELAY = 60
+
+    def __init__(self, options):
+        """
+        @param options: The parsed command line options.
+        """
+        self._options = options
+        self._parse_options = _make_parse_options(options)
+        self._queue = Queue.Queue()
+
+
+    def submit(self, results_dir):
+        """Queue a results directory for parsing.
+
+        @param results_dir: The results directory, as given on the command
+                            line of a regular parse.
+        """
+        self._queue.put((os.path.abspath(results_dir), time.time()))
+        self._report_queue_depth()
+
+
+    def _report_queue_depth(self):
+        metrics.Gauge(self._QUEUE_DEPTH_METRIC).set(self._queue.qsize())
+
+
+    def serve_forever(self):
+        """Start the parse threads and the inputs, and never return."""
+        for _ in xrange(max(1, self._options.service_threads)):
+            self._start_thread(self._parse_forever)
+        if self._options.serve_queue_dir:
+            self._start_thread(self._watch_queue_dir,
+                               self._options.serve_queue_dir)
+        if self._options.serve_socket:
+            self._serve_socket(self._options.serve_socket)
+        else:
+            while True:
+                time.sleep(60)
+
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+
+    def _connect(self):
+        """Connect to the database, retrying until it succeeds.
+
+        @returns: A tko_db.db instance.
+        """
+        delay = self._CONNECT_RETRY_DELAY
+        while True:
+            try:
+                return tko_db.db(autocommit=False,
+                                 **_get_db_args(self._options))
+            except Exception:
+                tko_utils.dprint('Failed to connect to the database, '
+                                 'retrying in %d seconds:\n%s'
+                                 % (delay, traceback.format_exc()))
+                time.sleep(delay)
+                delay = min(delay * 2, self._CONNECT_RETRY_MAX_DELAY)
+
+
+    def _parse_forever(self):
+        """Parse queued results directories with one warm connection."""
+        db = self._connect()
+        while True:
+            results_dir, queued_time = self._queue.get()
+            self._report_queue_depth()
+            start_time = time.time()
+            try:
+                with metrics.SuccessCounter(self._RUNS_METRIC):
+                    self._parse_results_dir(db, results_dir)
+            except Exception:
+                tko_utils.dprint('Failed to parse %s:\n%s'
+                                 % (results_dir, traceback.format_exc()))
+                # Start afresh, the transaction is in an unknown state.
+                try:
+                    db.rollback()
+                except Exception:
+                    db = self._connect()
+            finally:
+                end_time = time.time()
+                metrics.SecondsDistribution(self._PARSE_DURATION_METRIC).add(
+                        end_time - start_time)
+                metrics.SecondsDistribution(self._LATENCY_METRIC).add(
+                        end_time - queued_time)
+                self._queue.task_done()
+
+
+    def _parse_results_dir(self, db, results_dir):
+        """Parse one results directory, as a regular tko/parse run would.
+
+        @param db: This thread's database handle.
+        @param results_dir: Absolute path of the results directory.
+        """
+        pid_file_manager = pidfile.PidFileManager("parser", results_dir)
+        if self._options.write_pidfile:
+            pid_file_manager.open_file()
+        try:
+            _parse_jobs_list(db, None, pid_file_manager,
+                             _get_jobs_list(self._options, results_dir),
+                             self._options.level, self._options.noblock,
+                             self._parse_options)
+        except Exception:
+            pid_file_manager.close_file(1)
+            raise
+        else:
+            pid_file_manager.close_file(0)
+
+
+    def _watch_queue_dir(self, queue_dir):
+        """Submit the results directories named by files in queue_dir.
+
+        Each file is removed once its results directory is queued.
+
+        @param queue_dir: The directory to watch.
+        """
+        while True:
+            for name in sorted(os.listdir(queue_dir)):
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(queue_dir, name)
+                try:
+                    with open(path) as f:
+                        results_dir = f.read().strip()
+                    os.remove(path)
+                except (IOError, OSError) as e:
+                    tko_utils.dprint('Failed to read queue entry %s: %s'
+                                     % (path, e))
+                    continue
+                if results_dir:
+                    self.submit(results_dir)
+            time.sleep(self._QUEUE_DIR_POLL_INTERVAL)
+
+
+    def _serve_socket(self, socket_path):
+        """Accept results directories on a unix socket, forever.
+
+        Every line received is queued and acknowledged with the current
+        queue depth.
+
+        @param socket_path: Path of the unix socket to listen on.
+        """
+        service = self
+
+        class _Handler(SocketServer.StreamRequestHandler):
+            """Queues the results directory of every line received."""
+
+            def handle(self):
+                for line in self.rfile:
+                    results_dir = line.strip()
+                    if results_dir:
+                        service.submit(results_dir)
+                        self.wfile.write('QUEUED %d\n'
+                                         % service._queue.qsize())
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = SocketServer.ThreadingUnixStreamServer(socket_path, _Handler)
+        server.daemon_threads = True
+        server.serve_forever()
+
+
 def _update_db_config_from_json(options, test_results_dir):
     """Uptade DB config options using a side_effects_config.json file.
 
@@ -0,0 +1,436 @@
+#!/usr/bin/python2
+
+"""Tests for tko/parse.py."""
+
+import multiprocessing.pool
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+import common
+from autotest_lib.client.common_lib import pidfile
+from autotest_lib.tko import parse
+from autotest_lib.tko import parser_lib
+
+
+def _status_line(indent, status, subdir, testname, timestamp, reason=''):
+    """Render a status log line."""
+    return '%s%s\t%s\t%s\ttimestamp=%d\tlocaltime=Jan 01 00:00:00\t%s\n' % (
+            '\t' * indent, status, subdir, testname, timestamp, reason)
+
+
+def _write_job_keyvals(results_dir):
+    """Write the job and host keyvals of a single machine job."""
+    with open(os.path.join(results_dir, 'keyval'), 'w') as f:
+        f.write('hostname=host1\njob_started=1000\n')
+    os.mkdir(os.path.join(results_dir, 'host_keyvals'))
+    with open(os.path.join(results_dir, 'host_keyvals', 'host1'), 'w') as f:
+        f.write('labels=board%3Aboard1\n')
+
+
+def _write_status_log(results_dir, num_tests):
+    """Write a status log with a test per iteration, some of them failing.
+
+    @param results_dir: Directory to write the status.log into.
+    @param num_tests: Number of tests in the log.
+
+    @returns: The path of the status log.
+    """
+    lines = []
+    for i in xrange(num_tests):
+        name = 'test%d' % i
+        status = 'FAIL' if i % 3 == 0 else 'GOOD'
+        lines.append(_status_line(0, 'START', name, name, 1000 + i))
+        lines.append(_status_line(1, status, name, name, 1000 + i,
+                                  'reason %d' % i))
+        lines.append(_status_line(0, 'END %s' % status, name, name, 1000 + i,
+                                  'reason %d' % i))
+    status_log_path = os.path.join(results_dir, 'status.log')
+    with open(status_log_path, 'w') as f:
+        f.writelines(lines)
+    return status_log_path
+
+
+def _summarize(tests):
+    """Reduce parsed tests to comparable tuples."""
+    return sorted((test.testname, test.subdir, test.status, test.reason)
+                  for test in tests)
+
+
+class StreamStatusLogTest(unittest.TestCase):
+    """Tests for streaming and resuming the parse of a status log."""
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        _write_job_keyvals(self.results_dir)
+        self.status_log_path = _write_status_log(self.results_dir, 30)
+        self.checkpoint_path = os.path.join(self.results_dir,
+                                            parse._STATUS_LOG_CHECKPOINT_FILE)
+        # Checkpoint after every chunk.
+        patcher = mock.patch.object(parse, '_STATUS_LOG_CHECKPOINT_INTERVAL',
+                                    1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+
+    def _make_parser_and_job(self):
+        parser = parser_lib.parser(1)
+        return parser, parser.make_job(self.results_dir)
+
+
+    def _parse_at_once(self):
+        parser, job = self._make_parser_and_job()
+        parse._parse_status_log(parser, job, self.status_log_path)
+        return _summarize(job.tests)
+
+
+    def _stream(self):
+        parser, job = self._make_parser_and_job()
+        streamed = list(parse._stream_status_log(
+                parser, job, self.status_log_path, chunk_lines=4))
+        return _summarize(streamed), _summarize(job.tests)
+
+
+    def test_stream(self):
+        """Test that streaming finds the same tests as a one-shot parse."""
+        expected = self._parse_at_once()
+        self.assertEqual(31, len(expected))
+        self.assertEqual((expected, expected), self._stream())
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+
+    def test_resume_from_checkpoint(self):
+        """Test resuming an interrupted parse from its checkpoint."""
+        parser, job = self._make_parser_and_job()
+        stream = parse._stream_status_log(parser, job, self.status_log_path,
+                                          chunk_lines=4)
+        for _ in stream:
+            if os.path.exists(self.checkpoint_path):
+                break
+        # Interrupt the parse halfway.
+        stream.close()
+        checkpoint = parse._load_status_log_checkpoint(
+                self.checkpoint_path, os.stat(self.status_log_path).st_ino)
+        self.assertTrue(0 < checkpoint['offset']
+                        < os.path.getsize(self.status_log_path))
+        self.assertTrue(checkpoint['tests'])
+
+        streamed, tests = self._stream()
+        self.assertEqual(self._parse_at_once(), tests)
+        # Only the tests after the checkpoint are parsed again.
+        self.assertEqual(
+                sorted(set(tests) - set(_summarize(checkpoint['tests']))),
+                streamed)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+
+    def test_checkpoint_of_another_log_ignored(self):
+        """Test that a checkpoint of another status log is ignored."""
+        parse._save_status_log_checkpoint(
+                self.checkpoint_path,
+                os.stat(self.status_log_path).st_ino + 1,
+                os.path.getsize(self.status_log_path) / 2, {}, [])
+        self.assertEqual(None, parse._load_status_log_checkpoint(
+                self.checkpoint_path, os.stat(self.status_log_path).st_ino))
+        expected = self._parse_at_once()
+        self.assertEqual((expected, expected), self._stream())
+
+
+    def test_corrupt_checkpoint_ignored(self):
+        """Test that a corrupt checkpoint is ignored."""
+        with open(self.checkpoint_path, 'w') as f:
+            f.write('not a checkpoint')
+        self.assertEqual(None, parse._load_status_log_checkpoint(
+                self.checkpoint_path, os.stat(self.status_log_path).st_ino))
+        expected = self._parse_at_once()
+        self.assertEqual((expected, expected), self._stream())
+
+
+class LeafPathsTest(unittest.TestCase):
+    """Tests for finding the job directories under a results directory."""
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+
+    def _touch(self, *path):
+        with open(os.path.join(self.results_dir, *path), 'w'):
+            pass
+
+
+    def test_single_machine_job(self):
+        """Test that a single machine job is its own leaf."""
+        self._touch('status.log')
+        os.mkdir(os.path.join(self.results_dir, 'debug'))
+        self.assertEqual([(self.results_dir, 1)],
+                         parse._get_leaf_paths(self.results_dir, 1))
+
+
+    def test_multi_machine_job(self):
+        """Test that each machine of a multi-machine job is a leaf."""
+        for host in ('host1', 'host2'):
+            os.mkdir(os.path.join(self.results_dir, host))
+            self._touch(host, 'status.log')
+        self.assertEqual(
+                [(os.path.join(self.results_dir, 'host1'), 2),
+                 (os.path.join(self.results_dir, 'host2'), 2)],
+                sorted(parse._get_leaf_paths(self.results_dir, 1)))
+
+
+    def test_multi_machine_job_with_status_log(self):
+        """Test that the status log of a multi-machine job is parsed too."""
+        with open(os.path.join(self.results_dir, '.machines'), 'w') as f:
+            f.write('host1\nhost2\n')
+        self._touch('status.log')
+        os.mkdir(os.path.join(self.results_dir, 'host1'))
+        self._touch('host1', 'status.log')
+        self.assertEqual(
+                [(self.results_dir, 1),
+                 (os.path.join(self.results_dir, 'host1'), 2)],
+                parse._get_leaf_paths(self.results_dir, 1))
+
+
+class ParsePathInPoolTest(unittest.TestCase):
+    """Tests for parsing the job directories of a path in a worker pool."""
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        for host in ('host1', 'host2', 'host3'):
+            os.mkdir(os.path.join(self.results_dir, host))
+        self.parse_options = parse._ParseOptions(
+                False, False, False, False, None, None, True, False)
+        patcher = mock.patch.object(parse.tko_db, 'db')
+        self.db_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(parse, '_worker_db', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+
+    def test_init_parse_worker(self):
+        """Test that each worker opens its own database connection."""
+        parse._init_parse_worker({'host': 'db_host', 'database': 'tko'})
+        self.db_class.assert_called_once_with(
+                autocommit=False, host='db_host', database='tko')
+        self.assertEqual(self.db_class.return_value, parse._worker_db)
+
+
+    @mock.patch.object(parse, 'parse_leaf_path')
+    def test_parse_path_in_pool(self, parse_leaf_path):
+        """Test that the job directories are parsed by the workers."""
+        def fake_parse_leaf_path(db, pid_file_manager, path, level,
+                                 parse_options):
+            self.assertEqual(self.db_class.return_value, db)
+            self.assertEqual(self.parse_options, parse_options)
+            if path.endswith('host2'):
+                pid_file_manager.num_tests_failed = 2
+            return '/'.join(path.split('/')[-level:])
+        parse_leaf_path.side_effect = fake_parse_leaf_path
+
+        # Threads stand in for the worker processes, so that the mocks are
+        # shared with them.
+        pool = multiprocessing.pool.ThreadPool(
+                2, parse._init_parse_worker, ({},))
+        pid_file_manager = pidfile.PidFileManager('parser', self.results_dir)
+        try:
+            jobs = parse.parse_path_in_pool(
+                    pool, pid_file_manager, self.results_dir, 1,
+                    self.parse_options)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        job = os.path.basename(self.results_dir)
+        self.assertEqual(set(['%s/host1' % job, '%s/host2' % job,
+                              '%s/host3' % job]), jobs)
+        self.assertEqual(3, parse_leaf_path.call_count)
+        self.assertEqual(2, pid_file_manager.num_tests_failed)
+
+
+class MainWithOptionsTest(unittest.TestCase):
+    """Tests for the pool handling of _main_with_options."""
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        for name, value in (('_update_db_config_from_json', None),
+                            ('_get_jobs_list', [self.results_dir]),
+                            ('_get_db_args', {})):
+            patcher = mock.patch.object(parse, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(parse, '_make_parse_pool')
+        self.pool = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(parse, '_parse_jobs_list')
+        self.parse_jobs_list = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+
+    def _main(self):
+        options = mock.Mock(detach=False, write_pidfile=False, workers=4,
+                            level=1, noblock=False)
+        parse._main_with_options(options, [self.results_dir])
+
+
+    def test_pool_closed(self):
+        """Test that the pool is closed once all jobs are parsed."""
+        self.parse_jobs_list.return_value = set()
+        self._main()
+        self.pool.close.assert_called_once_with()
+        self.assertFalse(self.pool.terminate.called)
+        self.pool.join.assert_called_once_with()
+
+
+    def test_pool_terminated_on_error(self):
+        """Test that the pool is terminated when parsing fails."""
+        self.parse_jobs_list.side_effect = Exception('parse failed')
+        self.assertRaises(Exception, self._main)
+        self.pool.terminate.assert_called_once_with()
+        self.pool.join.assert_called_once_with()
+
+
+class _StopLoop(BaseException):
+    """Breaks out of the endless loops of _ParseService."""
+
+
+class ParseServiceTest(unittest.TestCase):
+    """Tests for _ParseService."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        options = mock.Mock(write_pidfile=False, service_threads=1)
+        self.service = parse._ParseService(options)
+        patcher = mock.patch.object(parse.tko_db, 'db')
+        self.db_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def _queued(self):
+        results_dirs = []
+        while not self.service._queue.empty():
+            results_dirs.append(self.service._queue.get()[0])
+        return results_dirs
+
+
+    def test_submit_over_socket(self):
+        """Test that each line received on the socket is queued."""
+        socket_path = os.path.join(self.temp_dir, 'socket')
+        thread = threading.Thread(target=self.service._serve_socket,
+                                  args=(socket_path,))
+        thread.daemon = True
+        thread.start()
+        for _ in xrange(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.05)
+
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+        client_file = client.makefile()
+        client_file.write('/results/1-job\n\n/results/2-job\n')
+        client_file.flush()
+        self.assertEqual('QUEUED 1\n', client_file.readline())
+        self.assertEqual('QUEUED 2\n', client_file.readline())
+        client_file.close()
+        client.close()
+        self.assertEqual(['/results/1-job', '/results/2-job'], self._queued())
+
+
+    def test_submit_through_queue_dir(self):
+        """Test that the files dropped into the queue dir are queued."""
+        for name, results_dir in (('b', '/results/2-job\n'),
+                                  ('a', '/results/1-job\n'),
+                                  ('.c.tmp', '/results/3-job\n')):
+            with open(os.path.join(self.temp_dir, name), 'w') as f:
+                f.write(results_dir)
+        with mock.patch.object(parse.time, 'sleep', side_effect=_StopLoop):
+            self.assertRaises(_StopLoop, self.service._watch_queue_dir,
+                              self.temp_dir)
+        self.assertEqual(['/results/1-job', '/results/2-job'], self._queued())
+        self.assertEqual(['.c.tmp'], os.listdir(self.temp_dir))
+
+
+    def _parse_forever(self, results_dirs, parse_results_dir_effects):
+        """Run _parse_forever until the queue is drained.
+
+        @param results_dirs: Results directories to queue.
+        @param parse_results_dir_effects: side_effect of _parse_results_dir
+                                          for each results directory.
+
+        @returns: The mocked _parse_results_dir and time.sleep.
+        """
+        for results_dir in results_dirs:
+            self.service.submit(results_dir)
+        self.service.submit('/results/stop')
+        with mock.patch.object(self.service, '_parse_results_dir',
+                               side_effect=parse_results_dir_effects +
+                               [_StopLoop]) as parse_results_dir, \
+             mock.patch.object(parse.time, 'sleep') as sleep:
+            self.assertRaises(_StopLoop, self.service._parse_forever)
+        return parse_results_dir, sleep
+
+
+    def test_recover_from_parse_failure(self):
+        """Test that a failed parse is rolled back and parsing goes on."""
+        db = self.db_class.return_value
+        parse_results_dir, _ = self._parse_forever(
+                ['/results/1-job', '/results/2-job'],
+                [Exception('parse failed'), None])
+        self.assertEqual(1, self.db_class.call_count)
+        db.rollback.assert_called_once_with()
+        self.assertEqual(
+                [mock.call(db, '/results/1-job'),
+                 mock.call(db, '/results/2-job'),
+                 mock.call(db, '/results/stop')],
+                parse_results_dir.call_args_list)
+
+
+    def test_reconnect(self):
+        """Test reconnecting after the connection is lost."""
+        lost_db = mock.Mock()
+        lost_db.rollback.side_effect = Exception('connection lost')
+        new_db = mock.Mock()
+        self.db_class.side_effect = [Exception('no database'),
+                                     Exception('no database'), lost_db,
+                                     Exception('no database'), new_db]
+        parse_results_dir, sleep = self._parse_forever(
+                ['/results/1-job', '/results/2-job'],
+                [Exception('connection lost'), None])
+        self.assertEqual(5, self.db_class.call_count)
+        self.assertEqual([mock.call(1), mock.call(2), mock.call(1)],
+                         sleep.call_args_list)
+        self.assertEqual(
+                [mock.call(lost_db, '/results/1-job'),
+                 mock.call(new_db, '/results/2-job'),
+                 mock.call(new_db, '/results/stop')],
+                parse_results_dir.call_args_list)
+
+
+if __name__ == '__main__':
+    unittest.main()
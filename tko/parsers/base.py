@@ -9,12 +9,19 @@ class parser(object):
     standard parser interfaction functions. The derived classes must
     implement a state_iterator method for this class to be useful.
     """
-    def start(self, job):
+    def start(self, job, resume_state=None):
         """ Initialize the parser for processing the results of
-        'job'."""
+        'job'. If 'resume_state' is given, it must be a value of
+        self.resume_state saved by an earlier parse of the same job,
+        and the parser continues from that point."""
         # initialize all the basic parser parameters
         self.job = job
         self.finished = False
+        self.initial_state = resume_state
+        # Updated by state machines that support resuming; it is set to a
+        # picklable snapshot whenever all fed lines have been consumed and
+        # no test is open, and to None otherwise.
+        self.resume_state = None
         self.line_buffer = status_lib.line_buffer()
         # create and prime the parser state machine
         self.state = self.state_iterator(self.line_buffer)
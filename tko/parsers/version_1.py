@@ -322,6 +322,15 @@ class parser(base.parser):
         current_kernel = kernel("", [])  # UNKNOWN
         current_status = status_lib.statuses[-1]
         current_reason = None
+        server_job_reason = ''
+        if self.initial_state:
+            job_count = self.initial_state['job_count']
+            boot_count = self.initial_state['boot_count']
+            min_stack_size = self.initial_state['min_stack_size']
+            current_kernel = self.initial_state['current_kernel']
+            current_status = self.initial_state['current_status']
+            current_reason = self.initial_state['current_reason']
+            server_job_reason = self.initial_state['server_job_reason']
         started_time_stack = [None]
         subdir_stack = [None]
         testname_stack = [None]
@@ -341,7 +350,8 @@ class parser(base.parser):
 
         # Create a RUNNING SERVER_JOB entry to represent the entire test.
         running_job = test.parse_partial_test(self.job, '----', 'SERVER_JOB',
-                                              '', current_kernel,
+                                              server_job_reason,
+                                              current_kernel,
                                               self.job.started_time)
         new_tests.append(running_job)
 
@@ -376,6 +386,18 @@ class parser(base.parser):
 
             # Stop processing once the buffer is empty.
             if buffer.size() == 0:
+                if stack.size() == 0 and not running_test:
+                    self.resume_state = {
+                            'job_count': job_count,
+                            'boot_count': boot_count,
+                            'min_stack_size': min_stack_size,
+                            'current_kernel': current_kernel,
+                            'current_status': current_status,
+                            'current_reason': current_reason,
+                            'server_job_reason': running_job.reason,
+                    }
+                else:
+                    self.resume_state = None
                 yield new_tests
                 new_tests = []
                 continue
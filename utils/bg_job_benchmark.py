@@ -0,0 +1,85 @@
+#!/usr/bin/python2
+
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Benchmark the I/O of commands run with utils.run and utils.run_parallel."""
+
+import argparse
+import resource
+import time
+
+import common
+from autotest_lib.client.common_lib import utils
+
+
+def get_parser():
+    """Creates the argparse parser."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output_mb', type=int, default=64,
+                        help='MB of output of the command run alone.')
+    parser.add_argument('--stdin_mb', type=int, default=64,
+                        help='MB of string stdin of the command run alone.')
+    parser.add_argument('--parallel', type=int, default=50,
+                        help='Number of commands run in parallel.')
+    parser.add_argument('--parallel_output_kb', type=int, default=256,
+                        help='KB of output of each parallel command.')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Number of times to run each benchmark.')
+    return parser
+
+
+def _cpu_time():
+    """Return the user and system CPU time of this process, in seconds."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _measure(name, run, func):
+    """Run a benchmark once and print how long it took.
+
+    @param name: Name of the benchmark.
+    @param run: Number of the run.
+    @param func: Function running the benchmark, returning the number of
+                 bytes transferred.
+    """
+    start = time.time()
+    start_cpu = _cpu_time()
+    size = func()
+    duration = time.time() - start
+    cpu = _cpu_time() - start_cpu
+    print ('Run %d: %s: %d MB in %.2f seconds (%.1f MB/s), %.2f CPU seconds.'
+           % (run, name, size / 2**20, duration,
+              size / 2**20 / max(duration, 1e-6), cpu))
+
+
+def main():
+    """Main entry."""
+    options = get_parser().parse_args()
+    output_size = options.output_mb * 2**20
+    stdin = 'A' * (options.stdin_mb * 2**20)
+    parallel_size = options.parallel_output_kb * 2**10
+
+    def read_output():
+        result = utils.run('head -c %d /dev/zero' % output_size,
+                           verbose=False)
+        return len(result.stdout)
+
+    def write_stdin():
+        result = utils.run('wc -c', stdin=stdin, verbose=False)
+        return int(result.stdout)
+
+    def run_parallel():
+        results = utils.run_parallel(
+                ['head -c %d /dev/zero' % parallel_size] * options.parallel)
+        return sum(len(result.stdout) for result in results)
+
+    for run in xrange(options.runs):
+        _measure('output', run, read_output)
+        _measure('stdin', run, write_stdin)
+        _measure('parallel', run, run_parallel)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python2
+
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Benchmark the gs_offloader uploaders on a synthetic result directory.
+
+The results are copied to a local fake bucket, so the benchmark measures
+the overhead of the uploader rather than the network.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import common
+from autotest_lib.site_utils import gs_offloader
+
+
+def get_parser():
+    """Creates the argparse parser."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=20,
+                        help='Number of job directories to offload.')
+    parser.add_argument('--files', type=int, default=500,
+                        help='Number of files in each job directory.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16],
+                        help='Numbers of upload workers to compare.')
+    return parser
+
+
+def create_jobs(top_dir, jobs, files):
+    """Create synthetic job result directories.
+
+    @param top_dir: Directory to create the jobs in.
+    @param jobs: Number of job directories to create.
+    @param files: Number of files in each job directory.
+
+    @return A list of the job directories.
+    """
+    job_dirs = []
+    for job in xrange(jobs):
+        job_dir = os.path.join(top_dir, '%d-debug' % job)
+        os.makedirs(os.path.join(job_dir, 'debug'))
+        for i in xrange(files):
+            with open(os.path.join(job_dir, 'debug', 'file_%d' % i), 'w') as f:
+                f.write('A' * (i % 1000))
+        job_dirs.append(job_dir)
+    return job_dirs
+
+
+def main():
+    """Main entry."""
+    options = get_parser().parse_args()
+    top_dir = tempfile.mkdtemp()
+    try:
+        job_dirs = create_jobs(os.path.join(top_dir, 'results'),
+                               options.jobs, options.files)
+        for workers in options.workers:
+            bucket_dir = os.path.join(top_dir, 'buckets_%d' % workers)
+            uploader = gs_offloader.FakeBucketUploader(bucket_dir, workers)
+            start = time.time()
+            for job_dir in job_dirs:
+                uploader.upload(job_dir, 'gs://bucket/results', sys.stdout,
+                                sys.stderr)
+                uploader.mark_finished('gs://bucket/results', sys.stdout,
+                                       sys.stderr)
+            uploader.flush()
+            duration = time.time() - start
+            print ('%d workers: uploaded %d files in %.2f seconds, %.0f '
+                   'files/second.' % (workers, options.jobs * options.files,
+                                      duration,
+                                      options.jobs * options.files / duration))
+    finally:
+        shutil.rmtree(top_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -54,6 +54,39 @@ def get_exclude_string(client_dir):
     return exclude_string
 
 
+def get_exclude_tarballs_string(pkgmgr, name, pkg_type, pkg_formats):
+    """
+    Get the exclude string for the tar command to exclude the tarballs and
+    checksums of a package in every format being built, so that none of them
+    gets repackaged into another.
+    """
+    exclude_string = ''
+    for pkg_format in pkg_formats:
+        pkg_name = pkgmgr.get_tarball_name(name, pkg_type, pkg_format)
+        exclude_string += (' --exclude="**%s" --exclude="**%s.checksum"' %
+                           (pkg_name, pkg_name))
+    return exclude_string + ' '
+
+
+def remove_other_format_packages(pkgmgr, pkg_type, pkg_names, pkg_formats):
+    """
+    Remove the packages in the formats other than pkg_formats from the
+    repositories. Hosts install the zstd package whenever the checksum file
+    lists it, so a stale one would shadow the package uploaded in bzip2.
+    """
+    names = [p.strip() for p in pkg_names.split(',')]
+    for name in names:
+        if not name:
+            continue
+        for pkg_format in packages.PACKAGE_FORMATS:
+            if pkg_format in pkg_formats:
+                continue
+            pkg_name = pkgmgr.get_tarball_name(name, pkg_type, pkg_format)
+            if pkgmgr.is_pkg_listed(pkg_name):
+                print "Removing %s, not built in this format" % pkg_name
+                pkgmgr.remove_pkg(pkg_name, remove_checksum=True)
+
+
 def parse_args():
     parser = optparse.OptionParser()
     parser.add_option("-d", "--dependency", help="package the dependency"
@@ -83,6 +116,9 @@ def parse_args():
                       "to all the repos specified in global_config.ini. "
                       "(includes the client, tests, deps and profilers)",
                       dest="all", action="store_true", default=False)
+    parser.add_option("--zstd", help="also build the packages in the zstd "
+                      "format, extracted faster by the hosts with zstd",
+                      dest="zstd", action="store_true", default=False)
 
     options, args = parser.parse_args()
     return options, args
@@ -112,12 +148,15 @@ def get_build_dir(name, dest_dir, pkg_type):
     return build_dir
 
 def process_packages(pkgmgr, pkg_type, pkg_names, src_dir,
-                     action, dest_dir=None):
+                     action, dest_dir=None,
+                     pkg_formats=(packages.PACKAGE_FORMAT_BZ2,)):
     """Method to upload or remove package depending on the flag passed to it.
 
     If tar_only is set to True, this routine is solely used to generate a
     tarball and compute the md5sum from that tarball.
     If the tar_only flag is True, then the remove flag is ignored.
+    The packages are processed in each format of pkg_formats. When uploading
+    or removing, the packages in the other formats are removed.
     """
     exclude_string = ' .'
     names = [p.strip() for p in pkg_names.split(',')]
@@ -134,67 +173,72 @@ def process_packages(pkgmgr, pkg_type, pkg_names, src_dir,
             # for the profilers and deps
             pkg_dir = os.path.join(src_dir, name)
 
-        pkg_name = pkgmgr.get_tarball_name(name, pkg_type)
-
-        exclude_string_tar = ((
-            ' --exclude="**%s" --exclude="**%s.checksum" ' %
-            (pkg_name, pkg_name)) + exclude_string)
-        if action == ACTION_TAR_ONLY:
-            # We don't want any pre-existing tarballs and checksums to
-            # be repackaged, so we should purge these.
-            build_dir = get_build_dir(name, dest_dir, pkg_type)
-            try:
-                packages.check_diskspace(build_dir)
-            except error.RepoDiskFullError as e:
-                msg = ("Work_dir directory for packages %s does not have "
-                       "enough space available: %s" % (build_dir, e))
-                raise error.RepoDiskFullError(msg)
-            tarball_path = pkgmgr.tar_package(pkg_name, pkg_dir,
-                                              build_dir, exclude_string_tar)
-
-            # Create the md5 hash too.
-            md5sum = pkgmgr.compute_checksum(tarball_path)
-            md5sum_filepath = os.path.join(build_dir, pkg_name + '.checksum')
-            with open(md5sum_filepath, "w") as f:
-                f.write(md5sum)
-
-        elif action == ACTION_UPLOAD:
-            # Tar the source and upload
-            temp_dir = tempfile.mkdtemp()
-            try:
+        exclude_string_tar = get_exclude_tarballs_string(
+                pkgmgr, name, pkg_type, pkg_formats) + exclude_string
+        for pkg_format in pkg_formats:
+            pkg_name = pkgmgr.get_tarball_name(name, pkg_type, pkg_format)
+            if action == ACTION_TAR_ONLY:
+                # We don't want any pre-existing tarballs and checksums to
+                # be repackaged, so we should purge these.
+                build_dir = get_build_dir(name, dest_dir, pkg_type)
                 try:
-                    packages.check_diskspace(temp_dir)
-                except error.RepoDiskFullError, e:
-                    msg = ("Temporary directory for packages %s does not have "
-                           "enough space available: %s" % (temp_dir, e))
+                    packages.check_diskspace(build_dir)
+                except error.RepoDiskFullError as e:
+                    msg = ("Work_dir directory for packages %s does not have "
+                           "enough space available: %s" % (build_dir, e))
                     raise error.RepoDiskFullError(msg)
-
-                # Check if tarball already exists. If it does, then don't
-                # create a tarball again.
-                tarball_path = os.path.join(pkg_dir, pkg_name);
-                if os.path.exists(tarball_path):
-                    print("process_packages: Tarball %s already exists" %
-                          tarball_path)
-                else:
-                    tarball_path = pkgmgr.tar_package(pkg_name, pkg_dir,
-                                                      temp_dir,
-                                                      exclude_string_tar)
-                # Compare the checksum with what packages.checksum has. If they
-                # match then we don't need to perform the upload.
-                if not pkgmgr.compare_checksum(tarball_path):
-                    pkgmgr.upload_pkg(tarball_path, update_checksum=True)
-                else:
-                    logging.warning('Checksum not changed for %s, not copied '
-                                    'in packages/ directory.', tarball_path)
-            finally:
-                # remove the temporary directory
-                shutil.rmtree(temp_dir)
-        elif action == ACTION_REMOVE:
-            pkgmgr.remove_pkg(pkg_name, remove_checksum=True)
+                tarball_path = pkgmgr.tar_package(pkg_name, pkg_dir,
+                                                  build_dir, exclude_string_tar)
+
+                # Create the md5 hash too.
+                md5sum = pkgmgr.compute_checksum(tarball_path)
+                md5sum_filepath = os.path.join(build_dir,
+                                               pkg_name + '.checksum')
+                with open(md5sum_filepath, "w") as f:
+                    f.write(md5sum)
+
+            elif action == ACTION_UPLOAD:
+                # Tar the source and upload
+                temp_dir = tempfile.mkdtemp()
+                try:
+                    try:
+                        packages.check_diskspace(temp_dir)
+                    except error.RepoDiskFullError, e:
+                        msg = ("Temporary directory for packages %s does "
+                               "not have enough space available: %s"
+                               % (temp_dir, e))
+                        raise error.RepoDiskFullError(msg)
+
+                    # Check if tarball already exists. If it does, then don't
+                    # create a tarball again.
+                    tarball_path = os.path.join(pkg_dir, pkg_name);
+                    if os.path.exists(tarball_path):
+                        print("process_packages: Tarball %s already exists" %
+                              tarball_path)
+                    else:
+                        tarball_path = pkgmgr.tar_package(pkg_name, pkg_dir,
+                                                          temp_dir,
+                                                          exclude_string_tar)
+                    # Compare the checksum with what packages.checksum has.
+                    # If they match then we don't need to perform the upload.
+                    if not pkgmgr.compare_checksum(tarball_path):
+                        pkgmgr.upload_pkg(tarball_path, update_checksum=True)
+                    else:
+                        logging.warning('Checksum not changed for %s, not '
+                                        'copied in packages/ directory.',
+                                        tarball_path)
+                finally:
+                    # remove the temporary directory
+                    shutil.rmtree(temp_dir)
+            elif action == ACTION_REMOVE:
+                pkgmgr.remove_pkg(pkg_name, remove_checksum=True)
+        if action in (ACTION_UPLOAD, ACTION_REMOVE):
+            remove_other_format_packages(pkgmgr, pkg_type, name, pkg_formats)
         print "Done."
 
 
-def tar_packages(pkgmgr, pkg_type, pkg_names, src_dir, temp_dir):
+def tar_packages(pkgmgr, pkg_type, pkg_names, src_dir, temp_dir,
+                 pkg_formats=(packages.PACKAGE_FORMAT_BZ2,)):
     """Tar all packages up and return a list of each tar created"""
     tarballs = []
     exclude_string = ' .'
@@ -212,26 +256,26 @@ def tar_packages(pkgmgr, pkg_type, pkg_names, src_dir, temp_dir):
             # for the profilers and deps
             pkg_dir = os.path.join(src_dir, name)
 
-        pkg_name = pkgmgr.get_tarball_name(name, pkg_type)
-
         # We don't want any pre-existing tarballs and checksums to
         # be repackaged, so we should purge these.
-        exclude_string_tar = ((
-            ' --exclude="**%s" --exclude="**%s.checksum" ' %
-            (pkg_name, pkg_name)) + exclude_string)
-        # Check if tarball already exists. If it does, don't duplicate
-        # the effort.
-        tarball_path = os.path.join(pkg_dir, pkg_name);
-        if os.path.exists(tarball_path):
-          print("tar_packages: Tarball %s already exists" % tarball_path);
-        else:
-            tarball_path = pkgmgr.tar_package(pkg_name, pkg_dir,
-                                              temp_dir, exclude_string_tar)
-        tarballs.append(tarball_path)
+        exclude_string_tar = get_exclude_tarballs_string(
+                pkgmgr, name, pkg_type, pkg_formats) + exclude_string
+        for pkg_format in pkg_formats:
+            pkg_name = pkgmgr.get_tarball_name(name, pkg_type, pkg_format)
+            # Check if tarball already exists. If it does, don't duplicate
+            # the effort.
+            tarball_path = os.path.join(pkg_dir, pkg_name);
+            if os.path.exists(tarball_path):
+              print("tar_packages: Tarball %s already exists" % tarball_path);
+            else:
+                tarball_path = pkgmgr.tar_package(pkg_name, pkg_dir,
+                                                  temp_dir, exclude_string_tar)
+            tarballs.append(tarball_path)
     return tarballs
 
 
-def process_all_packages(pkgmgr, client_dir, action):
+def process_all_packages(pkgmgr, client_dir, action,
+                         pkg_formats=(packages.PACKAGE_FORMAT_BZ2,)):
     """Process a full upload of packages as a directory upload."""
     dep_dir = os.path.join(client_dir, "deps")
     prof_dir = os.path.join(client_dir, "profilers")
@@ -265,26 +309,34 @@ def process_all_packages(pkgmgr, client_dir, action):
     if action == ACTION_UPLOAD:
         all_packages = []
         all_packages.extend(tar_packages(pkgmgr, 'profiler', profilers,
-                                         prof_dir, temp_dir))
+                                         prof_dir, temp_dir, pkg_formats))
         all_packages.extend(tar_packages(pkgmgr, 'dep', deps, dep_dir,
-                                         temp_dir))
+                                         temp_dir, pkg_formats))
         all_packages.extend(tar_packages(pkgmgr, 'test', site_tests,
-                                         client_dir, temp_dir))
+                                         client_dir, temp_dir, pkg_formats))
         all_packages.extend(tar_packages(pkgmgr, 'test', tests, client_dir,
-                                         temp_dir))
+                                         temp_dir, pkg_formats))
         all_packages.extend(tar_packages(pkgmgr, 'client', 'autotest',
-                                         client_dir, temp_dir))
+                                         client_dir, temp_dir, pkg_formats))
         for package in all_packages:
             pkgmgr.upload_pkg(package, update_checksum=True)
+        for pkg_type, pkg_names in (('profiler', profilers), ('dep', deps),
+                                    ('test', site_tests), ('test', tests),
+                                    ('client', 'autotest')):
+            remove_other_format_packages(pkgmgr, pkg_type, pkg_names,
+                                         pkg_formats)
         client_utils.run('rm -rf ' + temp_dir)
     elif action == ACTION_REMOVE:
-        process_packages(pkgmgr, 'test', tests, client_dir, action=action)
-        process_packages(pkgmgr, 'test', site_tests, client_dir, action=action)
+        process_packages(pkgmgr, 'test', tests, client_dir, action=action,
+                         pkg_formats=pkg_formats)
+        process_packages(pkgmgr, 'test', site_tests, client_dir, action=action,
+                         pkg_formats=pkg_formats)
         process_packages(pkgmgr, 'client', 'autotest', client_dir,
-                         action=action)
-        process_packages(pkgmgr, 'dep', deps, dep_dir, action=action)
+                         action=action, pkg_formats=pkg_formats)
+        process_packages(pkgmgr, 'dep', deps, dep_dir, action=action,
+                         pkg_formats=pkg_formats)
         process_packages(pkgmgr, 'profiler', profilers, prof_dir,
-                         action=action)
+                         action=action, pkg_formats=pkg_formats)
 
 
 # Get the list of sub directories present in a directory
@@ -362,24 +414,32 @@ def main():
                                      upload_paths=upload_paths,
                                      run_function_dargs={'timeout':600})
 
+    pkg_formats = [packages.PACKAGE_FORMAT_BZ2]
+    if options.zstd:
+        pkg_formats.append(packages.PACKAGE_FORMAT_ZSTD)
+
     if options.all:
-        process_all_packages(pkgmgr, client_dir, action=cur_action)
+        process_all_packages(pkgmgr, client_dir, action=cur_action,
+                             pkg_formats=pkg_formats)
 
     if options.client:
         process_packages(pkgmgr, 'client', 'autotest', client_dir,
-                         action=cur_action)
+                         action=cur_action, pkg_formats=pkg_formats)
 
     if options.dep:
         process_packages(pkgmgr, 'dep', options.dep, dep_dir,
-                         action=cur_action, dest_dir=options.output_dir)
+                         action=cur_action, dest_dir=options.output_dir,
+                         pkg_formats=pkg_formats)
 
     if options.test:
         process_packages(pkgmgr, 'test', options.test, client_dir,
-                         action=cur_action, dest_dir=options.output_dir)
+                         action=cur_action, dest_dir=options.output_dir,
+                         pkg_formats=pkg_formats)
 
     if options.prof:
         process_packages(pkgmgr, 'profiler', options.prof, prof_dir,
-                         action=cur_action, dest_dir=options.output_dir)
+                         action=cur_action, dest_dir=options.output_dir,
+                         pkg_formats=pkg_formats)
 
     if options.file:
         if cur_action == ACTION_REMOVE:
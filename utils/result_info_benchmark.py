@@ -0,0 +1,64 @@
+#!/usr/bin/python2
+
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Benchmark building the result directory summary on a synthetic tree."""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import common
+from autotest_lib.client.bin.result_tools import result_info
+
+
+def get_parser():
+    """Creates the argparse parser."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=200000,
+                        help='Number of files in the synthetic tree.')
+    parser.add_argument('--files_per_dir', type=int, default=500,
+                        help='Number of files in each directory.')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Number of times to build the summary.')
+    return parser
+
+
+def create_tree(top_dir, files, files_per_dir):
+    """Create a synthetic result tree.
+
+    @param top_dir: Directory to create the tree in.
+    @param files: Number of files to create.
+    @param files_per_dir: Number of files in each directory.
+    """
+    for i in xrange(files):
+        dir_path = os.path.join(top_dir, 'dir_%d' % (i / files_per_dir))
+        if i % files_per_dir == 0:
+            os.mkdir(dir_path)
+        with open(os.path.join(dir_path, 'file_%d' % i), 'w') as f:
+            f.write('A' * (i % 100))
+
+
+def main():
+    """Main entry."""
+    options = get_parser().parse_args()
+    top_dir = tempfile.mkdtemp()
+    try:
+        create_tree(top_dir, options.files, options.files_per_dir)
+        for run in xrange(options.runs):
+            start = time.time()
+            summary = result_info.ResultInfo.build_from_path(top_dir)
+            duration = time.time() - start
+            print ('Run %d: built summary of %d bytes for %d files in %.2f '
+                   'seconds.' % (run, summary.original_size, options.files,
+                                 duration))
+    finally:
+        shutil.rmtree(top_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/python2
+
+# Copyright 2017 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Benchmark shard heartbeats on the master with an in-memory database.
+
+Each shard first fetches its hosts, then sends heartbeats reporting the
+hosts it knows, with a fraction of them changing status in between.
+"""
+
+import argparse
+import random
+import time
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.frontend.afe import models
+from autotest_lib.frontend.afe import rpc_interface
+from django.db import connection
+
+
+def get_parser():
+    """Creates the argparse parser."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', type=int, default=20,
+                        help='Number of shards.')
+    parser.add_argument('--hosts_per_shard', type=int, default=500,
+                        help='Number of hosts of each shard.')
+    parser.add_argument('--changed_fraction', type=float, default=0.1,
+                        help='Fraction of the hosts changing status between '
+                             'heartbeats.')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Number of heartbeats of each shard after the '
+                             'first one.')
+    return parser
+
+
+def create_shards(shards, hosts_per_shard):
+    """Create shards, each with a board label and hosts of that board.
+
+    @param shards: Number of shards.
+    @param hosts_per_shard: Number of hosts of each shard.
+
+    @returns A list of shard hostnames.
+    """
+    shard_hostnames = []
+    for i in xrange(shards):
+        label = models.Label.objects.create(name='board:board%d' % i)
+        shard = models.Shard.objects.create(hostname='shard%d' % i)
+        shard.labels.add(label)
+        for j in xrange(hosts_per_shard):
+            host = models.Host.objects.create(
+                    hostname='board%d-host%d' % (i, j), leased=False)
+            host.labels.add(label)
+        shard_hostnames.append(shard.hostname)
+    return shard_hostnames
+
+
+def heartbeat_all(shard_hostnames, known_hosts):
+    """Send a heartbeat from each shard.
+
+    @param shard_hostnames: List of shard hostnames.
+    @param known_hosts: Dictionary mapping each shard hostname to a
+                        dictionary of the host ids it knows to their
+                        statuses.  Updated with the hosts sent.
+
+    @returns A tuple of (seconds, number of queries, number of hosts sent).
+    """
+    connection.use_debug_cursor = True
+    queries_before = len(connection.queries)
+    hosts_sent = 0
+    start = time.time()
+    for shard_hostname in shard_hostnames:
+        statuses = known_hosts[shard_hostname]
+        host_ids = statuses.keys()
+        response = rpc_interface.shard_heartbeat(
+                shard_hostname, known_host_ids=host_ids,
+                known_host_statuses=[statuses[i] for i in host_ids])
+        for host in response['hosts']:
+            statuses[host['id']] = host['status']
+        hosts_sent += len(response['hosts'])
+    duration = time.time() - start
+    queries = len(connection.queries) - queries_before
+    connection.use_debug_cursor = None
+    return duration, queries, hosts_sent
+
+
+def change_statuses(known_hosts, changed_fraction):
+    """Change the status of a fraction of the hosts known by the shards.
+
+    @param known_hosts: Same as in heartbeat_all.
+    @param changed_fraction: Fraction of the hosts to change.
+    """
+    for statuses in known_hosts.itervalues():
+        for host_id in random.sample(statuses.keys(),
+                                     int(len(statuses) * changed_fraction)):
+            statuses[host_id] = random.choice(models.Host.Status.names)
+
+
+def main():
+    """Main entry."""
+    options = get_parser().parse_args()
+    setup_test_environment.set_up()
+    global_config.global_config.override_config_value(
+            'SERVER', 'rpc_logging', 'False')
+    try:
+        shard_hostnames = create_shards(options.shards,
+                                        options.hosts_per_shard)
+        known_hosts = dict((hostname, {}) for hostname in shard_hostnames)
+        print ('First heartbeats: %.2f seconds, %d queries, %d hosts sent.'
+               % heartbeat_all(shard_hostnames, known_hosts))
+        for run in xrange(options.runs):
+            change_statuses(known_hosts, options.changed_fraction)
+            print ('Run %d: %.2f seconds, %d queries, %d hosts sent.'
+                   % ((run,) + heartbeat_all(shard_hostnames, known_hosts)))
+    finally:
+        setup_test_environment.tear_down()
+
+
+if __name__ == '__main__':
+    main()